@@ -9,6 +9,16 @@ from .models import db
 # by importing controllers you expose the actions defined in it
 from . import controllers
 
+# versioned JSON API (api/v1/...)
+from . import api
+
+# without celery the periodic tasks run in a thread of this process
+from .common import settings, scheduler
+from . import tasks
+
+if not settings.USE_CELERY:
+    scheduler.start()
+
 # optional parameters
 __version__ = "0.0.0"
 __author__ = "you <you@example.com>"
@@ -0,0 +1,174 @@
+"""
+Time-series analytics for the report charts.
+
+Series are summed in SQL from the daily_product_movement rollup, bucketed
+by day or month with an engine specific date expression, plus the tail of
+lines the rollup has not folded in yet (bucketed the same way). Weeks are
+ISO 8601 weeks ('2024-W01', Monday to Sunday, week 1 holds the first
+Thursday) on every engine: SQLite has no ISO week format, so they are
+summed per day in SQL and folded into weeks in Python.
+Results are cached per (range, bucket, grouping) and stay valid until an
+invoice line, product or category is written (see versions.py).
+"""
+import datetime
+
+from pydal.objects import Expression
+
+from .common import db
+from . import rollup, versions, counters
+from .caching import VersionedLRU
+from .dbutils import engine
+from .reports import movement_report
+
+BUCKETS = ('day', 'week', 'month')
+GROUPS = ('product', 'category', 'all')
+
+cache = VersionedLRU(size=256)
+
+_FORMATS = {
+    'sqlite': {'month': "strftime('%%Y-%%m', %s)"},
+    'mysql': {'month': "DATE_FORMAT(%s, '%%Y-%%m')"},
+    'postgres': {'month': "to_char(%s, 'YYYY-MM')"},
+}
+
+
+# ISO 8601 week label of a date or YYYY-MM-DD string, e.g. '2024-W01'
+def week_label(day):
+    if not isinstance(day, datetime.date):
+        day = datetime.date.fromisoformat(str(day)[:10])
+    year, week, _ = day.isocalendar()
+    return '%d-W%02d' % (year, week)
+
+
+# SQL expression of the bucket label of a date column (the day for weeks,
+# see week_label())
+def bucket_expression(column, bucket):
+    if bucket in ('day', 'week'):
+        return column
+    formats = _FORMATS.get(engine(), _FORMATS['sqlite'])
+    sql = formats[bucket] % ('%s.%s' % (column.table._rname, column._rname))
+    return Expression(db, sql, type='string')
+
+
+def _group_fields(group):
+    if group == 'category':
+        return [db.categories.id, db.categories.name]
+    if group == 'product':
+        return [db.product.id, db.product.product_code, db.product.description]
+    return []
+
+
+def _group_query(query, group):
+    if group == 'category':
+        query &= db.product.categories_id == db.categories.id
+    return query
+
+
+def _key(row, group):
+    if group == 'category':
+        return row.categories.id, dict(id=row.categories.id, code='', name=row.categories.name)
+    if group == 'product':
+        return row.product.id, dict(id=row.product.id, code=row.product.product_code,
+                                    name=row.product.description)
+    return 0, dict(id=0, code='', name='All products')
+
+
+def _range(column, from_date, to_date):
+    query = column != None
+    if from_date:
+        query &= column >= from_date
+    if to_date:
+        query &= column <= to_date
+    return query
+
+
+# (label, group row, import quantity, export quantity) from the rollup
+def _rolled_up(from_date, to_date, bucket, group, ids):
+    movement = db.daily_product_movement
+    label = bucket_expression(movement.date, bucket)
+    qty_in, qty_out = movement.qty_in.sum(), movement.qty_out.sum()
+    query = _group_query(_range(movement.date, from_date, to_date)
+                         & (movement.product_id == db.product.id), group)
+    if ids:
+        query &= (db.categories.id if group == 'category' else db.product.id).belongs(ids)
+    fields = [label] + _group_fields(group)
+    for row in db(query).select(*(fields + [qty_in, qty_out]), groupby=fields):
+        yield row[label], row, row[qty_in] or 0, row[qty_out] or 0
+
+
+# (label, group row, import quantity, export quantity) from the lines not rolled up yet
+def _tail(from_date, to_date, bucket, group, ids):
+    marks = rollup.high_water()
+    sides = ((db.input_invoice, db.input_invoice_details, 'input_invoice_id', 0),
+             (db.output_invoice, db.output_invoice_details, 'output_invoice_id', 1))
+    for header, details, invoice_field, side in sides:
+        label = bucket_expression(header.created_at, bucket)
+        quantity = details.quantity.sum()
+        query = _group_query(_range(header.created_at, from_date, to_date)
+                             & (details.id > marks[details._tablename])
+                             & (details[invoice_field] == header.id)
+                             & (details.product_id == db.product.id), group)
+        if ids:
+            query &= (db.categories.id if group == 'category' else db.product.id).belongs(ids)
+        fields = [label] + _group_fields(group)
+        for row in db(query).select(*(fields + [quantity]), groupby=fields):
+            value = row[quantity] or 0
+            yield (row[label], row, value, 0) if side == 0 else (row[label], row, 0, value)
+
+
+def _series(from_date, to_date, bucket, group, ids):
+    cells = {}
+    info = {}
+    labels = set()
+    for parts in (_rolled_up(from_date, to_date, bucket, group, ids),
+                  _tail(from_date, to_date, bucket, group, ids)):
+        for label, row, qty_in, qty_out in parts:
+            label = week_label(label) if bucket == 'week' else str(label)
+            key, meta = _key(row, group)
+            info.setdefault(key, meta)
+            labels.add(label)
+            cell = cells.setdefault((key, label), [0, 0])
+            cell[0] += qty_in
+            cell[1] += qty_out
+    labels = sorted(labels)
+    series = []
+    for key in sorted(info):
+        entry = dict(info[key])
+        entry['import'] = [cells.get((key, label), (0, 0))[0] for label in labels]
+        entry['export'] = [cells.get((key, label), (0, 0))[1] for label in labels]
+        series.append(entry)
+    return dict(bucket=bucket, group=group, labels=labels, series=series)
+
+
+# Versions the analytics depend on: invoice lines, products and categories
+def _data_version():
+    names = [counters.version_name(db.input_invoice_details),
+             counters.version_name(db.output_invoice_details), 'catalog']
+    current = versions.current_many(names)
+    return tuple(current.get(name, 0) for name in names)
+
+
+# Import/export series bucketed by day, week or month, per product, per
+# category or for the whole store; ids restricts the products / categories
+def series(from_date=None, to_date=None, bucket='day', group='all', ids=None):
+    if bucket not in BUCKETS or group not in GROUPS:
+        raise ValueError('unknown bucket or group')
+    ids = sorted(set(int(i) for i in ids or []))
+    key = ('series', from_date, to_date, bucket, group, tuple(ids))
+    return cache.get(key, _data_version(),
+                     lambda: _series(from_date, to_date, bucket, group, ids))
+
+
+# Top n products (or categories) by imported, exported or total moved quantity
+def top_movers(from_date=None, to_date=None, n=10, by='export', group='product'):
+    if by not in ('import', 'export', 'total') or group not in ('product', 'category'):
+        raise ValueError('unknown ordering or group')
+
+    def compute():
+        report = movement_report(from_date, to_date, by_category=group == 'category')
+        weight = (lambda line: line['import'] + line['export']) if by == 'total' \
+            else (lambda line: line[by])
+        return sorted(report, key=weight, reverse=True)[:n]
+
+    key = ('top', from_date, to_date, n, by, group)
+    return cache.get(key, _data_version(), compute)
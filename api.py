@@ -0,0 +1,216 @@
+"""
+Versioned JSON API (api/v1) over products, categories and invoices.
+
+    GET api/v1/<resource>                 one page, ?cursor=&limit= (newest first)
+    GET api/v1/<resource>?ids=1,2,3       batch fetch by id
+    GET api/v1/<resource>/<id>            one row
+    GET api/v1/<invoices>/<id>/lines      the lines of one invoice, ?cursor=&limit=
+
+resource is products, categories, import_invoices or export_invoices.
+?fields=a,b selects the returned fields (id is always included). Invoice
+lists also take ?from=&to=&order=id|created_at, products ?category_id=.
+
+Every response carries an ETag built from the version counters of what it
+returns (per row for single rows, batches and invoice lines, per table for
+pages, see versions.py). The counters are read first, so a request with a
+matching If-None-Match gets 304 Not Modified after that single query.
+"""
+import hashlib
+
+from py4web import action, request, response, abort
+
+from .common import db, auth, replica
+from .metrics import metrics
+from .pagination import keyset_page, page_params, date_filter
+from . import versions, counters, archive
+
+PREFIX = 'api/v1'
+MAX_IDS = 200
+
+# resource: (table name, exposed fields)
+RESOURCES = {
+    'products': ('product', ('id', 'product_code', 'description', 'unit', 'category_id',
+                             'category', 'created_at')),
+    'categories': ('categories', ('id', 'name')),
+    'import_invoices': ('input_invoice', ('id', 'name', 'customer_name', 'customer_address',
+                                          'created_at', 'total_amount', 'line_count')),
+    'export_invoices': ('output_invoice', ('id', 'name', 'customer_name', 'customer_address',
+                                           'created_at', 'total_amount', 'line_count')),
+}
+LINE_FIELDS = ('id', 'product_id', 'product_code', 'quantity', 'unit_price', 'total_price')
+LINES = ('import_invoices', 'export_invoices')
+
+
+def _resource(name):
+    if name not in RESOURCES:
+        abort(404)
+    tablename, fields = RESOURCES[name]
+    return db[tablename], fields
+
+
+# Requested fields (?fields=), id first
+def _fields(allowed):
+    requested = [f.strip() for f in (request.params.get('fields') or '').split(',') if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        abort(400, 'unknown field(s): %s' % ', '.join(unknown))
+    return ['id'] + [f for f in (requested or allowed) if f != 'id']
+
+
+def _ids():
+    try:
+        ids = sorted(set(int(i) for i in (request.params.get('ids') or '').split(',') if i.strip()))
+    except ValueError:
+        abort(400, 'ids must be integers')
+    if len(ids) > MAX_IDS:
+        abort(400, 'at most %s ids' % MAX_IDS)
+    return ids
+
+
+# Answer 304 if the client's ETag matches the versions, else set the ETag
+def _not_modified(names):
+    current = versions.current_many(names)
+    params = sorted((k, str(v)) for k, v in request.query.items())
+    digest = hashlib.sha1(repr((request.path, params, [current.get(n, 0) for n in names]))
+                          .encode()).hexdigest()[:24]
+    etag = '"%s"' % digest
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    sent = request.headers.get('If-None-Match') or ''
+    if etag in [tag.strip().replace('W/', '', 1) for tag in sent.split(',')] or sent.strip() == '*':
+        response.status = 304
+        return True
+    return False
+
+
+# DAL fields to select for the exposed fields, and the row -> dict function
+def _select(table, names):
+    if table._tablename == 'product':
+        # the category comes from a join: product.categories_id has a filter_out
+        # that would load each category with one query per row
+        columns = [table[n] for n in names if n not in ('category_id', 'category')]
+        columns += [db.categories.id, db.categories.name]
+        left = db.categories.on(db.categories.id == table.categories_id)
+
+        def record(row):
+            values = row.product.as_dict()
+            values.update(category_id=row.categories.id, category=row.categories.name)
+            return {n: values.get(n) for n in names}
+
+        return columns, left, record
+    columns = [table[n] for n in names]
+    return columns, None, lambda row: {n: row[n] for n in names}
+
+
+def _versions(table, ids=None):
+    names = ['categories'] if table._tablename in ('product', 'categories') else []
+    if table._tablename == 'categories':
+        return names
+    if ids is None:
+        names.append(counters.version_name(table))
+        if table._tablename in ('input_invoice', 'output_invoice'):
+            # the header totals change with the lines, see counters.track
+            names.append(counters.version_name(archive.details_of(table)[0]))
+        return names
+    return names + [versions.row_name(table, i) for i in ids]
+
+
+def _filter(name, table):
+    if name == 'products':
+        category_id = request.params.get('category_id')
+        if category_id:
+            if not str(category_id).isdigit():
+                abort(400, 'category_id must be an integer')
+            return table.categories_id == int(category_id)
+        return table.id > 0
+    if name == 'categories':
+        return table.id > 0
+    return date_filter(table, request.params.get('from'), request.params.get('to'))
+
+
+# One page, or a batch with ?ids=
+@action(PREFIX + '/<name>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def api_list(name):
+    table, allowed = _resource(name)
+    names = _fields(allowed)
+    ids = _ids()
+    if _not_modified(_versions(table, ids or None)):
+        return ''
+    columns, left, record = _select(table, names)
+    if ids:
+        rows = db(table.id.belongs(ids)).select(*columns, left=left, orderby=table.id)
+        return dict(items=[record(row) for row in rows])
+    paging = page_params(request.params)
+    if paging['order'] == 'created_at' and 'created_at' not in table.fields:
+        abort(400, 'unknown order')
+    rows, next_cursor = _keyset(table, _filter(name, table), columns, left, paging)
+    return dict(items=[record(row) for row in rows], next=next_cursor)
+
+
+def _keyset(table, query, columns, left, paging):
+    if left is None:
+        if paging['order'] == 'created_at' and 'created_at' not in [c.name for c in columns]:
+            columns = columns + [table.created_at]
+        return keyset_page(table, query, fields=columns, **paging)
+    # keyset_page has no join: select the page ids, then the joined rows
+    id_rows, next_cursor = keyset_page(
+        table, query, fields=[table.id, table.created_at] if paging['order'] == 'created_at'
+        else [table.id], **paging)
+    ids = [row.id for row in id_rows]
+    rows = db(table.id.belongs(ids)).select(*columns, left=left) if ids else []
+    by_id = {row[table.id]: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id], next_cursor
+
+
+# One row
+@action(PREFIX + '/<name>/<row_id:int>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def api_item(name, row_id):
+    table, allowed = _resource(name)
+    names = _fields(allowed)
+    if _not_modified(_versions(table, [row_id])):
+        return ''
+    columns, left, record = _select(table, names)
+    row = db(table.id == row_id).select(*columns, left=left, limitby=(0, 1)).first()
+    if row is None and name in LINES:
+        # not hot: the invoice may have been archived
+        cold = archive.archive_table(table)
+        row = db(cold.id == row_id).select(*[cold[n] for n in names], limitby=(0, 1)).first()
+    if row is None:
+        abort(404)
+    return dict(item=record(row))
+
+
+# The lines of one invoice, newest first, with the product code
+@action(PREFIX + '/<name>/<invoice_id:int>/lines', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def api_lines(name, invoice_id):
+    if name not in LINES:
+        abort(404)
+    header, _ = _resource(name)
+    names = _fields(LINE_FIELDS)
+    # lines bump their invoice (header totals), products bump 'catalog'
+    if _not_modified([versions.row_name(header, invoice_id), 'catalog']):
+        return ''
+    if db(header.id == invoice_id).isempty():
+        # archived invoices are read from the archive, absent ones are 404
+        header = archive.archive_table(header)
+        if db(header.id == invoice_id).isempty():
+            abort(404)
+    details, invoice_field = archive.details_of(header)
+    columns = [details[n] for n in names if n != 'product_code'] + [db.product.product_code]
+    paging = page_params(request.params, order='id')
+    rows, next_cursor = keyset_page(details, details[invoice_field] == invoice_id,
+                                    fields=[details.id], **paging)
+    ids = [row.id for row in rows]
+    items = []
+    if ids:
+        joined = db(details.id.belongs(ids)).select(
+            *columns, left=db.product.on(db.product.id == details.product_id),
+            orderby=~details.id)
+        for row in joined:
+            values = row[details._tablename].as_dict()
+            values['product_code'] = row.product.product_code
+            items.append({n: values.get(n) for n in names})
+    return dict(items=items, next=next_cursor)
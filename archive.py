@@ -0,0 +1,117 @@
+"""
+Hot/cold archival of old invoices.
+
+archive() moves the invoices created before a cutoff, with their lines, from
+output_invoice / input_invoice and their detail tables into the *_archive
+tables (same ids), batch by batch, one transaction per batch. The moves are
+plain INSERT ... SELECT and DELETE statements: no DAL callback runs, so the
+stock ledger, the invoice totals and the daily movement rollup are left as
+they are, since archiving sells or buys nothing. Only invoices whose lines
+are all folded into the rollup are moved (the rollup is run first), so the
+reports, which read the rollup plus the recent hot lines, never need the
+archive.
+
+Readers use the archive only when they need it:
+- find() looks an invoice id up in the hot table, then in the archive;
+- header_tables() adds the archive to a date range that reaches before the
+  newest archived invoice;
+- stock.expected() counts the archived lines.
+"""
+import datetime
+
+from .common import db, settings
+from . import rollup, versions, counters
+
+SUFFIX = '_archive'
+BATCH = 500
+
+# hot header, hot details, invoice field
+SIDES = (('output_invoice', 'output_invoice_details', 'output_invoice_id'),
+         ('input_invoice', 'input_invoice_details', 'input_invoice_id'))
+
+
+def archive_table(table):
+    return db[table._tablename + SUFFIX]
+
+
+# The details table and invoice field of a hot or archived header table
+def details_of(header):
+    for header_name, details_name, invoice_field in SIDES:
+        if header._tablename in (header_name, header_name + SUFFIX):
+            suffix = header._tablename[len(header_name):]
+            return db[details_name + suffix], invoice_field
+    raise ValueError('not an invoice table: %s' % header._tablename)
+
+
+# Default cutoff: ARCHIVE_AFTER_DAYS days ago, as YYYY-MM-DD
+def default_cutoff():
+    return str(datetime.date.today() - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS))
+
+
+# (header rows, header table, details table) of invoice_id of the hot header
+# table; the archive is only read when the invoice is not hot
+def find(header, invoice_id):
+    for table in (header, archive_table(header)):
+        rows = db(table.id == invoice_id).select()
+        if rows:
+            return rows, table, details_of(table)[0]
+    return rows, header, details_of(header)[0]
+
+
+def newest_archived(header):
+    created_at = archive_table(header).created_at
+    return db(created_at != None).select(created_at.max()).first()[created_at.max()]
+
+
+# Header tables to read for invoices created between from_date and to_date:
+# the archive (older ids first) only when the range reaches into it
+def header_tables(header, from_date=None, to_date=None):
+    newest = newest_archived(header)
+    if newest and (not from_date or str(from_date) <= str(newest)):
+        return [archive_table(header), header]
+    return [header]
+
+
+def _copy(source, target, query):
+    names = [name for name in target.fields]
+    select = db(query)._select(*[source[name] for name in names]).rstrip().rstrip(';')
+    db.executesql('INSERT INTO %s (%s) %s;' % (
+        target._rname, ', '.join(target[name]._rname for name in names), select))
+
+
+# Move the invoices of one side created before cutoff, returns how many
+def archive_side(header, details, invoice_field, cutoff, batch=BATCH, progress=None):
+    cold_header, cold_details = archive_table(header), archive_table(details)
+    mark = rollup.high_water()[details._tablename]
+    # invoices with a line the rollup has not folded in yet stay hot for now
+    unfolded = db(details.id > mark)._select(details[invoice_field], distinct=True)
+    moved, last_id = 0, 0
+    while True:
+        ids = [row.id for row in db((header.created_at < cutoff) & (header.id > last_id)
+                                    & ~header.id.belongs(unfolded)).select(
+            header.id, orderby=header.id, limitby=(0, batch))]
+        if not ids:
+            return moved
+        _copy(header, cold_header, header.id.belongs(ids))
+        _copy(details, cold_details, details[invoice_field].belongs(ids))
+        # lines first: deleting the headers first would cascade to them
+        db.executesql(db(details[invoice_field].belongs(ids))._delete())
+        db.executesql(db(header.id.belongs(ids))._delete())
+        for table in (header, details, cold_header, cold_details):
+            versions.bump(counters.version_name(table))
+        # cached pages, PDFs and ETags of these invoices show them as editable
+        for invoice_id in ids:
+            versions.bump(versions.row_name(header, invoice_id))
+        db.commit()
+        moved += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(header._tablename, moved)
+
+
+# Archive both sides, returns {header table: invoices moved}
+def archive(cutoff=None, batch=BATCH, progress=None):
+    cutoff = str(cutoff or default_cutoff())
+    rollup.run()
+    return {header: archive_side(db[header], db[details], invoice_field, cutoff, batch, progress)
+            for header, details, invoice_field in SIDES}
@@ -0,0 +1,19 @@
+"""
+Synthetic data generator and per-action benchmarks.
+
+Run them from the folder that contains the py4web "apps" folder, against a
+SQLite database of their own (INVENTORY_DB_URI replaces settings.DB_URI):
+
+    export INVENTORY_DB_URI=sqlite://bench.sqlite
+    python -m apps.{appname}.benchmarks seed --products 10000 --categories 200 --lines 1000000
+    python -m apps.{appname}.benchmarks run --repeat 50 --output before.json
+    python -m apps.{appname}.benchmarks run --repeat 50 --compare before.json
+    python -m apps.{appname}.benchmarks contention --writers 16 --attempts 50 --stock 500
+
+seed fills the tables defined in models.py (see seed.py); run calls the
+controller functions directly and reports latency percentiles, query count
+and peak memory per action (see runner.py); contention checks the export
+stock reservation under concurrent writers (see contention.py). The same
+seed arguments always produce the same data, so result files of different
+commits are comparable.
+"""
@@ -0,0 +1,82 @@
+import argparse
+import datetime
+
+from ..common import db, settings, scheduler
+from . import seed as seeding, runner, contention as contending
+
+
+def seed(args):
+    if args.reset:
+        seeding.reset()
+    counts = seeding.seed(products=args.products, categories=args.categories, lines=args.lines,
+                          lines_per_invoice=args.lines_per_invoice, days=args.days,
+                          end=datetime.date.fromisoformat(args.end), seed=args.seed)
+    for name, count in counts.items():
+        print("%-24s %s" % (name, count))
+
+
+def run(args):
+    report = runner.run(repeat=args.repeat, warmup=args.warmup, render=args.render,
+                        only=args.only, seed=args.seed)
+    baseline = runner.load(args.compare) if args.compare else None
+    print(runner.format_report(report, baseline))
+    if args.output:
+        runner.save(report, args.output)
+
+
+
+def contention(args):
+    result = contending.run(writers=args.writers, attempts=args.attempts, units=args.stock,
+                            keep=args.keep)
+    for name, value in result.items():
+        print("%-22s %s" % (name, value))
+    if not result["ok"]:
+        raise SystemExit("stock check failed: oversold or lost updates")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inventory benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("seed", help="fill the database with synthetic data")
+    cmd.add_argument("--products", type=int, default=10000)
+    cmd.add_argument("--categories", type=int, default=200)
+    cmd.add_argument("--lines", type=int, default=1000000, help="invoice lines, about")
+    cmd.add_argument("--lines-per-invoice", type=int, default=20)
+    cmd.add_argument("--days", type=int, default=365, help="days of invoices before --end")
+    cmd.add_argument("--end", default="2024-12-31")
+    cmd.add_argument("--seed", type=int, default=1)
+    cmd.add_argument("--reset", action="store_true", help="empty the tables first")
+    cmd.set_defaults(func=seed)
+
+    cmd = commands.add_parser("run", help="time the controller actions")
+    cmd.add_argument("--repeat", type=int, default=20)
+    cmd.add_argument("--warmup", type=int, default=2)
+    cmd.add_argument("--render", action="store_true", help="also render the templates")
+    cmd.add_argument("--only", nargs="*", default=[], help="case name prefixes")
+    cmd.add_argument("--seed", type=int, default=1, help="seed of the sampled invoice ids")
+    cmd.add_argument("--output", help="write the results to this JSON file")
+    cmd.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    cmd.set_defaults(func=run)
+
+    cmd = commands.add_parser("contention", help="concurrent export lines on one product")
+    cmd.add_argument("--writers", type=int, default=16, help="concurrent threads")
+    cmd.add_argument("--attempts", type=int, default=50, help="lines per thread")
+    cmd.add_argument("--stock", type=int, default=500, help="units in stock at the start")
+    cmd.add_argument("--keep", action="store_true", help="keep the benchmark rows")
+    cmd.set_defaults(func=contention)
+
+    args = parser.parse_args(argv)
+    # keep the rollup thread from running in the middle of a measurement
+    if not settings.USE_CELERY:
+        scheduler.stop()
+    try:
+        args.func(args)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+if __name__ == "__main__":
+    main()
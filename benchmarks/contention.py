@@ -0,0 +1,83 @@
+"""
+Contention benchmark of the export line stock reservation.
+
+writers threads each bill one unit of the same product per transaction
+(stock.reserve then insert, as post_invoice does) until they made their
+attempts. With stock units in stock at the start, the run is correct when
+the lines committed never exceed the stock and the ledger ends at exactly
+stock - committed lines: anything else is an oversell or a lost update.
+"""
+import threading
+import time
+
+from ..common import db
+from .. import stock
+
+SEED_USER = 'bench@example.com'
+
+
+def _setup(units):
+    product_id = db.product.insert(product_code='CONTENTION-%d' % int(time.time() * 1000),
+                                   description='contention benchmark', unit='pcs',
+                                   created_by=SEED_USER)
+    restock = db.input_invoice.insert(name='contention restock')
+    db.input_invoice_details.insert(input_invoice_id=restock, product_id=product_id,
+                                    quantity=units, unit_price=1)
+    invoice_id = db.output_invoice.insert(name='contention')
+    db.commit()
+    return product_id, restock, invoice_id
+
+
+def _writer(product_id, invoice_id, attempts, totals, lock):
+    counts = dict(committed=0, out_of_stock=0, conflicts=0, retries=0)
+    db._adapter.reconnect()
+    try:
+        for _ in range(attempts):
+            try:
+                stock.reserve(product_id, 1, stats=counts)
+                db.output_invoice_details.insert(output_invoice_id=invoice_id,
+                                                 product_id=product_id, quantity=1, unit_price=1)
+                db.commit()
+                counts['committed'] += 1
+            except stock.OutOfStock:
+                db.rollback()
+                counts['out_of_stock'] += 1
+            except stock.ReservationConflict:
+                db.rollback()
+                counts['conflicts'] += 1
+    finally:
+        db._adapter.close()
+        with lock:
+            for name, value in counts.items():
+                totals[name] = totals.get(name, 0) + value
+
+
+# Run the benchmark, returns its counters and the consistency check
+def run(writers=16, attempts=50, units=500, keep=False):
+    product_id, restock, invoice_id = _setup(units)
+    totals, lock = {}, threading.Lock()
+    threads = [threading.Thread(target=_writer, args=(product_id, invoice_id, attempts, totals, lock))
+               for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db._adapter.reconnect()
+    lines = db(db.output_invoice_details.output_invoice_id == invoice_id).count()
+    left = stock.on_hand(product_id)
+    result = dict(writers=writers, attempts=writers * attempts, units=units, seconds=round(elapsed, 3),
+                  committed_per_second=round(totals.get('committed', 0) / elapsed, 1),
+                  lines=lines, stock_left=left, **totals)
+    result['oversold'] = max(0, lines - units)
+    result['lost_updates'] = (units - lines) - left
+    result['ok'] = result['oversold'] == 0 and result['lost_updates'] == 0 \
+        and lines == totals.get('committed', 0)
+    if not keep:
+        db(db.output_invoice.id == invoice_id).delete()
+        db(db.input_invoice.id == restock).delete()
+        db(db.product.id == product_id).delete()
+    db.commit()
+    return result
@@ -0,0 +1,284 @@
+"""
+Per-action benchmarks.
+
+Each case calls a controller function directly, unwrapped from its
+action.uses fixtures (no session, no auth redirect), with a bound request
+carrying the case's method and parameters. Writes are rolled back after
+every call so all iterations and all commits see the same data.
+
+For every case the report holds the latency percentiles of repeat calls
+(after warmup calls), the number of SQL statements of one call (counted by
+a pydal execution handler) and the peak Python memory of one call (measured
+in a separate call, tracemalloc slows the timed ones down otherwise).
+"""
+import datetime
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from pydal.helpers.classes import ExecutionHandler
+from py4web import URL
+from py4web.core import bottle, HTTP, HELPERS, render as render_file
+
+from ..common import db, settings
+from .. import controllers
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# Counts the statements executed through the DAL while installed
+class QueryProbe:
+
+    def __init__(self):
+        self.queries = 0
+        probe = self
+
+        class Handler(ExecutionHandler):
+            def before_execute(self, command):
+                probe.queries += 1
+
+        self.handler = Handler
+
+    # the adapter copies db.execution_handlers when it is created, so the
+    # handler goes on the adapter itself
+    def install(self):
+        adapter = db._adapter
+        if self.handler not in adapter.execution_handlers:
+            adapter.execution_handlers = list(adapter.execution_handlers) + [self.handler]
+
+    def uninstall(self):
+        adapter = db._adapter
+        adapter.execution_handlers = [h for h in adapter.execution_handlers
+                                      if h is not self.handler]
+
+
+# Bind the thread's request/response to a fresh fake request (headers as
+# {'If-None-Match': ...})
+def bind_request(method='GET', params=None, headers=None):
+    query = urlencode(params or {})
+    body = query.encode() if method == 'POST' else b''
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': '/%s/bench' % settings.APP_NAME,
+        'QUERY_STRING': '' if method == 'POST' else query,
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '8000', 'HTTP_HOST': 'localhost:8000',
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    if hasattr(bottle.request, 'bind'):
+        # py4web on bottle
+        bottle.request.bind(environ)
+        bottle.response.bind()
+    else:
+        # py4web on ombott, which rebinds them the same way for each request
+        bottle.request.__init__(environ)
+        bottle.response.__init__()
+    bottle.request.app_name = settings.APP_NAME
+
+
+# Render output with the template file name, as py4web's Template fixture does
+def render_template(template, output):
+    context = dict(request=bottle.request, URL=URL)
+    context.update(HELPERS)
+    context.update(output)
+    context['__vars__'] = output
+    path = os.path.join(settings.APP_FOLDER, 'templates')
+    return render_file(filename=os.path.join(path, template), path=path, context=context,
+                       delimiters='[[ ]]')
+
+
+# One benchmark case: controller function name, positional arguments per
+# iteration (a list is cycled through), request method and parameters.
+# inserts names the table a write case must add a row to, checked by
+# check() (before the timed calls, so a case that only measures its error
+# path fails instead)
+class Case:
+
+    def __init__(self, name, action, args=(), method='GET', params=None, template=None,
+                 inserts=None):
+        self.name = name
+        self.func = inspect.unwrap(getattr(controllers, action))
+        self.args = args if isinstance(args, list) else [args]
+        self.method = method
+        self.params = params or {}
+        self.template = template
+        self.inserts = inserts
+
+    def call(self, i, render=False, check=False):
+        bind_request(self.method, self.params)
+        try:
+            before = self._rows() if check else None
+            try:
+                output = self.func(*self.args[i % len(self.args)])
+                if render and self.template and isinstance(output, dict):
+                    render_template(self.template, output)
+            except (bottle.HTTPResponse, HTTP):
+                # redirect() after a post
+                pass
+            if check and self._rows() <= before:
+                raise AssertionError('%s inserted no %s row' % (self.name, self.inserts))
+        finally:
+            db.rollback()
+
+    # highest id of the inserts table (the rows of a call are above it)
+    def _rows(self):
+        if not self.inserts:
+            return 0
+        last = db[self.inserts].id.max()
+        return db(db[self.inserts].id > 0).select(last).first()[last] or 0
+
+    def check(self):
+        for i in range(len(self.args)):
+            self.call(i, check=True)
+
+
+def _sample(table, n, rng):
+    ids = [row.id for row in db(table.id > 0).select(table.id)]
+    return rng.sample(ids, min(n, len(ids))) or [0]
+
+
+def _date_range():
+    created_at = db.output_invoice.created_at
+    row = db(db.output_invoice.id > 0).select(created_at.min(), created_at.max()).first()
+    end = row[created_at.max()] or str(datetime.date.today())
+    return datetime.date.fromisoformat(str(end)[:10]), row[created_at.min()]
+
+
+# The cases of the controller actions, on ids sampled with a fixed seed
+def default_cases(seed=1):
+    rng = random.Random(seed)
+    exports = [(i,) for i in _sample(db.output_invoice, 50, rng)]
+    imports = [(i,) for i in _sample(db.input_invoice, 50, rng)]
+    products = _sample(db.product, 50, rng)
+    end, _ = _date_range()
+
+    def since(days):
+        return dict(**{'from': str(end - datetime.timedelta(days=days - 1)), 'to': str(end)})
+
+    # the product with the most stock, so posting one unit on an export passes
+    ledger = db.product_stock
+    stocked = db(ledger.quantity > 0).select(ledger.product_id, orderby=~ledger.quantity,
+                                             limitby=(0, 1)).first()
+    line = dict(productId=stocked.product_id if stocked else products[0], quantity=1,
+                unit_price=1000)
+    return [
+        Case('index', 'index', template='index.html'),
+        Case('product', 'product', args=(None,), template='product.html'),
+        Case('get_invoice', 'get_invoice', args=exports, template='invoice.html'),
+        Case('get-import-invoice', 'get_import_invoice', args=imports,
+             template='import_invoice.html'),
+        Case('print-invoice', 'invoiceJson', args=exports, template='hoadon.html'),
+        Case('statistic 7d', 'statistic', method='POST', params=since(7),
+             template='statistic.html'),
+        Case('statistic 30d', 'statistic', method='POST', params=since(30),
+             template='statistic.html'),
+        Case('statistic 365d', 'statistic', method='POST', params=since(365),
+             template='statistic.html'),
+        Case('statistic all', 'statistic', method='POST', params={}, template='statistic.html'),
+        Case('statistic 30d by category', 'statistic', method='POST',
+             params=dict(since(30), group='category'), template='statistic.html'),
+        Case('search code', 'search_products', params=dict(q='P0001')),
+        Case('search description', 'search_products', params=dict(q='steel')),
+        Case('post_invoice', 'post_invoice', args=exports, method='POST', params=line,
+             inserts='output_invoice_details'),
+        Case('post_import_invoice', 'post_import_invoice', args=imports, method='POST',
+             params=line, inserts='input_invoice_details'),
+    ]
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+
+# Run one case, returns its result dict (times in milliseconds)
+def measure(case, repeat=20, warmup=2, render=False, probe=None):
+    probe = probe or QueryProbe()
+    try:
+        case.check()
+    except Exception as error:
+        return dict(error='%s: %s' % (type(error).__name__, error))
+    probe.install()
+    try:
+        for i in range(warmup):
+            case.call(i, render)
+        times, queries = [], []
+        for i in range(repeat):
+            probe.queries = 0
+            started = time.perf_counter()
+            case.call(i, render)
+            times.append((time.perf_counter() - started) * 1000)
+            queries.append(probe.queries)
+        tracemalloc.start()
+        try:
+            case.call(0, render)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except Exception as error:
+        return dict(error='%s: %s' % (type(error).__name__, error))
+    finally:
+        probe.uninstall()
+    result = {'p%s' % p: round(_percentile(times, p), 3) for p in PERCENTILES}
+    result.update(mean=round(sum(times) / len(times), 3), max=round(max(times), 3),
+                  queries=max(queries), peak_kb=round(peak / 1024.0, 1), repeat=repeat)
+    return result
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=settings.APP_FOLDER, stderr=subprocess.DEVNULL
+                                       ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Run the cases whose name starts with one of only (all when empty)
+def run(repeat=20, warmup=2, render=False, only=(), seed=1):
+    cases = [case for case in default_cases(seed)
+             if not only or any(case.name.startswith(name) for name in only)]
+    meta = dict(commit=_commit(), date=datetime.datetime.now().isoformat(timespec='seconds'),
+                python=platform.python_version(), sqlite=sqlite3.sqlite_version,
+                render=render, rows={name: db(db[name].id > 0).count() for name in (
+                    'product', 'categories', 'output_invoice', 'input_invoice',
+                    'output_invoice_details', 'input_invoice_details')})
+    results = {case.name: measure(case, repeat, warmup, render) for case in cases}
+    return dict(meta=meta, results=results)
+
+
+def format_report(report, baseline=None):
+    lines = ['%-28s %9s %9s %9s %8s %9s' % ('action', 'p50 ms', 'p95 ms', 'p99 ms',
+                                            'queries', 'peak KB')]
+    for name, result in report['results'].items():
+        if 'error' in result:
+            lines.append('%-28s %s' % (name, result['error']))
+            continue
+        line = '%-28s %9.2f %9.2f %9.2f %8d %9.1f' % (
+            name, result['p50'], result['p95'], result['p99'], result['queries'],
+            result['peak_kb'])
+        old = (baseline or {}).get('results', {}).get(name)
+        if old and 'error' not in old and old['p50']:
+            line += '   p50 %+.0f%%, queries %+d' % (
+                (result['p50'] - old['p50']) * 100.0 / old['p50'], result['queries'] - old['queries'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def save(report, path):
+    with open(path, 'w') as stream:
+        json.dump(report, stream, indent=2, default=str)
+
+
+def load(path):
+    with open(path) as stream:
+        return json.load(stream)
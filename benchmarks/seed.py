@@ -0,0 +1,139 @@
+"""
+Deterministic synthetic data for the benchmarks.
+
+Rows are written with executemany in chunks (the DAL insert callbacks would
+make a million lines take hours), then the derived tables are rebuilt with
+the maintenance functions the app already has: the stock ledger, the invoice
+totals, the product search index and the daily movement rollup.
+"""
+import datetime
+import random
+
+from ..common import db
+from ..dbutils import engine, placeholder
+from .. import stock, totals, search, rollup, versions, counters
+
+CHUNK_SIZE = 5000
+SEED_USER = 'bench@example.com'
+UNITS = ('pcs', 'box', 'kg', 'set', 'pack')
+WORDS = ('steel', 'cotton', 'blue', 'red', 'large', 'small', 'bolt', 'screw', 'cable', 'pipe',
+         'shirt', 'paper', 'glass', 'bottle', 'lamp', 'filter', 'valve', 'panel', 'brush', 'tape')
+
+# tables written by seed, children first
+TABLES = ('daily_product_movement', 'rollup_state', 'product_trigram', 'product_stock',
+          'input_invoice_details', 'output_invoice_details', 'input_invoice', 'output_invoice',
+          'product', 'categories')
+
+
+def _insert_many(table, names, rows):
+    sql = 'INSERT INTO %s (%s) VALUES (%s);' % (
+        table._rname, ', '.join(table[name]._rname for name in names),
+        ', '.join([placeholder()] * len(names)))
+    cursor = db._adapter.cursor
+    for start in range(0, len(rows), CHUNK_SIZE):
+        cursor.executemany(sql, rows[start:start + CHUNK_SIZE])
+
+
+def _ids(table):
+    return [row.id for row in db(table.id > 0).select(table.id, orderby=table.id)]
+
+
+# Empty every table written by seed (TRUNCATE, so no delete callback runs)
+def reset():
+    for name in TABLES:
+        db[name].truncate()
+    db.commit()
+
+
+# Fill the database: products spread over categories, invoices over the
+# days before end, lines_per_invoice lines per invoice on average.
+# import_share of the invoices are imports; export lines never take more
+# than the product has in stock at their date. Returns the row counts.
+def seed(products=10000, categories=200, lines=1000000, lines_per_invoice=20, days=365,
+         end=datetime.date(2024, 12, 31), import_share=0.4, seed=1):
+    if engine() != 'sqlite':
+        raise RuntimeError('the benchmarks only seed SQLite databases, set INVENTORY_DB_URI')
+    if not db(db.product.id > 0).isempty():
+        raise RuntimeError('the database is not empty, run seed with --reset')
+    rng = random.Random(seed)
+    start = end - datetime.timedelta(days=days - 1)
+
+    _insert_many(db.categories, ['name'],
+                 [('Category %04d' % i,) for i in range(1, categories + 1)])
+    category_ids = _ids(db.categories)
+
+    _insert_many(db.product, ['categories_id', 'product_code', 'description', 'unit',
+                              'created_by', 'created_at'],
+                 [(rng.choice(category_ids), 'P%06d' % i,
+                   ' '.join(rng.sample(WORDS, 3)) + ' %d' % i, rng.choice(UNITS),
+                   SEED_USER, start) for i in range(1, products + 1)])
+    product_ids = _ids(db.product)
+
+    invoices = max(1, lines // lines_per_invoice)
+    imports = int(invoices * import_share)
+    for header, count in ((db.input_invoice, imports), (db.output_invoice, invoices - imports)):
+        _insert_many(header, ['name', 'customer_name', 'customer_address', 'created_at',
+                              'total_amount', 'line_count'],
+                     [('%s %d' % (header._tablename, i), 'Customer %d' % rng.randint(1, 500),
+                       'Street %d' % rng.randint(1, 200),
+                       start + datetime.timedelta(days=rng.randrange(days)), 0, 0)
+                      for i in range(1, count + 1)])
+
+    sides = ((db.input_invoice, db.input_invoice_details, 'input_invoice_id'),
+             (db.output_invoice, db.output_invoice_details, 'output_invoice_id'))
+    names = {side: [invoice_field, 'product_id', 'quantity', 'unit_price', 'total_price']
+             for side, (_, _, invoice_field) in enumerate(sides)}
+    # lines invoice by invoice in date order: an export line only takes what
+    # the imports before it brought in, so no product goes out of stock below 0
+    invoices = sorted((str(row.created_at), side, row.id)
+                      for side, (header, _, _) in enumerate(sides)
+                      for row in db(header.id > 0).select(header.id, header.created_at))
+    on_hand, stocked, position = {}, [], {}
+    rows = ([], [])
+    for _, side, invoice_id in invoices:
+        for _ in range(max(1, int(rng.expovariate(1.0 / lines_per_invoice)))):
+            quantity, unit_price = rng.randint(1, 50), rng.randint(1, 500) * 1000
+            if side == 0:
+                product_id = rng.choice(product_ids)
+                if product_id not in position:
+                    position[product_id] = len(stocked)
+                    stocked.append(product_id)
+                on_hand[product_id] = on_hand.get(product_id, 0) + quantity
+            elif stocked:
+                product_id = rng.choice(stocked)
+                quantity = min(quantity, on_hand[product_id])
+                on_hand[product_id] -= quantity
+                if not on_hand[product_id]:
+                    # out of stock: swap it out of the stocked list
+                    last = stocked.pop()
+                    if last != product_id:
+                        stocked[position[product_id]] = last
+                        position[last] = position[product_id]
+                    del position[product_id]
+            else:
+                continue
+            rows[side].append((invoice_id, product_id, quantity, unit_price,
+                               quantity * unit_price))
+            if len(rows[side]) >= CHUNK_SIZE:
+                _insert_many(sides[side][1], names[side], rows[side])
+                del rows[side][:]
+    for side, (_, details, _) in enumerate(sides):
+        _insert_many(details, names[side], rows[side])
+    db.commit()
+
+    # derived tables, as after an upgrade (see manage.py)
+    stock.reconcile(fix=True)
+    for header, details, invoice_field in sides:
+        totals.backfill(header, details, invoice_field)
+    db.commit()
+    search.reindex()
+    # a run folds only up to the id the previous run saw: the first one
+    # records the seeded lines, the second folds them all
+    rollup.run()
+    rollup.run()
+    for name in TABLES:
+        versions.bump(counters.version_name(db[name]))
+    versions.bump('catalog')
+    versions.bump('categories')
+    db.commit()
+    return {name: db(db[name].id > 0).count() for name in TABLES}
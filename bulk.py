@@ -0,0 +1,143 @@
+"""
+Bulk entry of invoice lines.
+
+A payload of many lines (JSON or CSV) is parsed, validated with one IN query
+per lookup column, and inserted with executemany in the current transaction.
+The stock ledger, the invoice totals and the version counters are then
+updated once per product, invoice and table instead of once per line.
+"""
+import csv
+import io
+
+from .common import db
+from . import stock, versions, counters, totals
+from .prefetch import referenced_table
+from .dbutils import placeholder
+
+CHUNK_SIZE = 500
+COLUMNS = ('product_code', 'quantity', 'unit_price')
+
+
+# Parse a JSON list (or {"lines": [...]}) into line dicts
+def parse_json(data):
+    if isinstance(data, dict):
+        data = data.get('lines')
+    if not isinstance(data, list):
+        raise ValueError('expected a list of lines')
+    return [item if isinstance(item, dict) else {} for item in data]
+
+
+# Parse CSV text; the header row is optional, without it the columns are
+# product_code,quantity,unit_price
+def parse_csv(text):
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    if 'quantity' in header:
+        rows = rows[1:]
+    else:
+        header = list(COLUMNS)
+    return [dict(zip(header, (cell.strip() for cell in row))) for row in rows]
+
+
+def _positive_int(value):
+    try:
+        value = int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+# Check every line and resolve its product. Products are looked up with one
+# IN query on ids and one on codes. Returns (valid lines, errors) where errors
+# is a list of dict(line=<1-based line number>, error=<message>).
+def validate(lines):
+    ids = set(_positive_int(line.get('product_id')) for line in lines) - {None}
+    codes = set(str(line.get('product_code')).strip() for line in lines if line.get('product_code'))
+    known_ids = set()
+    by_code = {}
+    if ids:
+        known_ids = set(row.id for row in db(db.product.id.belongs(sorted(ids))).select(db.product.id))
+    if codes:
+        for row in db(db.product.product_code.belongs(sorted(codes))).select(
+                db.product.id, db.product.product_code):
+            by_code[row.product_code] = row.id
+
+    valid, errors = [], []
+    for number, line in enumerate(lines, 1):
+        if line.get('product_id'):
+            product_id = _positive_int(line.get('product_id'))
+            if product_id not in known_ids:
+                errors.append(dict(line=number, error='unknown product id %s' % line.get('product_id')))
+                continue
+        elif line.get('product_code'):
+            product_id = by_code.get(str(line.get('product_code')).strip())
+            if product_id is None:
+                errors.append(dict(line=number, error='unknown product code %s' % line.get('product_code')))
+                continue
+        else:
+            errors.append(dict(line=number, error='missing product'))
+            continue
+        quantity = _positive_int(line.get('quantity'))
+        unit_price = _positive_int(line.get('unit_price'))
+        if quantity is None:
+            errors.append(dict(line=number, error='quantity must be a positive integer'))
+        elif unit_price is None:
+            errors.append(dict(line=number, error='unit price must be a positive integer'))
+        else:
+            valid.append(dict(product_id=product_id, quantity=quantity, unit_price=unit_price,
+                              line=number))
+    return valid, errors
+
+
+# Insert lines into an invoice detail table with executemany, in chunks.
+# sign is +1 for imports and -1 for exports (stock ledger direction).
+def insert_lines(details, invoice_field, invoice_id, lines, sign):
+    if not lines:
+        return 0
+    names = [invoice_field, 'product_id', 'quantity', 'unit_price', 'total_price']
+    sql = 'INSERT INTO %s (%s) VALUES (%s);' % (
+        details._rname,
+        ', '.join(details[name]._rname for name in names),
+        ', '.join([placeholder()] * len(names)))
+    values = [(invoice_id, line['product_id'], line['quantity'], line['unit_price'],
+               line['quantity'] * line['unit_price']) for line in lines]
+    cursor = db._adapter.cursor
+    for start in range(0, len(values), CHUNK_SIZE):
+        cursor.executemany(sql, values[start:start + CHUNK_SIZE])
+
+    # the DAL callbacks did not run: apply their effects once per product / table
+    moved = {}
+    for line in lines:
+        moved[line['product_id']] = moved.get(line['product_id'], 0) + line['quantity']
+    for product_id, quantity in moved.items():
+        stock.adjust(product_id, sign * quantity)
+    totals.adjust(referenced_table(details[invoice_field]), invoice_id,
+                  len(values), sum(value[-1] for value in values))
+    versions.bump(counters.version_name(details))
+    return len(lines)
+
+
+# Validate and insert a bulk payload. Nothing is inserted if any line is
+# invalid, unless partial is True, nor if an export runs out of stock.
+# Returns dict(inserted, errors).
+def add_lines(details, invoice_field, invoice_id, lines, sign, partial=False):
+    valid, errors = validate(lines)
+    if errors and not partial:
+        return dict(inserted=0, errors=errors)
+    if sign < 0 and valid:
+        # exports: reserve the stock of every product first (see stock.reserve_many)
+        wanted, first_line = {}, {}
+        for line in valid:
+            wanted[line['product_id']] = wanted.get(line['product_id'], 0) + line['quantity']
+            first_line.setdefault(line['product_id'], line['line'])
+        try:
+            stock.reserve_many(wanted)
+        except stock.OutOfStock as e:
+            errors.append(dict(line=first_line[e.product_id], error=str(e)))
+            return dict(inserted=0, errors=sorted(errors, key=lambda error: error['line']))
+        except stock.ReservationConflict as e:
+            return dict(inserted=0, errors=errors + [dict(line=0, error=str(e))])
+    inserted = insert_lines(details, invoice_field, invoice_id, valid, sign)
+    return dict(inserted=inserted, errors=errors)
@@ -0,0 +1,132 @@
+"""
+Bounded caches keyed on data versions.
+
+VersionedLRU stores computed values under (key, versions): a value is only
+returned while the version counters it was computed from are unchanged
+(see versions.py), and the least recently used entries are dropped once
+the cache holds size entries.
+
+DiskCache does the same for text values with one file per (key, versions)
+in a folder, so several worker processes can share what one of them
+computed. Files are touched when read and the least recently used ones are
+removed once the folder holds more than size files.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class VersionedLRU:
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Cached value of key for these versions, computed by compute() on a miss
+    def get(self, key, version, compute):
+        value = self.lookup(key, version, MISSING)
+        if value is MISSING:
+            value = compute()
+            self.put(key, version, value)
+        return value
+
+    # Cached value of key if it was stored for these versions, else default
+    def lookup(self, key, version, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return default
+
+    def put(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return dict(size=len(self.entries), capacity=self.size, hits=self.hits, misses=self.misses)
+
+
+class DiskCache:
+
+    # prune the folder every PRUNE_EVERY writes of this process
+    PRUNE_EVERY = 50
+
+    def __init__(self, folder, size=2000):
+        self.folder = folder
+        self.size = size
+        self.writes = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key, version):
+        digest = hashlib.sha1(repr((key, version)).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest + '.cache')
+
+    # Cached text of key if it was stored for these versions, else default
+    def lookup(self, key, version, default=None):
+        path = self._path(key, version)
+        try:
+            with open(path, encoding='utf-8') as stream:
+                value = stream.read()
+            os.utime(path)
+        except OSError:
+            return default
+        return value
+
+    def put(self, key, version, value):
+        # write next to the final file and rename, so readers never see a partial file
+        handle, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.folder)
+        try:
+            with os.fdopen(handle, 'w', encoding='utf-8') as stream:
+                stream.write(value)
+            os.replace(tmp, self._path(key, version))
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self.writes += 1
+        if self.writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    # Remove the least recently used files beyond size
+    def prune(self):
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.cache'):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.size)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.cache'):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
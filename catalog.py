@@ -0,0 +1,79 @@
+"""
+In-process cache of the product catalog used by the invoice screens.
+
+The cache holds a compact {product_id: CatalogEntry(code, description, unit,
+category)} map, the product codes in sorted order for prefix lookups (the
+product picker, see search.py) and the 'catalog' version it was built from. Every product or
+category write bumps that version in the database (see versions.watch in
+models.py), so each worker only re-reads the catalog after a change, even
+when the change was made by another worker.
+"""
+import bisect
+import threading
+from collections import OrderedDict, namedtuple
+
+from .common import db
+from . import versions
+
+CatalogEntry = namedtuple('CatalogEntry', 'code description unit category')
+
+VERSION = 'catalog'
+
+
+class CatalogCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = OrderedDict()
+        self.codes = []
+        self.hits = 0
+        self.misses = 0
+
+    # Read the catalog from the database (one join with categories)
+    def load(self):
+        rows = db(db.product.id > 0).select(
+            db.product.id, db.product.product_code, db.product.description,
+            db.product.unit, db.categories.name,
+            left=db.categories.on(db.categories.id == db.product.categories_id),
+            orderby=db.product.product_code)
+        return OrderedDict(
+            (row.product.id, CatalogEntry(row.product.product_code, row.product.description,
+                                          row.product.unit, row.categories.name))
+            for row in rows)
+
+    # The current catalog, reloaded only if the stored version moved
+    def get(self):
+        # read the version before the data: a write committed in between
+        # only makes the next call reload again, never serves stale data
+        version = versions.current(VERSION)
+        with self.lock:
+            if version == self.version:
+                self.hits += 1
+                return self.entries
+        entries = self.load()
+        codes = sorted((entry.code or '', product_id) for product_id, entry in entries.items())
+        with self.lock:
+            self.misses += 1
+            self.version, self.entries, self.codes = version, entries, codes
+        return entries
+
+    # Ids of the products whose code starts with prefix, in code order: a
+    # binary search over the sorted codes of the catalog last loaded (call
+    # get() first)
+    def code_prefix(self, prefix, limit):
+        with self.lock:
+            codes = self.codes
+        ids = []
+        for code, product_id in codes[bisect.bisect_left(codes, (prefix,)):]:
+            if not code.startswith(prefix) or len(ids) >= limit:
+                break
+            ids.append(product_id)
+        return ids
+
+    def stats(self):
+        return dict(version=self.version, size=len(self.entries),
+                    hits=self.hits, misses=self.misses)
+
+
+catalog = CatalogCache()
@@ -0,0 +1,75 @@
+"""
+Cached category directory: resolves category names to ids for searches.
+
+The directory keeps the categories sorted by their lowercased name together
+with the 'categories' version it was built from (bumped by every category
+write, see models.py), so each worker re-reads the table only after a
+change. Lookups are case-insensitive; match() also accepts a name prefix and
+is a binary search over the sorted names.
+"""
+import bisect
+import threading
+
+from .common import db
+from . import versions
+
+VERSION = 'categories'
+
+
+class CategoryDirectory:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.keys = []
+        self.entries = []
+
+    # Read the categories, sorted by lowercased name
+    def load(self):
+        rows = db(db.categories.id > 0).select(db.categories.id, db.categories.name)
+        entries = sorted(((row.name or '').strip().lower(), row.id, row.name) for row in rows)
+        return [entry[0] for entry in entries], entries
+
+    def _current(self):
+        version = versions.current(VERSION)
+        with self.lock:
+            if version == self.version:
+                return self.keys, self.entries
+        keys, entries = self.load()
+        with self.lock:
+            self.version, self.keys, self.entries = version, keys, entries
+        return keys, entries
+
+    # Id of the category named name (any case), None if there is none
+    def resolve(self, name):
+        key = str(name or '').strip().lower()
+        keys, entries = self._current()
+        i = bisect.bisect_left(keys, key)
+        if key and i < len(keys) and keys[i] == key:
+            return entries[i][1]
+        return None
+
+    # Ids of the categories whose name starts with prefix (any case);
+    # an exact name match returns only that category
+    def match(self, prefix):
+        key = str(prefix or '').strip().lower()
+        if not key:
+            return []
+        keys, entries = self._current()
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return [entries[i][1]]
+        j = bisect.bisect_left(keys, key + '￿')
+        return [entry[1] for entry in entries[i:j]]
+
+    # [(id, name)] in name order
+    def all(self):
+        return [(entry[1], entry[2]) for entry in self._current()[1]]
+
+
+directory = CategoryDirectory()
+
+
+# Query of the products in the categories matching name (see match())
+def products_query(name):
+    return db.product.categories_id.belongs(directory.match(name))
@@ -0,0 +1,78 @@
+"""
+Bulk deletion of invoices.
+
+delete_invoices() removes the invoices matched by a filter (ids, a created_at
+range, only the invoices without lines) in bounded chunks: the lines of at
+most CHUNK invoices are deleted LINE_CHUNK lines per transaction, then their
+headers in one more, so no transaction holds locks on the detail tables for
+long whatever the number of invoices. The deletes go through the DAL, so the
+stock ledger, the invoice totals, the daily rollup and the version counters
+follow each chunk; by the time a header is deleted its lines are gone and the
+ON DELETE CASCADE has nothing left to do.
+"""
+from .common import db
+
+CHUNK = 200
+LINE_CHUNK = 1000
+
+# kind: (header, details, invoice field), kinds as in exports.py
+KINDS = {'invoices': ('output_invoice', 'output_invoice_details', 'output_invoice_id'),
+         'import_invoices': ('input_invoice', 'input_invoice_details', 'input_invoice_id')}
+
+
+def tables(kind):
+    if kind not in KINDS:
+        raise ValueError('unknown invoice kind: %s' % kind)
+    header, details, invoice_field = KINDS[kind]
+    return db[header], db[details], invoice_field
+
+
+# Query of the invoices to delete; every given filter applies
+def invoice_query(kind, ids=None, from_date=None, to_date=None, empty_only=False):
+    header, details, invoice_field = tables(kind)
+    query = header.id > 0
+    if ids is not None:
+        query &= header.id.belongs([int(i) for i in ids])
+    if from_date:
+        query &= header.created_at >= from_date
+    if to_date:
+        query &= header.created_at <= to_date
+    if empty_only:
+        query &= ~header.id.belongs(db(details.id > 0)._select(details[invoice_field],
+                                                                distinct=True))
+    return query
+
+
+# Delete the lines of the given invoices, LINE_CHUNK lines per transaction
+def _delete_lines(details, invoice_field, invoice_ids, line_chunk, result, progress):
+    while True:
+        line_ids = [row.id for row in db(details[invoice_field].belongs(invoice_ids)).select(
+            details.id, orderby=details.id, limitby=(0, line_chunk))]
+        if not line_ids:
+            return
+        db(details.id.belongs(line_ids)).delete()
+        db.commit()
+        result['lines'] += len(line_ids)
+        if progress:
+            progress(details._tablename, result['lines'])
+
+
+# Delete the invoices of one kind matched by query, returns
+# {'invoices': n, 'lines': n}. progress(table name, rows deleted so far) is
+# called after each committed chunk.
+def delete_invoices(kind, query, chunk=CHUNK, line_chunk=LINE_CHUNK, progress=None):
+    header, details, invoice_field = tables(kind)
+    result = dict(invoices=0, lines=0)
+    last_id = 0
+    while True:
+        ids = [row.id for row in db(query & (header.id > last_id)).select(
+            header.id, orderby=header.id, limitby=(0, chunk))]
+        if not ids:
+            return result
+        _delete_lines(details, invoice_field, ids, line_chunk, result, progress)
+        db(header.id.belongs(ids)).delete()
+        db.commit()
+        result['invoices'] += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(header._tablename, result['invoices'])
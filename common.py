@@ -12,6 +12,7 @@ from py4web.utils.downloader import downloader
 from pydal.tools.tags import Tags
 from py4web.utils.factories import ActionFactory
 from . import settings
+from .replica import RoutingDAL, ReplicaReads
 
 # #######################################################
 # implement custom loggers form settings.LOGGERS
@@ -33,7 +34,7 @@ for item in settings.LOGGERS:
 # #######################################################
 # connect to db
 # #######################################################
-db = DAL(
+db = RoutingDAL(
     settings.DB_URI,
     folder=settings.DB_FOLDER,
     pool_size=settings.DB_POOL_SIZE,
@@ -41,6 +42,15 @@ db = DAL(
     fake_migrate=settings.DB_FAKE_MIGRATE,
 )
 
+# read-only actions use the replica when DB_REPLICA_URI is set (see replica.py)
+replica = ReplicaReads(
+    db,
+    settings.DB_REPLICA_URI,
+    pool_size=settings.DB_REPLICA_POOL_SIZE,
+    folder=settings.DB_FOLDER,
+    window=settings.READ_YOUR_WRITES_SECONDS,
+)
+
 # #######################################################
 # define global objects that may or may not be used by the actions
 # #######################################################
@@ -170,7 +180,7 @@ if settings.UPLOAD_FOLDER:
     # field.download_url = lambda filename: URL('download/%s' % filename)
 
 # #######################################################
-# Optionally configure celery
+# Optionally configure celery (otherwise use the in-process scheduler)
 # #######################################################
 if settings.USE_CELERY:
     from celery import Celery
@@ -180,6 +190,11 @@ if settings.USE_CELERY:
     scheduler = Celery(
         "apps.%s.tasks" % settings.APP_NAME, broker=settings.CELERY_BROKER
     )
+else:
+    from .scheduler import ThreadScheduler
+
+    # same task/beat_schedule API, runs in a thread of the web process
+    scheduler = ThreadScheduler(logger=logger)
 
 
 # #######################################################
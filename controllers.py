@@ -1,48 +1,169 @@
-from py4web import action, request, redirect, URL
-from yatl.helpers import A, P
-from .common import db, session, T, auth
-
-from py4web.utils.form import Form, FormStyleBulma
+import datetime
+import os
+import uuid
+
+from py4web import action, request, response, redirect, abort, URL
+from py4web.core import bottle
+from .common import db, session, auth, settings, replica
+from .reports import movement_report
+from . import stock
+from .prefetch import prefetch
+from .pagination import keyset_page, page_params, date_filter
+from .catalog import catalog
+from .metrics import metrics
+from .pagecache import pages
+from . import counters, bulk, exports, invoice_pdf, analytics, search, categories, idempotency, archive, cleanup, versions, tasks
+
+from py4web.utils.form import FormStyleBulma
 from py4web.utils.grid import Grid, GridClassStyleBulma
 
 # Get index page (login page)
 
 @action('index', method=["GET", "POST"])
-@action.uses(db, auth.user, 'index.html')
+@action.uses(metrics, replica, db, auth.user, 'index.html')
 def index():
     if request.method == 'GET':
-        products = db(db.product.id > 0).select()
-        invoices = db(db.output_invoice.id > 0).select()
-        import_invoices = db(db.input_invoice.id > 0).select()
-        return dict(products=products, invoices=invoices, import_invoices=import_invoices)
+        # Only the first page of each list, the rest is loaded on scroll
+        products, products_next = dashboard_page('products', {})
+        invoices, invoices_next = dashboard_page('invoices', {})
+        import_invoices, import_invoices_next = dashboard_page('import_invoices', {})
+        totals = dict(zip(('products', 'invoices', 'import_invoices'),
+                          counters.count(db.product, db.output_invoice, db.input_invoice)))
+        return dict(products=products, invoices=invoices, import_invoices=import_invoices,
+                    products_next=products_next, invoices_next=invoices_next,
+                    import_invoices_next=import_invoices_next, totals=totals,
+                    form_key=uuid.uuid4().hex)
+
+
+# One keyset page of a dashboard list as plain dicts, with the cursor of the next page
+def dashboard_page(kind, params):
+    paging = page_params(params)
+    if kind == 'products':
+        table = db.product
+        fields = [table.id, table.product_code, table.description, table.created_at]
+    else:
+        table = db.output_invoice if kind == 'invoices' else db.input_invoice
+        fields = [table.id, table.name, table.created_at, table.total_amount, table.line_count]
+    query = date_filter(table, params.get('from'), params.get('to'))
+    rows, next_cursor = keyset_page(table, query, fields=fields, **paging)
+
+    if kind == 'products':
+        levels = stock.on_hand_many([row.id for row in rows])
+        items = [dict(id=row.id, product_code=row.product_code, description=row.description,
+                      stock=levels.get(row.id, 0)) for row in rows]
+    else:
+        page = 'get_invoice' if kind == 'invoices' else 'get-import-invoice'
+        items = [dict(id=row.id, name=row.name, created_at=row.created_at,
+                      total_amount=row.total_amount or 0, line_count=row.line_count or 0,
+                      url=URL(page, row.id)) for row in rows]
+    return items, next_cursor
+
+
+# Paginated JSON lists for the dashboard: ?cursor=&order=id|created_at&limit=&from=&to=
+@action('dashboard/<kind>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def dashboard(kind):
+    if kind not in ('products', 'invoices', 'import_invoices'):
+        abort(404)
+    items, next_cursor = dashboard_page(kind, request.params)
+    return dict(items=items, next=next_cursor)
+
+
+# Current on-hand stock for one product or the whole catalog (JSON)
+@action('stock', method=["GET"])
+@action('stock/<product_id:int>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def product_stock(product_id=None):
+    if product_id is not None:
+        return dict(product_id=product_id, quantity=stock.on_hand(product_id))
+    return dict(stock=stock.on_hand_all())
+
+
+# Stock of the products of one category, and the category total (JSON)
+@action('stock/category/<category_id:int>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def category_stock(category_id):
+    items = [dict(id=product.id, product_code=product.product_code,
+                  description=product.description, quantity=quantity)
+             for product, quantity in stock.in_category(category_id)]
+    return dict(category_id=category_id, items=items,
+                quantity=sum(item['quantity'] for item in items))
+
+
+# Categories whose name matches ?q= (case-insensitive, exact name or prefix)
+@action('categories/lookup', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def categories_lookup():
+    ids = set(categories.directory.match(request.params.get("q")))
+    return dict(items=[dict(id=id, name=name) for id, name in categories.directory.all()
+                       if id in ids])
+
+
+# One keyset page of the products of a category: ?cursor=&limit=
+@action('categories/<category_id:int>/products', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def category_products(category_id):
+    paging = page_params(request.params, order='id')
+    table = db.product
+    rows, next_cursor = keyset_page(
+        table, table.categories_id == category_id,
+        fields=[table.id, table.product_code, table.description, table.unit], **paging)
+    levels = stock.on_hand_many([row.id for row in rows])
+    items = [dict(id=row.id, product_code=row.product_code, description=row.description,
+                  unit=row.unit, stock=levels.get(row.id, 0)) for row in rows]
+    return dict(items=items, next=next_cursor)
+
+
+# Request and SQL metrics of this worker in the Prometheus text format
+@action('metrics', method=["GET"])
+def prometheus_metrics():
+    if settings.METRICS_TOKEN and request.headers.get(
+            "Authorization") != "Bearer %s" % settings.METRICS_TOKEN:
+        abort(401)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return metrics.exposition()
+
+
+# Hit/miss statistics of the product catalog cache (JSON)
+@action('catalog/stats', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def catalog_stats():
+    return catalog.stats()
 
 
 # Product management page - Using Py4web Grid
 
 @action('product', method=["GET", "POST"])
 @action('product/<path:path>', method=["GET", "POST"])
-@action.uses(db, auth.user, 'product.html')
+@action.uses(metrics, replica.writes, db, auth.user, 'product.html')
 def product(path=None):
 
-    raw_categories = db.executesql("SELECT * FROM categories;")
-    categories = dict((y, x) for x, y in raw_categories)
-    print(categories)
     grid = Grid(
         path, query=db.product.id > 0,
         search_form=None, editable=True, deletable=True, details=False, create=True,
         grid_class_style=GridClassStyleBulma, formstyle=FormStyleBulma, rows_per_page=4,
         search_queries=[
-            ['By Code', lambda val: db.product.product_code.contains(val)],
-            ['By Category', lambda val: db.product.categories_id == categories[str(val)]]
+            ['By Code', lambda val: search.code_prefix_query(val)],
+            ['By Description', lambda val: db.product.id.belongs(search.description_ids(val, limit=None))],
+            ['By Category', lambda val: categories.products_query(val)]
         ])
     #Count total product
-    total = db(db.product.id > 0).select()
-    return dict(grid=grid, total=len(total))
+    return dict(grid=grid, total=counters.count(db.product))
+
+# Typeahead product search (JSON): ?q=&limit=10, code prefix matches first
+@action('search/products', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def search_products():
+    try:
+        limit = min(max(int(request.params.get("limit") or search.LIMIT), 1), 50)
+    except ValueError:
+        limit = search.LIMIT
+    return dict(items=search.search(request.params.get("q"), limit))
 
 # Category Management Page - Using Py4web Grid
 @action('category', method=["GET", "POST"])
 @action('category/<path:path>', method=["GET", "POST"])
-@action.uses(db, auth.user, 'category.html')
+@action.uses(metrics, replica.writes, db, auth.user, 'category.html')
 def category(path=None):
 
     grid = Grid(
@@ -54,16 +175,14 @@ def category(path=None):
         formstyle=FormStyleBulma,
         search_queries=[
             ['By Name', lambda val: db.categories.name.contains(val)]])
-    #Count total product
-    total = db(db.categories.id > 0).select()
-
-    return dict(grid=grid, total=len(total))
+    #Count total categories
+    return dict(grid=grid, total=counters.count(db.categories))
 
 
 # User Management Page - Using Py4Web Grid
 @action('user', method=["GET", "POST"])
 @action('user/<path:path>', method=["GET", "POST"])
-@action.uses(db, auth.user, 'user.html')
+@action.uses(metrics, replica.writes, db, auth.user, 'user.html')
 def user(path=None):
 
     grid = Grid(
@@ -78,60 +197,107 @@ def user(path=None):
             ['By Email', lambda val: db.auth_user.email.contains(val)]])
     return dict(grid=grid)
 
+# Lines per page of the invoice pages
+LINES_PAGE_SIZE = 50
+
+
+# One keyset page of the lines of an invoice (in entry order), only those of the
+# products whose code starts with ?product= when given, and the invoice totals
+# (lines, quantity, amount) from one aggregate query
+def invoice_lines_page(details, invoice_field, invoice_id, params, page):
+    paging = page_params(params, order='id')
+    limit = paging['limit'] if params.get('limit') else LINES_PAGE_SIZE
+    query = details[invoice_field] == invoice_id
+    product = (params.get('product') or '').strip()
+    product_ids = None
+    if product:
+        # a subquery, so every matching product counts however many there are
+        product_ids = db(search.code_prefix_query(product))._select(db.product.id)
+        query &= details.product_id.belongs(product_ids)
+    rows, next_cursor = keyset_page(details, query, cursor=paging['cursor'], limit=limit,
+                                    ascending=True)
+    prefetch(rows, details.product_id)
+    # lines before this page, for the line numbers
+    offset = db(query & (details.id <= int(paging['cursor']))).count() if paging['cursor'] else 0
+    summary = counters.invoice_summary(details, invoice_field, invoice_id)
+    filtered = counters.invoice_summary(details, invoice_field, invoice_id, product_ids) \
+        if product else None
+    keep = dict(product=product) if product else {}
+    return dict(invoice_details=rows, offset=offset, product=product, filtered=filtered,
+                total=summary['amount'], total_products=summary['lines'],
+                total_quantity=summary['quantity'],
+                filter_url=URL(page, invoice_id),
+                first_url=URL(page, invoice_id, vars=keep) if paging['cursor'] else None,
+                next_url=URL(page, invoice_id, vars=dict(keep, cursor=next_cursor, limit=limit))
+                if next_cursor else None)
+
+
 # Get specific import invoice by id
 @action('get-import-invoice/<invoice_id:int>', method=["GET"])
-@action.uses(db, auth.user, 'import_invoice.html')
+@action.uses(metrics, replica, db, auth.user, 'import_invoice.html')
 def get_import_invoice(invoice_id=None):
 
     if request.method == "GET":
-        total = 0
-        total_product = []
-
-        invoice = db(db.input_invoice.id == invoice_id).select()
-
-        invoice_details = db(
-            db.input_invoice.id == db.input_invoice_details.input_invoice_id == invoice_id).select()
+        # archived invoices are read from the archive tables (read only)
+        invoice, header, details = archive.find(db.input_invoice, invoice_id)
+        page = invoice_lines_page(details, 'input_invoice_id', invoice_id,
+                                  request.params, 'get-import-invoice')
 
-        products = db(db.product.id > 0).select()
+        return dict(invoice=invoice, archived=header is not db.input_invoice, **page)
 
-        for i in invoice_details:
-            total += int(i.total_price)
-            total_product.append(i.product_id)
+# Version counters of an export invoice page: the invoice (its lines bump it
+# through the header totals) and the catalog (product codes of the lines)
+def invoice_counters(invoice_id):
+    return [versions.row_name(db.output_invoice, invoice_id), 'catalog']
 
-        return dict(invoice=invoice, invoice_details=invoice_details, total=total, products=products, total_products=len(total_product))
 
 # Get specific export invoice with id
 @action('get_invoice/<invoice_id:int>', method=["GET"])
-@action.uses(db, auth.user, 'invoice.html')
+@action.uses(metrics, replica, db, auth.user, pages, 'invoice.html')
+@pages.cached(invoice_counters)
 def get_invoice(invoice_id=None):
 
     if request.method == "GET":
-        total = 0
-        total_product = []
+        invoice, header, details = archive.find(db.output_invoice, invoice_id)
+        page = invoice_lines_page(details, 'output_invoice_id', invoice_id,
+                                  request.params, 'get_invoice')
+
+        return dict(invoice=invoice, error=request.params.get("error"),
+                    archived=header is not db.output_invoice, **page)
+
+# Abort unless invoice_id is a hot invoice of header: archived invoices are
+# read only (403), absent ones 404
+def editable_invoice(header, invoice_id):
+    try:
+        invoice_id = int(invoice_id)
+    except (TypeError, ValueError):
+        abort(400, 'invoice id must be an integer')
+    if db(header.id == invoice_id).isempty():
+        if not db(archive.archive_table(header).id == invoice_id).isempty():
+            abort(403, 'archived invoices can no longer be edited')
+        abort(404)
+    return invoice_id
 
-        invoice = db(db.output_invoice.id == invoice_id).select()
-
-        invoice_details = db(
-            db.output_invoice.id == db.output_invoice_details.output_invoice_id == invoice_id).select()
-
-        products = db(db.product.id > 0).select()
-
-        for i in invoice_details:
-            total += int(i.total_price)
-            total_product.append(i.product_id)
-
-        return dict(invoice=invoice, invoice_details=invoice_details, total=total, products=products, total_products=len(total_product))
 
 # Create product in export in invoice
 @action('post_invoice/<invoice_id:int>', method=["GET", "POST"])
-@action.uses(db, auth.user, 'add.html')
+@action.uses(metrics, replica.writes, db, auth.user, 'add.html')
 def post_invoice(invoice_id=None):
     assert invoice_id is not None
+    editable_invoice(db.output_invoice, invoice_id)
+    product_id = int(request.params.get("productId"))
+    quantity = int(request.params.get("quantity"))
+
+    # hold the stock until the line is committed, never oversell
+    try:
+        stock.reserve(product_id, quantity)
+    except stock.StockError as e:
+        redirect(URL('get_invoice', invoice_id, vars=dict(error=str(e))))
 
     db.output_invoice_details.insert(
         output_invoice_id=invoice_id,
-        product_id=request.params.get("productId"),
-        quantity=int(request.params.get("quantity")),
+        product_id=product_id,
+        quantity=quantity,
         unit_price=int(request.params.get("unit_price"))
     )
    
@@ -141,9 +307,10 @@ def post_invoice(invoice_id=None):
 
 # Create product on import invoice
 @action('post_import_invoice/<invoice_id:int>', method=["GET", "POST"])
-@action.uses(db, auth.user, 'add.html')
+@action.uses(metrics, replica.writes, db, auth.user, 'add.html')
 def post_import_invoice(invoice_id=None):
     assert invoice_id is not None
+    editable_invoice(db.input_invoice, invoice_id)
 
     db.input_invoice_details.insert(
         input_invoice_id=invoice_id,
@@ -157,165 +324,297 @@ def post_import_invoice(invoice_id=None):
     redirect(URL('get-import-invoice', invoice_id))
 
 
+# Read the lines of a bulk entry request: a JSON body, an uploaded CSV file or CSV text
+def bulk_payload():
+    if request.json is not None:
+        return bulk.parse_json(request.json)
+    upload = request.files.get('file')
+    if upload:
+        return bulk.parse_csv(upload.file.read().decode('utf-8-sig'))
+    return bulk.parse_csv(request.params.get('csv') or '')
+
+
+# Delete many invoices of one kind ('invoices' / 'import_invoices') by filter:
+# ids=1,2,3, from/to (created_at) and empty=1 (only invoices without lines).
+# At least one filter is required. The deletion is queued (tasks.py) and the
+# answer, 202 Accepted, does not wait for it.
+@action('delete_invoices/<kind>', method=["POST"])
+@action.uses(metrics, replica.writes, db, auth.user)
+def delete_invoices(kind):
+    if kind not in cleanup.KINDS:
+        abort(404)
+    params = request.json if isinstance(request.json, dict) else request.params
+    ids = params.get('ids')
+    if isinstance(ids, str):
+        ids = [i for i in ids.split(',') if i.strip()]
+    from_date, to_date = params.get('from'), params.get('to')
+    empty = str(params.get('empty', '')).lower() in ('1', 'true', 'yes', 'on')
+    if not (ids or from_date or to_date or empty):
+        abort(400, 'give ids, a date range or empty=1')
+    try:
+        ids = [int(i) for i in ids] if ids else None
+    except (TypeError, ValueError):
+        abort(400, 'ids must be integers')
+    tasks.delete_invoices.delay(kind, ids=ids, from_date=from_date, to_date=to_date,
+                                empty_only=empty)
+    response.status = 202
+    return dict(queued=True, kind=kind)
+
+
+# Add many lines to an export invoice in one request (JSON report per line)
+@action('post_invoice_lines/<invoice_id:int>', method=["POST"])
+@action.uses(metrics, replica.writes, db, auth.user)
+def post_invoice_lines(invoice_id=None):
+    editable_invoice(db.output_invoice, invoice_id)
+    try:
+        lines = bulk_payload()
+    except ValueError as e:
+        return dict(inserted=0, errors=[dict(line=0, error=str(e))])
+    return bulk.add_lines(db.output_invoice_details, 'output_invoice_id', invoice_id, lines,
+                          sign=-1, partial=bool(request.params.get('partial')))
+
+
+# Add many lines to an import invoice in one request (JSON report per line)
+@action('post_import_invoice_lines/<invoice_id:int>', method=["POST"])
+@action.uses(metrics, replica.writes, db, auth.user)
+def post_import_invoice_lines(invoice_id=None):
+    editable_invoice(db.input_invoice, invoice_id)
+    try:
+        lines = bulk_payload()
+    except ValueError as e:
+        return dict(inserted=0, errors=[dict(line=0, error=str(e))])
+    return bulk.add_lines(db.input_invoice_details, 'input_invoice_id', invoice_id, lines,
+                          sign=1, partial=bool(request.params.get('partial')))
+
+
 # Delete import invoice by id
 @action('delete_import_invoice', method=["POST"])
-@action.uses(db, auth.user)
+@action.uses(metrics, replica.writes, db, auth.user)
 def delete_import_invoice():
     if request.params.get("id"):
-
-        db(db.input_invoice.id == request.params.get("id")).delete()
+        invoice_id = editable_invoice(db.input_invoice, request.params.get("id"))
+        # lines in chunks, so a large invoice does not lock the detail table for long
+        cleanup.delete_invoices('import_invoices',
+                                cleanup.invoice_query('import_invoices', ids=[invoice_id]))
 
     redirect(URL('index'))
 
 # Delete product in import invoice
 @action('delete_import_product/<input_invoice_details_id:int>/<invoice_id:int>')
-@action.uses(db, session, auth.user)
+@action.uses(metrics, replica.writes, db, session, auth.user)
 def delete(input_invoice_details_id, invoice_id=None):
     assert input_invoice_details_id, invoice_id is not None
-    db(db.input_invoice_details.id == input_invoice_details_id).delete()
+    editable_invoice(db.input_invoice, invoice_id)
+    db((db.input_invoice_details.id == input_invoice_details_id)
+       & (db.input_invoice_details.input_invoice_id == invoice_id)).delete()
 
     redirect(URL('get-import-invoice', invoice_id))
 
 # Create export invoice
 @action('create_invoice', method=["POST"])
-@action.uses(db, auth.user)
+@action.uses(metrics, replica.writes, db, auth.user)
 def create_export_invoice():
-    if request.params.get("name"):
-
-        db.output_invoice.insert(name=request.params.get("name"))
-        invoice = db(db.output_invoice.name ==
-                     request.params.get("name")).select()
-        invoice_id = invoice[0].id
+    name = request.params.get("name")
+    if not name:
+        redirect(URL('index'))
+    # a retried POST with the same key gets the invoice created the first time
+    invoice_id = idempotency.once('output_invoice', idempotency.request_key(),
+                                  lambda: db.output_invoice.insert(name=name))
 
     redirect(URL('get_invoice', invoice_id))
 
 
 # Create import invoice
 @action('create_import_invoice', method=["POST"])
-@action.uses(db, auth.user)
+@action.uses(metrics, replica.writes, db, auth.user)
 def create_import_invoice():
-    if request.params.get("name"):
-
-        db.input_invoice.insert(name=request.params.get("name"))
-        invoice = db(db.input_invoice.name ==
-                     request.params.get("name")).select()
-        invoice_id = invoice[0].id
+    name = request.params.get("name")
+    if not name:
+        redirect(URL('index'))
+    invoice_id = idempotency.once('input_invoice', idempotency.request_key(),
+                                  lambda: db.input_invoice.insert(name=name))
 
     redirect(URL('get-import-invoice', invoice_id))
 
 # Delete export invoice
 @action('delete_invoice', method=["POST"])
-@action.uses(db, auth.user)
+@action.uses(metrics, replica.writes, db, auth.user)
 def delete_invoice():
     if request.params.get("id"):
-
-        db(db.output_invoice.id == request.params.get("id")).delete()
+        invoice_id = editable_invoice(db.output_invoice, request.params.get("id"))
+        cleanup.delete_invoices('invoices', cleanup.invoice_query('invoices', ids=[invoice_id]))
 
     redirect(URL('index'))
 
 # Delete product in export invoice
 @action('delete_product/<output_invoice_details_id:int>/<invoice_id:int>')
-@action.uses(db, session, auth.user)
+@action.uses(metrics, replica.writes, db, session, auth.user)
 def delete(output_invoice_details_id, invoice_id=None):
     assert output_invoice_details_id, invoice_id is not None
-    db(db.output_invoice_details.id == output_invoice_details_id).delete()
+    editable_invoice(db.output_invoice, invoice_id)
+    db((db.output_invoice_details.id == output_invoice_details_id)
+       & (db.output_invoice_details.output_invoice_id == invoice_id)).delete()
 
     redirect(URL('get_invoice', invoice_id))
 
+# Data of the printed export invoice (print-invoice page and PDF)
+def invoice_data(invoice_id):
+    invoice, header, details = archive.find(db.output_invoice, invoice_id)
+    invoice_details = db(details.output_invoice_id == invoice_id).select()
+    prefetch(invoice_details, details.product_id)
+    header = invoice.first()
+    total = header.total_amount or 0 if header else 0
+    total_product = header.line_count or 0 if header else 0
+    return dict(invoice=invoice, details = invoice_details, total = total, total_product = total_product)
+
 # Create a print hmtl for export invoice
 @action('print-invoice/<invoice_id:int>', method=["GET"])
-@action.uses(db, auth.user, 'hoadon.html')
+@action.uses(metrics, replica, db, auth.user, pages, 'hoadon.html')
+@pages.cached(invoice_counters)
 def invoiceJson(invoice_id):
-    total = 0
-    total_product = []
-    invoice = db(db.output_invoice.id == invoice_id).select()
-    invoice_details = db(db.output_invoice.id == db.output_invoice_details.output_invoice_id ==  invoice_id).select()
-    for i in invoice_details:
-        total += int(i.total_price)
-        total_product.append(i.product_id)
-
-  
-   
     # return dict json 
-    products = db(db.product.id > 0).select()
-    return dict(invoice=invoice, details = invoice_details, total = total, total_product = len(total_product), products = products)
+    return invoice_data(invoice_id)
+
+# Export invoice as a vector PDF rendered on the server, cached on disk per invoice version
+@action('invoice-pdf/<invoice_id:int>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def invoice_pdf_file(invoice_id):
+    user = auth.get_user() or {}
+    seller = ('%s %s' % (user.get('last_name') or '', user.get('first_name') or '')).strip()
+    try:
+        path = invoice_pdf.get_pdf(invoice_id, invoice_data, seller)
+    except RuntimeError as e:
+        abort(501, str(e))
+    if not path:
+        abort(404)
+    return bottle.static_file(os.path.basename(path), root=os.path.dirname(path),
+                       mimetype='application/pdf', download='invoice_%s.pdf' % invoice_id)
 
 # Update custome infor for export invoice
 @action('customer-infor/<invoice_id:int>', method=["POST"])
-@action.uses(db, auth.user)
+@action.uses(metrics, replica.writes, db, auth.user)
 def customer(invoice_id = None):
     assert invoice_id is not None
+    editable_invoice(db.output_invoice, invoice_id)
     invoice = db(db.output_invoice.id == invoice_id)
     invoice.update(customer_name=request.params.get("fullname"),customer_address=request.params.get("address"))
     
 
     redirect(URL('get_invoice', invoice_id))
 
+# Version counters of a statistic report, cached only for closed ranges
+# (ending before today): open ones change with every new invoice line
+def statistic_counters():
+    to_date = request.params.get("to")
+    if request.method != "POST" or not to_date or str(to_date) >= str(datetime.date.today()):
+        return None
+    return [counters.version_name(db.input_invoice_details),
+            counters.version_name(db.output_invoice_details), 'catalog']
+
+
 # Get and calculate data for  report page
 @action('statistic', method=["GET", "POST"])
-@action.uses(db, auth.user, 'statistic.html')
+@action.uses(metrics, replica, db, auth.user, pages, 'statistic.html')
+@pages.cached(statistic_counters)
 def statistic():
     if request.method == "GET":
-        return dict(output_invoice={}, dct={}, message={})
+        return dict(productList=[], message={})
     else:
         fromDate = request.params.get("from")
         toDate = request.params.get("to")
-
-        products = db(((db.output_invoice.id == db.output_invoice_details.output_invoice_id) & (db.output_invoice.created_at >= fromDate) & (db.output_invoice.created_at <= toDate))).select()
-        import_products = db(((db.input_invoice.id == db.input_invoice_details.input_invoice_id) & (db.input_invoice.created_at >= fromDate) & (db.input_invoice.created_at <= toDate))).select()
-    
-        if len(products) == 0:
-            return dict(output_invoice={}, message="Don't have enough data!")
-        else:
-            report = dict()
-            import_report = dict()
-   
- 
-            for p in products: # Tính số lượng hàng hóa xuất nếu chưa có thì thêm vô obj nếu đã có thì cộng thêm value vô đúng key
-                if p.output_invoice_details.product_id in report:
-                    report[p.output_invoice_details.product_id] += p.output_invoice_details.quantity
-                else:
-                    report[p.output_invoice_details.product_id] = p.output_invoice_details.quantity
-            
-            
-            for i in import_products:
-                if i.input_invoice_details.product_id in import_report:
-                    import_report[i.input_invoice_details.product_id] += i.input_invoice_details.quantity
-                else:
-                    import_report[i.input_invoice_details.product_id] = i.input_invoice_details.quantity
-         
-            print(report)
-         
-            for i in report:
-                print(i)
-            arr = []
-            productList = []
-            for im in import_report:
-                product = {
-                    'name' : im,
-                    'import' : import_report[im] , 
-                    'export' : 0 
-                }
-                arr.append(im)
-                productList.append(product)
-            for ex in report:
-                if ex not in arr:
-                    product = {
-                        'name' : ex, 
-                        'import' : 0 ,
-                        'export' : report[ex] #dict['key'] --> value
-                    }
-                    productList.append(product)
-                else:
-                    index = arr.index(ex)
-                    productList[index]['export'] = report[ex] 
-
-              
-        
-        return dict(output_invoice=products, report=report, import_report=import_report, fromDate=fromDate,toDate=toDate, productList=productList)
-
-
-
- 
-    
-
+        byCategory = request.params.get("group") == "category"
+
+        # One GROUP BY query per side, merged on the product (or category) id
+        productList = movement_report(fromDate, toDate, by_category=byCategory)
+
+        if len(productList) == 0:
+            return dict(productList=[], message="Don't have enough data!")
+
+        return dict(productList=productList, fromDate=fromDate, toDate=toDate, byCategory=byCategory, message={})
+
+
+# Import/export series for the charts (JSON):
+# ?from=&to=&bucket=day|week|month&group=all|product|category&ids=1,2,3
+@action('analytics/series', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def analytics_series():
+    ids = [i for i in (request.params.get("ids") or "").split(",") if i.strip().isdigit()]
+    try:
+        return analytics.series(request.params.get("from"), request.params.get("to"),
+                                bucket=request.params.get("bucket") or "day",
+                                group=request.params.get("group") or "all", ids=ids)
+    except ValueError as e:
+        abort(400, str(e))
+
+
+# Top movers (JSON): ?from=&to=&n=10&by=export|import|total&group=product|category
+@action('analytics/top', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def analytics_top():
+    n = request.params.get("n") or "10"
+    try:
+        movers = analytics.top_movers(request.params.get("from"), request.params.get("to"),
+                                      n=min(int(n), 100) if n.isdigit() else 10,
+                                      by=request.params.get("by") or "export",
+                                      group=request.params.get("group") or "product")
+    except ValueError as e:
+        abort(400, str(e))
+    return dict(items=movers)
+
+
+# Send header + records as a CSV (streamed) or XLSX (?format=xlsx) download
+def download(filename, header, records):
+    if request.params.get('format') == 'xlsx':
+        try:
+            path = exports.write_xlsx(header, records, title=filename)
+        except RuntimeError as e:
+            abort(501, str(e))
+        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        response.headers['Content-Disposition'] = 'attachment; filename="%s.xlsx"' % filename
+        return exports.iter_file(path)
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response.headers['Content-Disposition'] = 'attachment; filename="%s.csv"' % filename
+    return exports.with_db(exports.iter_csv(header, records))
+
+
+# Download the report page: ?from=&to=&group=category&format=csv|xlsx
+@action('export/statistic', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def export_statistic():
+    fromDate = request.params.get("from")
+    toDate = request.params.get("to")
+    byCategory = request.params.get("group") == "category"
+    report = movement_report(fromDate, toDate, by_category=byCategory)
+    header, records = exports.statistic(report, by_category=byCategory)
+    return download('report_%s_%s' % (fromDate or 'all', toDate or 'all'), header, records)
+
+
+# Download an invoice list (kind: invoices | import_invoices), ?from=&to=&format=
+@action('export/<kind>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def export_invoices(kind):
+    if kind not in ('invoices', 'import_invoices'):
+        abort(404)
+    header, records = exports.invoice_list(kind, request.params.get("from"), request.params.get("to"))
+    return download(kind, header, records)
+
+
+# Download every invoice line of a date range, ?from=&to=&format=
+@action('export/<kind>/lines', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def export_lines(kind):
+    if kind not in ('invoices', 'import_invoices'):
+        abort(404)
+    header, records = exports.invoice_lines(
+        kind, from_date=request.params.get("from"), to_date=request.params.get("to"))
+    return download('%s_lines' % kind, header, records)
+
+
+# Download the lines of one invoice, ?format=
+@action('export/<kind>/<invoice_id:int>', method=["GET"])
+@action.uses(metrics, replica, db, auth.user)
+def export_invoice(kind, invoice_id):
+    if kind not in ('invoices', 'import_invoices'):
+        abort(404)
+    header, records = exports.invoice_lines(kind, invoice_id=invoice_id)
+    return download('invoice_%s' % invoice_id, header, records)
@@ -0,0 +1,93 @@
+"""
+Row counts and invoice summaries computed in SQL.
+
+Table sizes come from COUNT(*) and are cached per process against the
+'table:<name>' version counter, which the writes to the table bump (see
+track() below), so a page only recounts after the table changed. The
+counters are sharded (see versions.py): every invoice line insert bumps its
+table's one, and must not queue behind the other writers for it.
+Invoice summaries (line count, quantity, amount) are one aggregate query.
+"""
+import threading
+
+from .common import db
+from . import versions
+
+
+def version_name(table):
+    return 'table:' + table._tablename
+
+
+# Bump the table counter on every write. Tables whose rows the database
+# removes by ON DELETE CASCADE are bumped too, since no DAL callback sees them.
+# Updates that only set derived fields (the invoice totals, kept by the line
+# callbacks) are not bumped: the row count is the same and whoever caches
+# those fields follows the detail table counter.
+def track(table, derived=()):
+    name = version_name(table)
+    versions.shard(name)
+    children = [field.tablename for field in table._referenced_by
+                if field.ondelete == 'CASCADE']
+
+    def changed(*args):
+        versions.bump(name)
+
+    def updated(dbset, fields):
+        if any(field not in derived for field in fields):
+            versions.bump(name)
+
+    def cascaded(dbset):
+        for tablename in children:
+            versions.bump('table:' + tablename)
+
+    table._after_insert.append(changed)
+    table._after_update.append(updated)
+    table._after_delete.append(changed)
+    if children:
+        table._after_delete.append(cascaded)
+
+
+class CounterCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    # Row count of each table, recounted only for tables whose version moved
+    def count(self, *tables):
+        names = [version_name(table) for table in tables]
+        current = versions.current_many(names)
+        result = []
+        for table, name in zip(tables, names):
+            version = current.get(name, 0)
+            with self.lock:
+                cached = self.counts.get(name)
+            if cached and cached[0] == version:
+                result.append(cached[1])
+                continue
+            value = db(table.id > 0).count()
+            with self.lock:
+                self.counts[name] = (version, value)
+            result.append(value)
+        return result[0] if len(tables) == 1 else result
+
+
+counter = CounterCache()
+
+
+# Number of rows in a table (cached until the table is written)
+def count(*tables):
+    return counter.count(*tables)
+
+
+# Line count, total quantity and total amount of one invoice, in one query
+# (only of the lines of product_ids, a list or a _select() subquery, when given)
+def invoice_summary(details, invoice_field, invoice_id, product_ids=None):
+    lines = details.id.count()
+    quantity = details.quantity.sum()
+    amount = details.total_price.sum()
+    query = details[invoice_field] == invoice_id
+    if product_ids is not None:
+        query &= details.product_id.belongs(product_ids)
+    row = db(query).select(lines, quantity, amount).first()
+    return dict(lines=row[lines] or 0, quantity=row[quantity] or 0, amount=row[amount] or 0)
@@ -0,0 +1,57 @@
+"""
+Small helpers for the few places that need raw SQL, and for DAL callbacks.
+"""
+import contextlib
+import threading
+
+from .common import db
+
+
+# Database engine name: 'sqlite', 'mysql', 'postgres', ...
+def engine():
+    return db._adapter.dbengine
+
+
+# SQL parameter placeholder of the database driver
+def placeholder():
+    paramstyle = getattr(db._adapter.driver, 'paramstyle', 'qmark')
+    return '?' if paramstyle == 'qmark' else '%s'
+
+
+# Run the statements of the with block in a savepoint: if they fail only
+# they are rolled back, the rest of the transaction can go on and commit
+@contextlib.contextmanager
+def savepoint(name):
+    db.executesql('SAVEPOINT %s' % name)
+    try:
+        yield
+    except BaseException:
+        db.executesql('ROLLBACK TO SAVEPOINT %s' % name)
+        db.executesql('RELEASE SAVEPOINT %s' % name)
+        raise
+    db.executesql('RELEASE SAVEPOINT %s' % name)
+
+
+# Call before(ids) and after(ids) around every DAL update of table setting one
+# of the watched fields, with the ids of the updated rows (read before the
+# update, which may change the columns its query selects on)
+def around_updates(table, watched, before, after):
+    local = threading.local()
+
+    def updating(dbset, fields):
+        if any(name in fields for name in watched):
+            ids = [row.id for row in dbset.select(table.id)]
+            if ids:
+                before(ids)
+                local.__dict__.setdefault('pending', []).append((fields, ids))
+
+    def updated(dbset, fields):
+        pending = local.__dict__.get('pending', [])
+        for i, (pending_fields, ids) in enumerate(pending):
+            if pending_fields is fields:
+                del pending[i]
+                after(ids)
+                return
+
+    table._before_update.append(updating)
+    table._after_update.append(updated)
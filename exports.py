@@ -0,0 +1,167 @@
+"""
+Streaming CSV / XLSX exports.
+
+Rows are read in keyset batches (id > last id, BATCH rows at a time) and
+passed through generators, so an export holds at most one batch in memory
+whatever the date range. Ranges reaching before the newest archived invoice
+also read the archive tables (see archive.py), older invoices first. CSV is
+streamed straight to the client; XLSX is written row by row with openpyxl's
+write-only mode to a temporary file which is then streamed (openpyxl is
+optional: pip install openpyxl).
+"""
+import csv
+import io
+import itertools
+import os
+import tempfile
+
+from .common import db
+from . import archive
+
+BATCH = 1000
+
+
+# Yield the rows matching query in id order, BATCH rows per query.
+# id_field is the id the keyset runs on (the first table of a join).
+def iter_rows(query, fields, id_field, batch=BATCH, **kwargs):
+    last_id = 0
+    while True:
+        rows = db(query & (id_field > last_id)).select(
+            *fields, orderby=id_field, limitby=(0, batch), **kwargs)
+        for row in rows:
+            yield row
+        if len(rows) < batch:
+            return
+        last_id = rows.last()[id_field]
+
+
+# CSV bytes, in chunks of about 64KB, for a header and an iterable of value lists
+def iter_csv(header, records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for record in records:
+        writer.writerow(record)
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# Keep a database connection while a lazy response body is consumed: the
+# body is iterated after the action returned and its fixtures finished, on
+# the connection (primary or replica) the action was routed to
+def with_db(chunks):
+    return _consume(db.routed(), chunks)
+
+
+def _consume(adapter, chunks):
+    db.route(adapter)
+    db._adapter.reconnect()
+    # then give the connection back to the pool (or close it) as py4web's
+    # DAL fixture does at the end of a request
+    try:
+        for chunk in chunks:
+            yield chunk
+    except BaseException:
+        db.recycle_connection_in_pool_or_close('rollback')
+        raise
+    else:
+        db.recycle_connection_in_pool_or_close('commit')
+    finally:
+        db.route(None)
+
+
+# Write an XLSX file row by row (write-only workbook), return its path
+def write_xlsx(header, records, title='Sheet'):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError('XLSX export requires openpyxl (pip install openpyxl)')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title[:31])
+    sheet.append(header)
+    for record in records:
+        sheet.append(list(record))
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    workbook.save(path)
+    return path
+
+
+# Stream a file in chunks and remove it at the end
+def iter_file(path, chunk_size=64 * 1024):
+    try:
+        with open(path, 'rb') as stream:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+# Header and records of the invoice list of one kind ('invoices' / 'import_invoices')
+def invoice_list(kind, from_date=None, to_date=None):
+    hot = db.output_invoice if kind == 'invoices' else db.input_invoice
+    header = ['id', 'name', 'customer_name', 'customer_address', 'created_at', 'lines', 'total']
+    return header, itertools.chain.from_iterable(
+        _invoice_records(table, from_date, to_date)
+        for table in archive.header_tables(hot, from_date, to_date))
+
+
+def _invoice_records(table, from_date, to_date):
+    query = table.id > 0
+    if from_date:
+        query &= table.created_at >= from_date
+    if to_date:
+        query &= table.created_at <= to_date
+    fields = [table.id, table.name, table.customer_name, table.customer_address,
+              table.created_at, table.line_count, table.total_amount]
+    return ([row.id, row.name, row.customer_name, row.customer_address, row.created_at,
+             row.line_count or 0, row.total_amount or 0]
+            for row in iter_rows(query, fields, table.id))
+
+
+# Header and records of the lines of one invoice, or of all the invoices in a
+# date range when invoice_id is None
+def invoice_lines(kind, invoice_id=None, from_date=None, to_date=None):
+    hot = db.output_invoice if kind == 'invoices' else db.input_invoice
+    if invoice_id is not None:
+        tables = [archive.find(hot, invoice_id)[1]]
+    else:
+        tables = archive.header_tables(hot, from_date, to_date)
+    header = ['line_id', 'invoice_id', 'invoice', 'created_at', 'product_code', 'description',
+              'quantity', 'unit_price', 'total_price']
+    return header, itertools.chain.from_iterable(
+        _line_records(table, invoice_id, from_date, to_date) for table in tables)
+
+
+def _line_records(header_table, invoice_id, from_date, to_date):
+    details, invoice_field = archive.details_of(header_table)
+    query = (details[invoice_field] == header_table.id) & (details.product_id == db.product.id)
+    if invoice_id is not None:
+        query &= details[invoice_field] == invoice_id
+    if from_date:
+        query &= header_table.created_at >= from_date
+    if to_date:
+        query &= header_table.created_at <= to_date
+    fields = [details.id, header_table.id, header_table.name, header_table.created_at,
+              db.product.product_code, db.product.description,
+              details.quantity, details.unit_price, details.total_price]
+    return ([row[details].id, row[header_table].id, row[header_table].name,
+             row[header_table].created_at, row.product.product_code, row.product.description,
+             row[details].quantity, row[details].unit_price, row[details].total_price]
+            for row in iter_rows(query, fields, details.id))
+
+
+# Header and records of the statistic report (see reports.movement_report)
+def statistic(report, by_category=False):
+    header = ['category' if by_category else 'product_code', 'description',
+              'import', 'export', 'balance', 'import_amount', 'export_amount']
+    records = ([line['name'] if by_category else line['code'], '' if by_category else line['name'],
+                line['import'], line['export'], line['import'] - line['export'],
+                line['import_amount'], line['export_amount']] for line in report)
+    return header, records
@@ -0,0 +1,63 @@
+"""
+Idempotency keys for POSTs that create rows.
+
+A client (the create forms, or a terminal that retries) sends a key with the
+request, as an Idempotency-Key header or an idempotency_key form field. The
+first request with a key claims it by inserting it into idempotency_key
+(unique on scope + key) in the same transaction as the row it creates, and
+stores the new id there. A retry with the same key finds that id and gets the
+original result. A concurrent duplicate blocks on the unique index until the
+first transaction ends, then reads its result. Keys expire after
+IDEMPOTENCY_TTL seconds and are purged by a periodic task (tasks.py).
+"""
+import datetime
+
+from py4web import request
+
+from .common import db, settings
+
+
+# The key sent with the current request, None if there is none
+def request_key():
+    key = request.headers.get('Idempotency-Key') or request.params.get('idempotency_key')
+    key = (key or '').strip()
+    return key[:100] or None
+
+
+def _lookup(name, now):
+    row = db(db.idempotency_key.name == name).select(limitby=(0, 1)).first()
+    if row and row.expires_at and row.expires_at < now:
+        db(db.idempotency_key.id == row.id).delete()
+        return None
+    return row
+
+
+# Run create() once per (scope, key) and return its id; a repeated key
+# returns the id created the first time. Without a key create() just runs.
+def once(scope, key, create):
+    if not key:
+        return create()
+    name = '%s:%s' % (scope, key)
+    now = datetime.datetime.utcnow()
+    row = _lookup(name, now)
+    if row is not None:
+        return row.result_id
+    try:
+        claim_id = db.idempotency_key.insert(
+            name=name, created_at=now,
+            expires_at=now + datetime.timedelta(seconds=settings.IDEMPOTENCY_TTL))
+    except db._adapter.driver.IntegrityError:
+        # claimed by a concurrent request that has committed since
+        db.rollback()
+        row = _lookup(name, now)
+        if row is None or row.result_id is None:
+            raise
+        return row.result_id
+    result_id = create()
+    db(db.idempotency_key.id == claim_id).update(result_id=result_id)
+    return result_id
+
+
+# Delete the expired keys, returns how many were deleted
+def purge():
+    return db(db.idempotency_key.expires_at < datetime.datetime.utcnow()).delete()
@@ -0,0 +1,111 @@
+"""
+Secondary indexes for the hot query paths, and an EXPLAIN helper.
+
+create_indexes() is called at startup (when migrations are enabled) and is
+idempotent: each index is looked up in the catalog of the database first
+(sqlite_master on SQLite, information_schema on MySQL) and only created when
+missing. explain_all() prints the plan of the main query of each action so
+a missing index shows up as a full scan.
+"""
+from .common import db
+from .dbutils import engine, placeholder
+from . import search
+
+# (index name, table, columns[, unique])
+INDEXES = [
+    ('idx_input_details_invoice_product', 'input_invoice_details', ['input_invoice_id', 'product_id']),
+    ('idx_output_details_invoice_product', 'output_invoice_details', ['output_invoice_id', 'product_id']),
+    ('idx_input_details_product', 'input_invoice_details', ['product_id']),
+    ('idx_output_details_product', 'output_invoice_details', ['product_id']),
+    ('idx_input_invoice_created_at', 'input_invoice', ['created_at', 'id']),
+    ('idx_output_invoice_created_at', 'output_invoice', ['created_at', 'id']),
+    ('idx_product_code', 'product', ['product_code']),
+    ('idx_product_category', 'product', ['categories_id']),
+    ('idx_categories_name', 'categories', ['name']),
+    ('uniq_daily_movement_date_product', 'daily_product_movement', ['date', 'product_id'], True),
+    ('uniq_product_trigram', 'product_trigram', ['trigram', 'product_id'], True),
+    ('idx_product_trigram_product', 'product_trigram', ['product_id']),
+    ('idx_idempotency_key_expires_at', 'idempotency_key', ['expires_at']),
+    ('idx_input_details_archive_invoice_product', 'input_invoice_details_archive', ['input_invoice_id', 'product_id']),
+    ('idx_output_details_archive_invoice_product', 'output_invoice_details_archive', ['output_invoice_id', 'product_id']),
+    ('idx_input_invoice_archive_created_at', 'input_invoice_archive', ['created_at', 'id']),
+    ('idx_output_invoice_archive_created_at', 'output_invoice_archive', ['created_at', 'id']),
+]
+
+
+def _exists(name, table):
+    p = placeholder()
+    if engine() == 'sqlite':
+        rows = db.executesql(
+            "SELECT name FROM sqlite_master WHERE type='index' AND name=%s;" % p, (name,))
+    elif engine() == 'mysql':
+        rows = db.executesql(
+            "SELECT index_name FROM information_schema.statistics"
+            " WHERE table_schema=DATABASE() AND table_name=%s AND index_name=%s;" % (p, p),
+            (table._raw_rname, name))
+    else:
+        return False
+    return bool(rows)
+
+
+# Create the missing indexes, returns the names of the indexes created
+def create_indexes(indexes=INDEXES):
+    created = []
+    for name, tablename, columns, *unique in indexes:
+        if tablename not in db.tables:
+            continue
+        table = db[tablename]
+        if _exists(name, table):
+            continue
+        # other engines (postgres) understand IF NOT EXISTS
+        if_not_exists = '' if engine() == 'mysql' else 'IF NOT EXISTS '
+        db.executesql('CREATE %sINDEX %s%s ON %s (%s);' % (
+            'UNIQUE ' if unique and unique[0] else '', if_not_exists, name, table._rname,
+            ', '.join(table[column]._rname for column in columns)))
+        created.append(name)
+    db.commit()
+    return created
+
+
+# The main query of each action, as SQL built by the DAL with sample arguments
+def main_queries():
+    out, inp = db.output_invoice_details, db.input_invoice_details
+    quantity = out.quantity.sum()
+    return [
+        ('index: export invoices page', db(db.output_invoice.id > 0)._select(
+            db.output_invoice.id, db.output_invoice.name, db.output_invoice.created_at,
+            orderby=~db.output_invoice.id, limitby=(0, 21))),
+        ('index: products page', db(db.product.id > 0)._select(
+            db.product.id, db.product.product_code, orderby=~db.product.id, limitby=(0, 21))),
+        ('get_invoice: lines', db(out.output_invoice_id == 1)._select(out.ALL)),
+        ('get-import-invoice: lines', db(inp.input_invoice_id == 1)._select(inp.ALL)),
+        ('statistic: exports per product', db(
+            (db.output_invoice.created_at >= '2021-01-01')
+            & (db.output_invoice.created_at <= '2021-12-31')
+            & (out.output_invoice_id == db.output_invoice.id)
+            & (out.product_id == db.product.id))._select(
+                db.product.id, quantity, groupby=db.product.id)),
+        ('product: search by code', db(search.code_prefix_query('A'))._select(
+            db.product.id, orderby=db.product.product_code, limitby=(0, 10))),
+        ('product: search by description', db(
+            db.product_trigram.trigram.belongs(['abc', 'bcd']))._select(
+                db.product_trigram.product_id, groupby=db.product_trigram.product_id,
+                having=db.product_trigram.trigram.count() >= 2, limitby=(0, 50))),
+        ('category: search by name', db(db.categories.name == 'x')._select(db.categories.id)),
+        ('categories: products page', db(db.product.categories_id == 1)._select(
+            db.product.id, db.product.product_code, orderby=~db.product.id, limitby=(0, 21))),
+        ('stock: one category', db(db.product.categories_id == 1)._select(
+            db.product.id, db.product_stock.quantity,
+            left=db.product_stock.on(db.product_stock.product_id == db.product.id))),
+        ('stock: one product', db(db.product_stock.product_id == 1)._select(
+            db.product_stock.quantity)),
+    ]
+
+
+# EXPLAIN each main query, returns [(label, sql, plan rows)]
+def explain_all():
+    prefix = 'EXPLAIN QUERY PLAN ' if engine() == 'sqlite' else 'EXPLAIN '
+    plans = []
+    for label, sql in main_queries():
+        plans.append((label, sql, db.executesql(prefix + sql)))
+    return plans
@@ -0,0 +1,122 @@
+"""
+Server-side invoice PDF rendering with an on-disk render cache.
+
+The PDF is drawn as vector text and lines with reportlab (optional:
+pip install reportlab) from the same data as the print-invoice page.
+Rendered files are stored in settings.PDF_CACHE_FOLDER under a name built
+from the invoice id and a hash of the invoice version counter (bumped on
+every header or line change, see versions.watch_rows) and the seller name,
+so a repeated print is served straight from the file and any edit makes
+the next print render a new one. Older files of the same invoice are
+removed when a new one is written.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from . import settings, versions
+from .common import db
+
+# bump when the layout changes to invalidate every cached file
+LAYOUT_VERSION = 1
+TAX_RATE = 10
+
+
+def _prefix(invoice_id):
+    return os.path.join(settings.PDF_CACHE_FOLDER, 'invoice_%s_' % int(invoice_id))
+
+
+# Cache file path of an invoice for the current invoice version and seller
+def cache_path(invoice_id, seller=''):
+    version = versions.current(versions.row_name(db.output_invoice, invoice_id))
+    key = '%s:%s:%s:%s' % (LAYOUT_VERSION, invoice_id, version, seller)
+    return _prefix(invoice_id) + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.pdf'
+
+
+# Remove every cached file of an invoice (except keep, if given)
+def forget(invoice_id, keep=None):
+    for path in glob.glob(_prefix(invoice_id) + '*.pdf'):
+        if path != keep:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+# Draw the invoice into a PDF file at path
+def render(path, invoice, details, total, seller=''):
+    try:
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    except ImportError:
+        raise RuntimeError('PDF rendering requires reportlab (pip install reportlab)')
+
+    styles = getSampleStyleSheet()
+    created_at = invoice.created_at or ''
+    story = [
+        Paragraph('CIT TECH SHOP', styles['Title']),
+        Paragraph('INVOICE %s' % escape(invoice.name or ''), styles['Heading2']),
+        Paragraph('Customer Name: %s' % escape(invoice.customer_name or ''), styles['Normal']),
+        Paragraph('Address: %s' % escape(invoice.customer_address or ''), styles['Normal']),
+        Paragraph('Date: %s' % '-'.join(reversed(created_at.split('-'))), styles['Normal']),
+        Spacer(1, 12),
+    ]
+    rows = [['#', 'PRODUCT', 'QUANTITY', '$ / UNIT', 'NET PRICE']]
+    quantity = 0
+    for index, line in enumerate(details, 1):
+        quantity += line.quantity or 0
+        rows.append([index, line.product.product_code if line.product else '',
+                     line.quantity, '%s $' % line.unit_price, '%s $' % line.total_price])
+    tax = total * TAX_RATE / 100
+    rows.append(['', 'Subtotal', quantity, '', '%s $' % total])
+    rows.append(['', 'Tax (%s%%)' % TAX_RATE, '', '', '%s $' % tax])
+    rows.append(['', 'Total', '', '', '%s $' % (total + tax)])
+    table = Table(rows, colWidths=[30, 200, 70, 80, 100], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('LINEBELOW', (0, 0), (-1, 0), 1, colors.black),
+        ('LINEABOVE', (0, -3), (-1, -3), 1, colors.black),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('ALIGN', (2, 0), (-1, -1), 'RIGHT'),
+    ]))
+    story += [table, Spacer(1, 24),
+              Paragraph('BUYER: %s' % escape(invoice.customer_name or ''), styles['Normal']),
+              Paragraph('SELLER: %s' % escape(seller), styles['Normal'])]
+
+    # write next to the final file and rename, so readers never see a partial PDF
+    handle, tmp = tempfile.mkstemp(suffix='.pdf', dir=os.path.dirname(path))
+    os.close(handle)
+    try:
+        SimpleDocTemplate(tmp, pagesize=A4, title=invoice.name or 'invoice').build(story)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+# Path of the PDF of an invoice, rendered only when the cached file is missing.
+# load() returns the print-invoice data (invoice rows, details, total, ...).
+def get_pdf(invoice_id, load, seller=''):
+    path = cache_path(invoice_id, seller)
+    if not os.path.exists(path):
+        data = load(invoice_id)
+        invoice = data['invoice'].first()
+        if not invoice:
+            return None
+        render(path, invoice, data['details'], data['total'], seller)
+        forget(invoice_id, keep=path)
+    return path
+
+
+# Remove the cached files of invoices when they are deleted
+def track(header):
+
+    def invoices_deleted(dbset):
+        for row in dbset.select(header.id):
+            forget(row.id)
+
+    header._before_delete.append(invoices_deleted)
@@ -0,0 +1,135 @@
+"""
+Maintenance commands for this app. Run them from the folder that contains
+the py4web "apps" folder, for example:
+
+    python -m apps.{appname}.manage reconcile-stock
+    python -m apps.{appname}.manage reconcile-stock --dry-run
+    python -m apps.{appname}.manage backfill-totals
+    python -m apps.{appname}.manage explain
+    python -m apps.{appname}.manage reindex-search
+    python -m apps.{appname}.manage archive --before 2024-01-01
+    python -m apps.{appname}.manage delete-invoices invoices --empty
+"""
+import argparse
+
+from .common import db
+from . import models, stock, totals, indexes, rollup, search, archive, cleanup
+
+
+# Rebuild product_stock from the invoice detail tables and report drift
+def reconcile_stock(args):
+    drift = stock.reconcile(fix=not args.dry_run)
+    for product_id, have, want in drift:
+        print("product %s: ledger %s, expected %s" % (product_id, have, want))
+    print("%s product(s) drifted%s" % (len(drift), " (not fixed)" if args.dry_run else ""))
+
+
+# Recompute stored line totals and the denormalized invoice totals
+def backfill_totals(args):
+    totals.backfill(db.input_invoice, db.input_invoice_details, 'input_invoice_id')
+    totals.backfill(db.output_invoice, db.output_invoice_details, 'output_invoice_id')
+    print("invoice totals recomputed")
+
+
+# Create the missing secondary indexes
+def create_indexes(args):
+    created = indexes.create_indexes()
+    print("created: %s" % (", ".join(created) or "nothing, all indexes exist"))
+
+
+# Print the EXPLAIN plan of the main query of each action
+def explain(args):
+    for label, sql, plan in indexes.explain_all():
+        print("== %s\n%s" % (label, sql))
+        for row in plan:
+            print("   ", row)
+
+
+# Fold the new invoice lines into the daily movement rollup now
+def run_rollup(args):
+    for name, folded in rollup.run().items():
+        print("%s: %s line(s) folded" % (name, folded))
+
+
+# Rebuild the product description trigram index
+def reindex_search(args):
+    print("%s product(s) indexed" % search.reindex())
+
+
+# Move the invoices created before a date into the archive tables
+def archive_invoices(args):
+    def progress(table, moved):
+        print("%s: %s invoice(s) archived" % (table, moved))
+
+    moved = archive.archive(args.before, batch=args.batch, progress=progress)
+    print("archived: %s" % ", ".join("%s %s" % (name, count) for name, count in moved.items()))
+
+
+# Delete the invoices matching the filters, in chunks
+def delete_invoices(args):
+    if not (args.ids or args.from_date or args.to_date or args.empty):
+        raise SystemExit("give --ids, --from/--to or --empty")
+    ids = [int(i) for i in args.ids.split(",") if i.strip()] if args.ids else None
+    query = cleanup.invoice_query(args.kind, ids=ids, from_date=args.from_date,
+                                  to_date=args.to_date, empty_only=args.empty)
+    if args.dry_run:
+        print("%s invoice(s) would be deleted" % db(query).count())
+        return
+
+    def progress(table, deleted):
+        print("%s: %s row(s) deleted" % (table, deleted))
+
+    result = cleanup.delete_invoices(args.kind, query, chunk=args.chunk, progress=progress)
+    print("deleted %(invoices)s invoice(s), %(lines)s line(s)" % result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inventory maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("reconcile-stock", help="rebuild product_stock from the invoice lines")
+    cmd.add_argument("--dry-run", action="store_true", help="only report the drift")
+    cmd.set_defaults(func=reconcile_stock)
+
+    cmd = commands.add_parser("backfill-totals", help="recompute invoice total_amount/line_count")
+    cmd.set_defaults(func=backfill_totals)
+
+    cmd = commands.add_parser("create-indexes", help="create the missing secondary indexes")
+    cmd.set_defaults(func=create_indexes)
+
+    cmd = commands.add_parser("explain", help="print the query plan of each action's main query")
+    cmd.set_defaults(func=explain)
+
+    cmd = commands.add_parser("rollup", help="fold new invoice lines into daily_product_movement")
+    cmd.set_defaults(func=run_rollup)
+
+    cmd = commands.add_parser("reindex-search", help="rebuild the product search trigram index")
+    cmd.set_defaults(func=reindex_search)
+
+    cmd = commands.add_parser("archive", help="move old invoices into the archive tables")
+    cmd.add_argument("--before", help="created before this date, YYYY-MM-DD "
+                                      "(default: ARCHIVE_AFTER_DAYS days ago)")
+    cmd.add_argument("--batch", type=int, default=archive.BATCH, help="invoices per transaction")
+    cmd.set_defaults(func=archive_invoices)
+
+    cmd = commands.add_parser("delete-invoices", help="delete invoices in chunks by filter")
+    cmd.add_argument("kind", choices=sorted(cleanup.KINDS))
+    cmd.add_argument("--ids", help="comma separated invoice ids")
+    cmd.add_argument("--from", dest="from_date", help="created on or after YYYY-MM-DD")
+    cmd.add_argument("--to", dest="to_date", help="created on or before YYYY-MM-DD")
+    cmd.add_argument("--empty", action="store_true", help="only invoices without lines")
+    cmd.add_argument("--chunk", type=int, default=cleanup.CHUNK, help="invoices per chunk")
+    cmd.add_argument("--dry-run", action="store_true", help="only count the invoices")
+    cmd.set_defaults(func=delete_invoices)
+
+    args = parser.parse_args(argv)
+    try:
+        args.func(args)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+if __name__ == "__main__":
+    main()
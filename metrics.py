@@ -0,0 +1,193 @@
+"""
+Per-request database instrumentation and Prometheus metrics.
+
+Add the `metrics` fixture first in action.uses, before db, so it also
+covers the other fixtures and the template:
+
+    @action.uses(metrics, db, auth.user, 'index.html')
+
+For every request it records the number of SQL statements, the total SQL
+time, the slowest statement and the rows fetched (counted in a pydal
+execution handler and the adapter's row parser, so statements of other
+threads are never mixed in). Requests slower than SLOW_REQUEST_MS are
+written to SLOW_REQUEST_LOG; all of them are aggregated per action into
+histograms served by the /metrics action in the Prometheus text format.
+Metrics are per worker process, Prometheus sums the workers.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from pydal.helpers.classes import ExecutionHandler
+from py4web import request, response
+from py4web.core import Fixture
+
+from .common import db, settings, replica
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+slow_log = logging.getLogger("py4web:%s.slow" % settings.APP_NAME)
+if settings.SLOW_REQUEST_LOG and not slow_log.handlers:
+    _handler = logging.FileHandler(settings.SLOW_REQUEST_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.INFO)
+    slow_log.propagate = False
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    # Prometheus lines of this histogram, cumulative buckets
+    def lines(self, name, labels):
+        out, cumulative = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            out.append('%s_bucket{%s,le="%s"} %s' % (name, labels, bound, cumulative))
+        out.append('%s_sum{%s} %s' % (name, labels, round(self.total, 6)))
+        out.append('%s_count{%s} %s' % (name, labels, cumulative))
+        return out
+
+
+# Statistics of the request running in this thread
+class RequestStats:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.slowest = (0.0, None)
+
+
+class RequestMetrics(Fixture):
+
+    def __init__(self, db, slow_ms=None, replica=None):
+        self.db = db
+        self.slow_ms = slow_ms
+        self.replica = replica
+        # not self.local: that is a read-only property of py4web's Fixture
+        self._tls = threading.local()
+        self.lock = threading.Lock()
+        self.actions = {}
+        self._install()
+
+    # Hook the DAL: count and time statements, count parsed rows
+    def _install(self):
+        metrics = self
+
+        class Handler(ExecutionHandler):
+            def before_execute(self, command):
+                self.started = time.perf_counter()
+
+            def after_execute(self, command):
+                stats = metrics.current()
+                if stats is not None:
+                    elapsed = time.perf_counter() - self.started
+                    stats.queries += 1
+                    stats.sql_time += elapsed
+                    if elapsed > stats.slowest[0]:
+                        stats.slowest = (elapsed, command)
+
+        # on the adapters (the primary's and the replica's): each one copies
+        # db.execution_handlers when it is created
+        for adapter in [self.db._adapter, getattr(self.replica, 'adapter', None)]:
+            if adapter is not None:
+                adapter.execution_handlers = list(adapter.execution_handlers) + [Handler]
+                self._count_rows(adapter)
+
+    # Count the rows the adapter parses
+    def _count_rows(self, adapter):
+        metrics = self
+        parse = adapter.parse
+
+        def counting_parse(rows, *args, **kwargs):
+            stats = metrics.current()
+            if stats is not None:
+                stats.rows += len(rows)
+            return parse(rows, *args, **kwargs)
+
+        adapter.parse = counting_parse
+
+    def current(self):
+        return getattr(self._tls, 'stats', None)
+
+    # the signatures of the fixture hooks differ between py4web versions
+    def on_request(self, *args):
+        self._tls.stats = RequestStats()
+
+    def on_error(self, *args):
+        self._finish('500')
+
+    def on_success(self, *args):
+        self._finish(str(response.status_code))
+
+    def _finish(self, status):
+        stats = self.current()
+        if stats is None:
+            return
+        self._tls.stats = None
+        elapsed = time.perf_counter() - stats.started
+        route = request.environ.get('bottle.route')
+        name = route.rule if route is not None else request.path
+        with self.lock:
+            entry = self.actions.get(name)
+            if entry is None:
+                entry = self.actions[name] = dict(
+                    duration=Histogram(DURATION_BUCKETS), sql=Histogram(DURATION_BUCKETS),
+                    queries=Histogram(QUERY_BUCKETS), rows=0, statuses={})
+            entry['duration'].observe(elapsed)
+            entry['sql'].observe(stats.sql_time)
+            entry['queries'].observe(stats.queries)
+            entry['rows'] += stats.rows
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+        slow_ms = self.slow_ms if self.slow_ms is not None else settings.SLOW_REQUEST_MS
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            slow_log.info('%s %s %s %.1fms queries=%s sql=%.1fms rows=%s slowest=%.1fms %s' % (
+                request.method, request.fullpath, status, elapsed * 1000, stats.queries,
+                stats.sql_time * 1000, stats.rows, stats.slowest[0] * 1000,
+                ' '.join(str(stats.slowest[1] or '').split())[:500]))
+
+    # All the aggregated metrics in the Prometheus text format
+    def exposition(self):
+        prefix = 'inventory'
+        out = [
+            '# HELP %s_request_seconds Request duration.' % prefix,
+            '# TYPE %s_request_seconds histogram' % prefix,
+        ]
+        sections = {'sql': [], 'queries': [], 'rows': [], 'status': []}
+        with self.lock:
+            for name in sorted(self.actions):
+                entry = self.actions[name]
+                labels = 'action="%s"' % name.replace('\\', '\\\\').replace('"', '\\"')
+                out += entry['duration'].lines('%s_request_seconds' % prefix, labels)
+                sections['sql'] += entry['sql'].lines('%s_request_sql_seconds' % prefix, labels)
+                sections['queries'] += entry['queries'].lines(
+                    '%s_request_queries' % prefix, labels)
+                sections['rows'].append('%s_request_rows_fetched_total{%s} %s' % (
+                    prefix, labels, entry['rows']))
+                for status, count in sorted(entry['statuses'].items()):
+                    sections['status'].append('%s_requests_total{%s,status="%s"} %s' % (
+                        prefix, labels, status, count))
+        out += ['# HELP %s_request_sql_seconds SQL time per request.' % prefix,
+                '# TYPE %s_request_sql_seconds histogram' % prefix] + sections['sql']
+        out += ['# HELP %s_request_queries SQL statements per request.' % prefix,
+                '# TYPE %s_request_queries histogram' % prefix] + sections['queries']
+        out += ['# HELP %s_request_rows_fetched_total Rows fetched by the DAL.' % prefix,
+                '# TYPE %s_request_rows_fetched_total counter' % prefix] + sections['rows']
+        out += ['# HELP %s_requests_total Requests by status.' % prefix,
+                '# TYPE %s_requests_total counter' % prefix] + sections['status']
+        return '\n'.join(out) + '\n'
+
+
+metrics = RequestMetrics(db, replica=replica)
@@ -3,6 +3,7 @@
 
 import datetime
 from .common import db, Field, auth
+from . import settings, stock, versions, counters, totals, indexes, invoice_pdf, rollup, search
 from pydal.validators import *
 
 
@@ -52,21 +53,22 @@ db.define_table(
     Field('name', 'text'),
     Field('customer_name','text'),
     Field('customer_address','text'),
-    Field('created_at', default=get_time)
+    Field('created_at', default=get_time),
+    Field('total_amount', 'integer', default=0),
+    Field('line_count', 'integer', default=0)
 )
 
 # Input invoice details
 db.define_table(
     'input_invoice_details',
-    Field('input_invoice_id', 'reference input_invoice',
-          filter_out=lambda input_invoice: input_invoice.name if input_invoice else ''),
-    Field('product_id', 'reference product',
-          filter_out=lambda product: product.product_code if product else ''),
+    Field('input_invoice_id', 'reference input_invoice'),
+    Field('product_id', 'reference product'),
     Field('quantity', 'integer'),
     Field('unit_price', 'integer'),
-    Field('total_price', compute=lambda row: row.quantity * row.unit_price)
+    Field('total_price', 'integer', compute=lambda row: row.quantity * row.unit_price)
 )
 db.input_invoice_details.total_price.writable = False
+db.input_invoice.total_amount.writable = db.input_invoice.line_count.writable = False
 db.input_invoice_details.input_invoice_id.requires = IS_IN_DB(
     db, db.input_invoice.id, '%(name)s')
 db.input_invoice_details.product_id.requires = IS_IN_DB(
@@ -78,21 +80,127 @@ db.define_table(
     Field('name', 'text'),
     Field('customer_name','text'),
     Field('customer_address','text'),
-    Field('created_at', default=get_time)
+    Field('created_at', default=get_time),
+    Field('total_amount', 'integer', default=0),
+    Field('line_count', 'integer', default=0)
 )
 
 # Output (Export) invoice details
 db.define_table(
     'output_invoice_details',
-    Field('output_invoice_id', 'reference output_invoice',
-          filter_out=lambda output_invoice: output_invoice.name if output_invoice else ''),
-    Field('product_id', 'reference product',
-          filter_out=lambda product: product.product_code if product else ''),
+    Field('output_invoice_id', 'reference output_invoice'),
+    Field('product_id', 'reference product'),
     Field('quantity', 'integer'),
     Field('unit_price', 'integer'),
-    Field('total_price', compute=lambda row: row.quantity * row.unit_price)
+    Field('total_price', 'integer', compute=lambda row: row.quantity * row.unit_price)
+)
+db.output_invoice_details.total_price.writable = False
+db.output_invoice.total_amount.writable = db.output_invoice.line_count.writable = False
+
+# On-hand stock per product, maintained by the invoice detail callbacks (see stock.py);
+# version is bumped on every change, for the optimistic reservations of export lines
+db.define_table(
+    'product_stock',
+    Field('product_id', 'reference product', unique=True),
+    Field('quantity', 'integer', default=0),
+    Field('version', 'integer', default=0)
+)
+
+stock.track(db.input_invoice, db.input_invoice_details, 'input_invoice_id', sign=1)
+stock.track(db.output_invoice, db.output_invoice_details, 'output_invoice_id', sign=-1)
+
+totals.track(db.input_invoice, db.input_invoice_details, 'input_invoice_id')
+totals.track(db.output_invoice, db.output_invoice_details, 'output_invoice_id')
+
+# Version counters bumped by writes, used to invalidate caches (see versions.py)
+db.define_table(
+    'data_version',
+    Field('name', length=128, unique=True),
+    Field('version', 'integer', default=0)
 )
 
+versions.watch(db.product, 'catalog')
+versions.watch(db.categories, 'catalog', 'categories')
+
+for table in (db.categories, db.product, db.input_invoice_details, db.output_invoice_details):
+    counters.track(table)
+for table in (db.input_invoice, db.output_invoice):
+    counters.track(table, derived=('total_amount', 'line_count'))
+
+# Per-row versions (ETags of the JSON API, invoice PDF cache): line changes
+# update the header totals, so they bump the invoice too
+versions.watch_rows(db.output_invoice)
+versions.watch_rows(db.input_invoice)
+versions.watch_rows(db.product)
+invoice_pdf.track(db.output_invoice)
+
+# Daily import/export per product, folded in by the rollup task (see rollup.py)
+db.define_table(
+    'daily_product_movement',
+    Field('date', 'date'),
+    Field('product_id', 'reference product'),
+    Field('qty_in', 'integer', default=0),
+    Field('qty_out', 'integer', default=0),
+    Field('amount_in', 'integer', default=0),
+    Field('amount_out', 'integer', default=0)
+)
+
+# High-water marks of the rollup, one row per detail table
+db.define_table(
+    'rollup_state',
+    Field('name', length=128, unique=True),
+    Field('last_id', 'integer', default=0),
+    Field('seen_id', 'integer', default=0)
+)
+
+rollup.track(db.input_invoice, db.input_invoice_details, 'input_invoice_id')
+rollup.track(db.output_invoice, db.output_invoice_details, 'output_invoice_id')
+
+# Trigrams of the product descriptions, for the product search (see search.py)
+db.define_table(
+    'product_trigram',
+    Field('product_id', 'reference product'),
+    Field('trigram', length=3)
+)
+
+search.track(db.product)
+
+# Archived (cold) invoices and their lines, moved out of the hot tables with the
+# same ids by the archive command (see archive.py); read only
+for prefix in ('input', 'output'):
+    db.define_table(
+        '%s_invoice_archive' % prefix,
+        Field('name', 'text'),
+        Field('customer_name', 'text'),
+        Field('customer_address', 'text'),
+        Field('created_at'),
+        Field('total_amount', 'integer', default=0),
+        Field('line_count', 'integer', default=0)
+    )
+    db.define_table(
+        '%s_invoice_details_archive' % prefix,
+        Field('%s_invoice_id' % prefix, 'reference %s_invoice_archive' % prefix),
+        Field('product_id', 'reference product'),
+        Field('quantity', 'integer'),
+        Field('unit_price', 'integer'),
+        Field('total_price', 'integer')
+    )
+    counters.track(db['%s_invoice_archive' % prefix])
+    counters.track(db['%s_invoice_details_archive' % prefix])
+
+# Client supplied keys of the create POSTs and the id they created (see idempotency.py)
+db.define_table(
+    'idempotency_key',
+    Field('name', length=128, unique=True),
+    Field('result_id', 'integer'),
+    Field('created_at', 'datetime'),
+    Field('expires_at', 'datetime')
+)
+
+# Secondary indexes for the hot query paths (idempotent, see indexes.py)
+if settings.DB_MIGRATE:
+    indexes.create_indexes()
+
 
 ## always commit your models to avoid problems later
 db.commit()
@@ -0,0 +1,103 @@
+"""
+Rendered-page cache keyed on data version counters.
+
+Actions whose pages rarely change (print-invoice, the invoice page, the
+statistic of a closed date range) are decorated with pages.cached() and use
+the `pages` fixture just before their template:
+
+    @action('print-invoice/<invoice_id:int>', method=["GET"])
+    @action.uses(metrics, replica, db, auth.user, pages, 'hoadon.html')
+    @pages.cached(lambda invoice_id: [versions.row_name(db.output_invoice, invoice_id),
+                                      'catalog'])
+    def invoiceJson(invoice_id):
+
+The key is the action, its arguments, the request parameters and the user
+(the pages show the user's name); the version is the current value of the
+counters the page depends on, read in one query (see versions.py). On a hit
+the cached HTML is returned as is and the template, which only renders
+dicts, leaves it alone: the action's queries and the render are skipped. On
+a miss the fixture stores the page once the template has rendered it.
+Pages are kept in a per-process LRU and, when PAGE_CACHE_FOLDER is set, in a
+folder shared by the workers (see caching.py).
+"""
+import functools
+import threading
+
+from py4web import request, response
+from py4web.core import Fixture
+
+from .common import auth, settings
+from .caching import VersionedLRU, DiskCache
+from . import versions
+
+
+class PageCache(Fixture):
+
+    def __init__(self, size=256, folder=None, disk_size=2000):
+        self.memory = VersionedLRU(size=size)
+        self.disk = DiskCache(folder, disk_size) if folder else None
+        # not self.local: that is a read-only property of py4web's Fixture
+        self._tls = threading.local()
+
+    def lookup(self, key, version):
+        page = self.memory.lookup(key, version)
+        if page is None and self.disk is not None:
+            page = self.disk.lookup(key, version)
+            if page is not None:
+                self.memory.put(key, version, page)
+        return page
+
+    def store(self, key, version, page):
+        self.memory.put(key, version, page)
+        if self.disk is not None:
+            self.disk.put(key, version, page)
+
+    # Decorator of an action rendered by a template. counters(*args, **kwargs)
+    # returns the names of the version counters the page depends on, or None
+    # when this request should not be cached.
+    def cached(self, counters):
+
+        def decorator(func):
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                names = counters(*args, **kwargs)
+                if names is None:
+                    return func(*args, **kwargs)
+                key = (func.__name__, request.method, args, tuple(sorted(kwargs.items())),
+                       tuple(sorted((k, str(v)) for k, v in request.params.items())),
+                       auth.user_id)
+                current = versions.current_many(names)
+                version = tuple(current.get(name, 0) for name in names)
+                page = self.lookup(key, version)
+                if page is not None:
+                    return page
+                self._tls.pending = (key, version)
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    # the signatures of the fixture hooks differ between py4web versions;
+    # the rendered page is in the context of the current ones
+    def on_request(self, *args):
+        self._tls.pending = None
+
+    def on_error(self, *args):
+        self._tls.pending = None
+
+    def on_success(self, *args):
+        pending = getattr(self._tls, 'pending', None)
+        self._tls.pending = None
+        context = args[0] if args and isinstance(args[0], dict) else {}
+        page = context.get('output')
+        if pending and isinstance(page, str) and response.status_code == 200:
+            self.store(pending[0], pending[1], page)
+
+    def stats(self):
+        return self.memory.stats()
+
+
+pages = PageCache(size=settings.PAGE_CACHE_SIZE, folder=settings.PAGE_CACHE_FOLDER,
+                  disk_size=settings.PAGE_CACHE_DISK_SIZE)
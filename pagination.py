@@ -0,0 +1,83 @@
+"""
+Keyset (seek) pagination.
+
+Pages are read newest first. The cursor is the sort key of the last row of
+the previous page, so every page is an indexed range scan of page size rows
+no matter how deep the client has scrolled (no OFFSET).
+
+Two orders are supported:
+- 'id':         cursor "<id>" (also oldest first, with ascending=True)
+- 'created_at': cursor "<created_at>,<id>" (id breaks ties within a day)
+"""
+from .common import db
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+
+# Date filter on created_at (stored as YYYY-MM-DD)
+def date_filter(table, from_date=None, to_date=None):
+    query = table.id > 0
+    if from_date:
+        query &= table.created_at >= from_date
+    if to_date:
+        query &= table.created_at <= to_date
+    return query
+
+
+def _cursor_query(table, order, cursor, ascending=False):
+    if order == 'created_at':
+        created_at, _, last_id = cursor.rpartition(',')
+        return (table.created_at < created_at) | (
+            (table.created_at == created_at) & (table.id < int(last_id)))
+    return table.id > int(cursor) if ascending else table.id < int(cursor)
+
+
+def _cursor(row, order):
+    if order == 'created_at':
+        return '%s,%s' % (row.created_at or '', row.id)
+    return str(row.id)
+
+
+# One page of rows matching query, newest first (oldest first by id when
+# ascending). Returns (rows, next_cursor), next_cursor is None on the last page.
+def keyset_page(table, query=None, cursor=None, order='id', limit=PAGE_SIZE, fields=None,
+                ascending=False):
+    if order not in ('id', 'created_at') or (ascending and order != 'id'):
+        raise ValueError('unknown order %r' % order)
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    query = query if query is not None else table.id > 0
+    if cursor:
+        query &= _cursor_query(table, order, cursor, ascending)
+    if ascending:
+        orderby = table.id
+    else:
+        orderby = ~table.id if order == 'id' else ~table.created_at | ~table.id
+    rows = db(query).select(*(fields or []), orderby=orderby, limitby=(0, limit + 1))
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, _cursor(rows[-1], order)
+    return rows, None
+
+
+# A well-formed cursor of order, or None
+def _parse_cursor(cursor, order='id'):
+    cursor = str(cursor or '')
+    last_id = cursor.rpartition(',')[2] if order == 'created_at' else cursor
+    if order == 'created_at' and ',' not in cursor:
+        return None
+    return cursor if last_id.isdigit() else None
+
+
+# Read the paging parameters of a request: cursor, order and limit. order
+# forces the order (else ?order=, 'id' by default). A malformed cursor (a
+# client's own, or one of another order) reads as the first page.
+def page_params(params, order=None):
+    if order is None:
+        order = params.get('order') if params.get('order') in ('id', 'created_at') else 'id'
+    limit = params.get('limit')
+    return dict(
+        cursor=_parse_cursor(params.get('cursor'), order),
+        order=order,
+        limit=int(limit) if limit and str(limit).isdigit() else PAGE_SIZE,
+    )
@@ -0,0 +1,34 @@
+"""
+Batched reference loading.
+
+Instead of dereferencing a reference field row by row (one SELECT per row),
+prefetch() collects the ids referenced by a whole result set and loads them
+with one IN query per referenced table, then attaches the loaded rows to
+each row under the referenced table name (row.product, row.output_invoice).
+Columns with a filter_out are not loaded: product.categories_id turns each
+id into the category name with one query per row.
+"""
+from .common import db
+
+
+# Table a 'reference <table>' field points to
+def referenced_table(field):
+    return db[field.type.split(' ', 1)[1].strip()]
+
+
+# Load the rows referenced by each of the given fields with one query per
+# field and attach them to the rows. A field can also be given as a
+# (field, name) pair to choose the attribute name.
+def prefetch(rows, *fields):
+    for item in fields:
+        field, name = item if isinstance(item, tuple) else (item, None)
+        table = referenced_table(field)
+        name = name or table._tablename
+        ids = set(row[field.name] for row in rows if row[field.name])
+        loaded = {}
+        if ids:
+            columns = [column for column in table if not column.filter_out]
+            loaded = {ref.id: ref for ref in db(table.id.belongs(sorted(ids))).select(*columns)}
+        for row in rows:
+            row[name] = loaded.get(row[field.name])
+    return rows
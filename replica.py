@@ -0,0 +1,131 @@
+"""
+Read/write splitting between the primary database and a read replica.
+
+common.db is a RoutingDAL: its adapter can be switched, per thread, to a
+second adapter connected to DB_REPLICA_URI (with its own connection pool of
+DB_REPLICA_POOL_SIZE). The tables stay those of db, so every module keeps
+using `db` and only the connection changes.
+
+- `replica` (ReplicaReads) is a fixture for read-only actions, listed before
+  db so that db connects, commits and closes on the replica:
+
+      @action.uses(metrics, replica, db, auth.user, 'index.html')
+
+- `replica.writes` is a fixture for actions that write (some write on GET,
+  like the delete links). After a successful request it sets a short lived
+  cookie, and while it is set that browser's reads stay on the primary
+  (read-your-writes: the redirect that follows a post never shows the
+  replica's older data).
+
+Without DB_REPLICA_URI both fixtures do nothing and everything runs on the
+primary. To try it locally use two SQLite files, e.g.
+DB_URI = "sqlite://storage.sqlite", DB_REPLICA_URI = "sqlite://replica.sqlite",
+and DB_REPLICA_SIMULATED_LAG = 5: tasks.py then copies the primary file to
+the replica every 5 seconds, a replica lagging up to 5 seconds behind.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from pydal.adapters import adapters
+from py4web import DAL, request, response
+from py4web.core import Fixture
+
+COOKIE = 'inventory_rw'
+
+
+class RoutingDAL(DAL):
+
+    def __init__(self, *args, **kwargs):
+        object.__setattr__(self, '_routing', threading.local())
+        super().__init__(*args, **kwargs)
+
+    # the adapter of the current thread: the routed one, else the primary
+    @property
+    def _adapter(self):
+        routed = getattr(self.__dict__['_routing'], 'adapter', None)
+        return routed if routed is not None else self.__dict__.get('_primary_adapter')
+
+    @_adapter.setter
+    def _adapter(self, adapter):
+        self.__dict__['_primary_adapter'] = adapter
+
+    # Send this thread's statements to adapter (None: back to the primary)
+    def route(self, adapter):
+        self.__dict__['_routing'].adapter = adapter
+
+    def routed(self):
+        return getattr(self.__dict__['_routing'], 'adapter', None)
+
+
+# A second adapter of db connected to uri, sharing the tables of db
+def connect(db, uri, pool_size=0, folder=None):
+    dbname = re.match(r'^(\w+)(:\w+)*', uri).group()
+    adapter = adapters.get_for(dbname)
+    return adapter(db=db, uri=uri, pool_size=pool_size, folder=folder,
+                   db_codec='UTF-8', credential_decoder=lambda cred: cred,
+                   driver_args={}, adapter_args={}, after_connection=None,
+                   entity_quoting=True)
+
+
+# Path of the file of a sqlite:// URI, None for other engines
+def sqlite_path(uri, folder):
+    if not uri or not uri.startswith('sqlite://'):
+        return None
+    name = uri[len('sqlite://'):].split('?')[0]
+    return name if os.path.isabs(name) else os.path.join(folder, name)
+
+
+# Copy the primary SQLite file over the replica (simulated replication)
+def sync_sqlite(primary_path, replica_path):
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+class MarkWrites(Fixture):
+
+    def __init__(self, reads):
+        self.reads = reads
+
+    def on_request(self, *args):
+        pass
+
+    def on_error(self, *args):
+        pass
+
+    def on_success(self, *args):
+        if self.reads.adapter is not None:
+            response.set_cookie(COOKIE, str(int(time.time() + self.reads.window)), path='/')
+
+
+class ReplicaReads(Fixture):
+
+    def __init__(self, db, uri=None, pool_size=0, folder=None, window=5):
+        self.db = db
+        self.window = window
+        self.adapter = connect(db, uri, pool_size, folder) if uri else None
+        self.writes = MarkWrites(self)
+
+    # True while the client's last write may not have reached the replica
+    def recent_write(self):
+        try:
+            return float(request.get_cookie(COOKIE) or 0) > time.time()
+        except ValueError:
+            return False
+
+    def on_request(self, *args):
+        if self.adapter is not None and not self.recent_write():
+            self.db.route(self.adapter)
+
+    def on_error(self, *args):
+        self.db.route(None)
+
+    def on_success(self, *args):
+        self.db.route(None)
@@ -0,0 +1,100 @@
+"""
+Aggregated import/export reports.
+
+Ranges are read from the daily_product_movement rollup (see rollup.py) plus
+the small tail of detail lines the rollup task has not folded in yet. All
+the summing happens in SQL (GROUP BY / SUM) so only one row per product (or
+per category) ever reaches Python; the parts are then merged with a single
+keyed pass (full outer merge on the group key).
+"""
+from .common import db
+from . import rollup
+
+
+# Date range condition on a date / created_at column (stored as YYYY-MM-DD)
+def _date_range(column, from_date=None, to_date=None):
+    query = column != None
+    if from_date:
+        query &= column >= from_date
+    if to_date:
+        query &= column <= to_date
+    return query
+
+
+# Group-by columns for a report: per product (code + name) or per category
+def _group_fields(by_category):
+    if by_category:
+        return [db.categories.id, db.categories.name]
+    return [db.product.id, db.product.product_code, db.product.description]
+
+
+def _group_query(query, by_category):
+    if by_category:
+        query &= db.product.categories_id == db.categories.id
+    return query
+
+
+# SUM of the rollup columns over the range, grouped in SQL
+def _rolled_up(from_date, to_date, by_category):
+    movement = db.daily_product_movement
+    sums = [movement.qty_in.sum(), movement.qty_out.sum(),
+            movement.amount_in.sum(), movement.amount_out.sum()]
+    query = _group_query(
+        _date_range(movement.date, from_date, to_date) & (movement.product_id == db.product.id),
+        by_category)
+    fields = _group_fields(by_category)
+    rows = db(query).select(*(fields + sums), groupby=fields)
+    for row in rows:
+        qty_in, qty_out, amount_in, amount_out = (row[value] or 0 for value in sums)
+        yield row, 'import', qty_in, amount_in
+        yield row, 'export', qty_out, amount_out
+
+
+# SUM(quantity) and SUM(total_price) of the detail lines above the rollup
+# high-water mark, grouped in SQL
+def _tail(header, details, invoice_field, last_id, from_date, to_date, by_category):
+    quantity = details.quantity.sum()
+    amount = details.total_price.sum()
+    query = _group_query(
+        _date_range(header.created_at, from_date, to_date)
+        & (details.id > last_id)
+        & (details[invoice_field] == header.id)
+        & (details.product_id == db.product.id),
+        by_category)
+    fields = _group_fields(by_category)
+    rows = db(query).select(*(fields + [quantity, amount]), groupby=fields)
+    return [(row, row[quantity] or 0, row[amount] or 0) for row in rows]
+
+
+# Import/export quantities per product (or per category) for a date range
+def movement_report(from_date=None, to_date=None, by_category=False):
+    marks = rollup.high_water()
+    parts = list(_rolled_up(from_date, to_date, by_category))
+    for row, quantity, amount in _tail(
+            db.input_invoice, db.input_invoice_details, 'input_invoice_id',
+            marks['input_invoice_details'], from_date, to_date, by_category):
+        parts.append((row, 'import', quantity, amount))
+    for row, quantity, amount in _tail(
+            db.output_invoice, db.output_invoice_details, 'output_invoice_id',
+            marks['output_invoice_details'], from_date, to_date, by_category):
+        parts.append((row, 'export', quantity, amount))
+
+    report = {}
+    for row, side, quantity, amount in parts:
+        if by_category:
+            key = row.categories.id
+            line = report.get(key) or dict(id=key, code='', name=row.categories.name)
+        else:
+            key = row.product.id
+            line = report.get(key) or dict(
+                id=key, code=row.product.product_code, name=row.product.description)
+        line.setdefault('import', 0)
+        line.setdefault('export', 0)
+        line.setdefault('import_amount', 0)
+        line.setdefault('export_amount', 0)
+        line[side] += quantity
+        line[side + '_amount'] += amount
+        report[key] = line
+    # products whose movements cancelled out (lines deleted after the rollup) are left out
+    return sorted((line for line in report.values()
+                   if line['import'] or line['export']), key=lambda line: line['id'])
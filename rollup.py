@@ -0,0 +1,141 @@
+"""
+Daily per-product movement rollup.
+
+daily_product_movement holds, per (date, product), the quantities and
+amounts imported and exported that day. run() folds the detail lines added
+since the last run into it, using a high-water mark per detail table stored
+in rollup_state:
+
+- last_id: every line with id <= last_id is already in the rollup
+- seen_id: the highest line id seen by the previous run
+
+A run only folds lines up to the previous run's seen_id, so a line whose id
+was allocated by a transaction that had not committed yet is never skipped.
+Deleting or changing a line that is already rolled up, or moving its
+invoice to another date, updates the rollup too (see track()). Reports read
+the rollup plus the small tail of lines above last_id.
+"""
+from .common import db
+from .dbutils import engine, around_updates
+
+SIDES = (
+    # (state name, header, details, invoice field, quantity column, amount column)
+    ('input_invoice_details', 'input_invoice', 'input_invoice_details', 'input_invoice_id', 'qty_in', 'amount_in'),
+    ('output_invoice_details', 'output_invoice', 'output_invoice_details', 'output_invoice_id', 'qty_out', 'amount_out'),
+)
+
+
+def _side(name):
+    for side in SIDES:
+        if side[0] == name:
+            return side
+    raise KeyError(name)
+
+
+# High-water marks {details table name: last rolled-up line id}
+def high_water():
+    rows = db(db.rollup_state.id > 0).select(db.rollup_state.name, db.rollup_state.last_id)
+    marks = {row.name: row.last_id or 0 for row in rows}
+    return {side[0]: marks.get(side[0], 0) for side in SIDES}
+
+
+# Add quantity / amount to one (date, product) cell of the rollup
+def _add(day, product_id, quantity_column, amount_column, quantity, amount):
+    movement = db.daily_product_movement
+    query = (movement.date == day) & (movement.product_id == product_id)
+    updated = db(query).update(**{
+        quantity_column: movement[quantity_column].coalesce_zero() + quantity,
+        amount_column: movement[amount_column].coalesce_zero() + amount})
+    if not updated:
+        values = dict(qty_in=0, qty_out=0, amount_in=0, amount_out=0)
+        values[quantity_column], values[amount_column] = quantity, amount
+        movement.insert(date=day, product_id=product_id, **values)
+
+
+# (date, product_id, quantity, amount) per day and product of the lines matched by query
+def _per_day(header, details, invoice_field, query):
+    quantity = details.quantity.sum()
+    amount = details.total_price.sum()
+    rows = db(query & (details[invoice_field] == header.id)).select(
+        header.created_at, details.product_id, quantity, amount,
+        groupby=header.created_at | details.product_id)
+    return [(row[header.created_at], row[details.product_id], row[quantity] or 0, row[amount] or 0)
+            for row in rows]
+
+
+# The rollup_state row of name (created on first use), locked until commit.
+# SQLite has no SELECT ... FOR UPDATE: a no-op write first takes the database
+# write lock instead, which serializes concurrent runs the same way.
+def _lock_state(state, name):
+    if engine() == 'sqlite':
+        if not db(state.name == name).update(seen_id=state.seen_id):
+            state.insert(name=name, last_id=0, seen_id=0)
+        return db(state.name == name).select().first()
+    row = db(state.name == name).select(for_update=True).first()
+    if not row:
+        state.insert(name=name, last_id=0, seen_id=0)
+        row = db(state.name == name).select(for_update=True).first()
+    return row
+
+
+# Fold the new lines of one detail table into the rollup, returns the number of lines folded
+def run_side(name):
+    _, header, details, invoice_field, quantity_column, amount_column = _side(name)
+    header, details = db[header], db[details]
+    state = db.rollup_state
+    # lock the state row so concurrent runs (several workers) do not fold twice
+    row = _lock_state(state, name)
+    last_id, upto = row.last_id or 0, row.seen_id or 0
+    folded = 0
+    if upto > last_id:
+        query = (details.id > last_id) & (details.id <= upto)
+        for day, product_id, quantity, amount in _per_day(header, details, invoice_field, query):
+            if day:
+                _add(day, product_id, quantity_column, amount_column, quantity, amount)
+        folded = db(query).count()
+    max_id = details.id.max()
+    seen_id = db(details.id > 0).select(max_id).first()[max_id] or 0
+    row.update_record(last_id=max(last_id, upto), seen_id=seen_id)
+    return folded
+
+
+# Fold the new import and export lines, one transaction per detail table
+def run():
+    result = {}
+    for side in SIDES:
+        try:
+            result[side[0]] = run_side(side[0])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return result
+
+
+# Keep the rolled-up lines in the rollup when they change: a deleted line is
+# subtracted; an update of a line (quantity, price, product, invoice) or of
+# an invoice date takes the lines out before and puts them back after
+def track(header, details, invoice_field):
+    name = details._tablename
+    quantity_column, amount_column = _side(name)[4:]
+
+    def moved(query, direction):
+        last_id = high_water()[name]
+        if not last_id:
+            return
+        query &= details.id <= last_id
+        for day, product_id, quantity, amount in _per_day(header, details, invoice_field, query):
+            if day:
+                _add(day, product_id, quantity_column, amount_column,
+                     direction * quantity, direction * amount)
+
+    def lines_deleted(dbset):
+        moved(dbset.query, -1)
+
+    details._before_delete.append(lines_deleted)
+    around_updates(details, ('quantity', 'unit_price', 'product_id', invoice_field),
+                   lambda ids: moved(details.id.belongs(ids), -1),
+                   lambda ids: moved(details.id.belongs(ids), 1))
+    around_updates(header, ('created_at',),
+                   lambda ids: moved(details[invoice_field].belongs(ids), -1),
+                   lambda ids: moved(details[invoice_field].belongs(ids), 1))
@@ -0,0 +1,93 @@
+"""
+A lightweight in-process scheduler used when USE_CELERY is False.
+
+It mimics the small part of the Celery API that tasks.py uses, so the same
+tasks.py works with either:
+
+    @scheduler.task
+    def my_task(): ...
+
+    scheduler.conf.beat_schedule = {
+        "name": {"task": "apps.{appname}.tasks.my_task", "schedule": 10.0, "args": ()},
+    }
+
+start() runs the schedule in one daemon thread. Each task runs for the first
+time one interval after start, then every interval; a task that raises is
+logged and retried at its next turn. my_task.delay(*args) queues one run of
+the task in that same thread, which takes it as soon as it is free.
+"""
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+
+class ThreadScheduler:
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.tasks = {}
+        self.conf = SimpleNamespace(beat_schedule={})
+        self.thread = None
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.queue = queue.Queue()
+
+    # Register a task under its dotted name (module.function), like celery
+    def task(self, func):
+        self.tasks["%s.%s" % (func.__module__, func.__name__)] = func
+        func.delay = lambda *args, **kwargs: self.enqueue(func, *args, **kwargs)
+        return func
+
+    # Queue one run of func(*args, **kwargs) in the scheduler thread
+    def enqueue(self, func, *args, **kwargs):
+        self.queue.put((func, args, kwargs))
+        self.wakeup.set()
+
+    # Run the queued tasks in order, returns how many ran
+    def run_queued(self):
+        ran = 0
+        while True:
+            try:
+                func, args, kwargs = self.queue.get_nowait()
+            except queue.Empty:
+                return ran
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                if self.logger:
+                    self.logger.exception("scheduler: queued task %s failed" % func.__name__)
+            ran += 1
+
+    def _run(self):
+        now = time.time()
+        due = {name: now + float(entry["schedule"])
+               for name, entry in self.conf.beat_schedule.items()}
+        while not self.stopped.is_set():
+            self.run_queued()
+            now = time.time()
+            for name, entry in self.conf.beat_schedule.items():
+                if due.get(name, 0) > now:
+                    continue
+                due[name] = now + float(entry["schedule"])
+                func = self.tasks.get(entry["task"])
+                if func is None:
+                    if self.logger:
+                        self.logger.warning("scheduler: unknown task %s" % entry["task"])
+                    continue
+                try:
+                    func(*entry.get("args", ()))
+                except Exception:
+                    if self.logger:
+                        self.logger.exception("scheduler: task %s failed" % entry["task"])
+            self.wakeup.wait(max(0.5, min(due.values() or [60]) - time.time()))
+            self.wakeup.clear()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
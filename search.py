@@ -0,0 +1,138 @@
+"""
+Product search for the Grid and the invoice product pickers.
+
+- product code: prefix search as a range (code >= q AND code < q + U+FFFF),
+  which both SQLite and MySQL answer from the product_code index, unlike
+  LIKE '%q%'. The pickers' typeahead (search()) looks the prefix up in the
+  sorted codes of the catalog cache instead (see catalog.py).
+- description: product_trigram holds the distinct trigrams of each
+  normalized description (lowercase, accents removed). A search looks up the
+  trigrams of the query, keeps the products having all of them, then checks
+  the candidates, in code order, for the full normalized substring. The
+  table is kept up to date by callbacks on product (see track());
+  manage.py reindex-search rebuilds it.
+"""
+import unicodedata
+
+from .common import db
+from .catalog import catalog
+
+LIMIT = 10
+# candidate products checked per query
+BATCH = 500
+
+
+# Lowercase, strip accents (so "hang hoa" finds "hàng hóa") and collapse spaces
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text or '').lower().replace('đ', 'd'))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def trigrams(text):
+    text = normalize(text)
+    return sorted(set(text[i:i + 3] for i in range(len(text) - 2)))
+
+
+# Query matching the products whose code starts with prefix
+def code_prefix_query(prefix):
+    prefix = str(prefix or '').strip()
+    if not prefix:
+        return db.product.id > 0
+    return (db.product.product_code >= prefix) & (db.product.product_code < prefix + '￿')
+
+
+# Ids of products whose description contains text, in code order (all of
+# them when limit is None)
+def description_ids(text, limit=LIMIT):
+    needle = normalize(text)
+    if not needle:
+        return []
+    grams = trigrams(needle)
+    if not grams:
+        # one or two characters: too short for the trigram index
+        return _containing(db.product.id > 0, needle, limit)
+    index = db.product_trigram
+    matched = index.trigram.count()
+    candidates = db(index.trigram.belongs(grams))._select(
+        index.product_id, groupby=index.product_id, having=matched >= len(grams))
+    return _containing(db.product.id.belongs(candidates), needle, limit)
+
+
+# Ids of the products matched by query whose normalized description contains
+# needle, in code order: BATCH products at a time until limit are found, so
+# no match is dropped whatever the number of candidates before it
+def _containing(query, needle, limit):
+    found, offset = [], 0
+    while True:
+        rows = db(query).select(db.product.id, db.product.description,
+                                orderby=db.product.product_code | db.product.id,
+                                limitby=(offset, offset + BATCH))
+        found += [row.id for row in rows if needle in normalize(row.description)]
+        if limit and len(found) >= limit:
+            return found[:limit]
+        if len(rows) < BATCH:
+            return found
+        offset += BATCH
+
+
+# Typeahead matches: code prefix matches first, then description matches.
+# The codes, descriptions and units come from the catalog cache, the only
+# queries are its version and the trigram lookup.
+def search(text, limit=LIMIT):
+    text = str(text or '').strip()
+    if not text:
+        return []
+    entries = catalog.get()
+    ids = catalog.code_prefix(text, limit)
+    if len(ids) < limit:
+        seen = set(ids)
+        found = [i for i in description_ids(text, limit + len(ids))
+                 if i not in seen and i in entries]
+        ids += sorted(found, key=lambda i: entries[i].code or '')[:limit - len(ids)]
+    return [dict(id=i, code=entries[i].code, description=entries[i].description,
+                 unit=entries[i].unit) for i in ids if i in entries]
+
+
+# Replace the trigrams of one product
+def index_product(product_id, description):
+    db(db.product_trigram.product_id == product_id).delete()
+    grams = trigrams(description)
+    if grams:
+        db.product_trigram.bulk_insert(
+            [dict(product_id=product_id, trigram=gram) for gram in grams])
+
+
+# Keep product_trigram in sync with product descriptions (trigram rows of
+# deleted products go with the ON DELETE CASCADE of the reference)
+def track(table):
+
+    def inserted(fields, id):
+        index_product(id, fields.get('description'))
+
+    def updated(dbset, fields):
+        if 'description' in fields:
+            for row in dbset.select(table.id, table.description):
+                index_product(row.id, row.description)
+
+    table._after_insert.append(inserted)
+    table._after_update.append(updated)
+
+
+# Rebuild the whole trigram index, returns the number of products indexed
+def reindex(batch=1000):
+    db(db.product_trigram.id > 0).delete()
+    last_id, count = 0, 0
+    while True:
+        rows = db(db.product.id > last_id).select(
+            db.product.id, db.product.description, orderby=db.product.id, limitby=(0, batch))
+        for row in rows:
+            grams = trigrams(row.description)
+            if grams:
+                db.product_trigram.bulk_insert(
+                    [dict(product_id=row.id, trigram=gram) for gram in grams])
+        count += len(rows)
+        db.commit()
+        if len(rows) < batch:
+            return count
+        last_id = rows.last().id
@@ -0,0 +1,33 @@
+// Submit the bulk line form with fetch and show the per-line error report
+(function () {
+    var form = document.getElementById('bulkForm');
+    if (!form) return;
+    var errors = document.getElementById('bulkErrors');
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        errors.innerHTML = '';
+        fetch(form.action, {method: 'POST', body: new FormData(form), credentials: 'same-origin'})
+            .then(function (response) { return response.json(); })
+            .then(function (report) {
+                report.errors.forEach(function (error) {
+                    var li = document.createElement('li');
+                    li.textContent = (error.line ? 'Line ' + error.line + ': ' : '') + error.error;
+                    errors.appendChild(li);
+                });
+                if (report.inserted && !report.errors.length) {
+                    window.location.reload();
+                } else if (report.inserted) {
+                    var li = document.createElement('li');
+                    li.className = 'text-success';
+                    li.textContent = report.inserted + ' line(s) added, reload the page to see them';
+                    errors.insertBefore(li, errors.firstChild);
+                }
+            })
+            .catch(function () {
+                var li = document.createElement('li');
+                li.textContent = 'The lines could not be sent';
+                errors.appendChild(li);
+            });
+    });
+})();
@@ -0,0 +1,41 @@
+// Draw the report charts from the analytics JSON endpoints
+(function () {
+    var box = document.getElementById('charts');
+    if (!box || !window.Chartist) return;
+
+    function query(params) {
+        params.from = box.dataset.from;
+        params.to = box.dataset.to;
+        return '?' + Object.keys(params).map(function (key) {
+            return encodeURIComponent(key) + '=' + encodeURIComponent(params[key]);
+        }).join('&');
+    }
+
+    function getJSON(url) {
+        return fetch(url, {credentials: 'same-origin'}).then(function (response) { return response.json(); });
+    }
+
+    function drawSeries() {
+        var bucket = document.getElementById('chartBucket').value;
+        getJSON(box.dataset.series + query({bucket: bucket, group: 'all'})).then(function (data) {
+            var total = data.series[0] || {import: [], export: []};
+            new Chartist.Line('#seriesChart', {
+                labels: data.labels,
+                series: [total.import, total.export]
+            }, {fullWidth: true, chartPadding: {right: 40}});
+        });
+    }
+
+    function drawTop() {
+        getJSON(box.dataset.top + query({n: 10, by: 'export'})).then(function (data) {
+            new Chartist.Bar('#topChart', {
+                labels: data.items.map(function (item) { return item.code || item.name; }),
+                series: [data.items.map(function (item) { return item.export; })]
+            });
+        });
+    }
+
+    document.getElementById('chartBucket').addEventListener('change', drawSeries);
+    drawSeries();
+    drawTop();
+})();
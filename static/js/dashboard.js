@@ -0,0 +1,71 @@
+// Load the next page of a dashboard list when its end scrolls into view.
+// Each list container carries data-url (JSON endpoint) and data-next (cursor).
+(function () {
+    function cell(text) {
+        var td = document.createElement('td');
+        td.textContent = text;
+        return td;
+    }
+
+    function renderRow(kind, item, index) {
+        var tr = document.createElement('tr');
+        tr.appendChild(cell(index));
+        if (kind === 'products') {
+            tr.appendChild(cell(item.product_code));
+            tr.appendChild(cell(item.description));
+            tr.appendChild(cell(item.stock));
+        } else {
+            tr.appendChild(cell(item.name));
+            tr.appendChild(cell(item.created_at));
+            tr.appendChild(cell(item.line_count));
+            tr.appendChild(cell(item.total_amount + '$'));
+            var td = document.createElement('td');
+            var link = document.createElement('a');
+            link.className = 'btn btn-sm btn-info';
+            link.href = item.url;
+            link.textContent = 'Details';
+            td.appendChild(link);
+            tr.appendChild(td);
+        }
+        return tr;
+    }
+
+    function setup(list) {
+        var body = list.querySelector('tbody');
+        var more = list.querySelector('.dashboard-more');
+        var loading = false;
+
+        function loadMore() {
+            var cursor = list.dataset.next;
+            if (!cursor || loading) return;
+            loading = true;
+            more.textContent = 'Loading...';
+            fetch(list.dataset.url + '?cursor=' + encodeURIComponent(cursor), {credentials: 'same-origin'})
+                .then(function (response) { return response.json(); })
+                .then(function (page) {
+                    var index = body.rows.length;
+                    page.items.forEach(function (item) {
+                        index += 1;
+                        body.appendChild(renderRow(body.dataset.kind, item, index));
+                    });
+                    list.dataset.next = page.next || '';
+                    more.textContent = '';
+                })
+                .catch(function () {
+                    more.textContent = 'Could not load more rows';
+                    list.dataset.next = '';
+                })
+                .then(function () {
+                    loading = false;
+                    // the list may still not fill its box: keep loading while the end is visible
+                    if (more.getBoundingClientRect().top < list.getBoundingClientRect().bottom) loadMore();
+                });
+        }
+
+        new IntersectionObserver(function (entries) {
+            if (entries[0].isIntersecting) loadMore();
+        }, {root: list}).observe(more);
+    }
+
+    document.querySelectorAll('.dashboard-list').forEach(setup);
+})();
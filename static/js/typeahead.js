@@ -0,0 +1,55 @@
+// Product picker: search products as the user types and keep the chosen id
+// in the hidden productId input
+(function () {
+    document.querySelectorAll('.product-picker').forEach(function (picker) {
+        if (picker.dataset.ready) return;
+        picker.dataset.ready = '1';
+        var input = picker.querySelector('.product-picker-input');
+        var value = picker.querySelector('.product-picker-value');
+        var list = picker.querySelector('.product-picker-list');
+        var timer = null;
+        var last = '';
+
+        function choose(item) {
+            value.value = item.id;
+            input.value = item.code + ' - ' + item.description;
+            list.innerHTML = '';
+        }
+
+        function show(items) {
+            list.innerHTML = '';
+            items.forEach(function (item) {
+                var li = document.createElement('li');
+                li.className = 'list-group-item list-group-item-action';
+                li.style.cursor = 'pointer';
+                li.textContent = item.code + ' - ' + item.description + (item.unit ? ' (' + item.unit + ')' : '');
+                li.addEventListener('mousedown', function (event) {
+                    event.preventDefault();
+                    choose(item);
+                });
+                list.appendChild(li);
+            });
+        }
+
+        input.addEventListener('input', function () {
+            value.value = '';
+            clearTimeout(timer);
+            var q = input.value.trim();
+            if (!q) { show([]); return; }
+            timer = setTimeout(function () {
+                last = q;
+                fetch(picker.dataset.url + '?q=' + encodeURIComponent(q), {credentials: 'same-origin'})
+                    .then(function (response) { return response.json(); })
+                    .then(function (data) { if (q === last) show(data.items); })
+                    .catch(function () { show([]); });
+            }, 150);
+        });
+        input.addEventListener('blur', function () { list.innerHTML = ''; });
+        picker.closest('form').addEventListener('submit', function (event) {
+            if (!value.value) {
+                event.preventDefault();
+                input.focus();
+            }
+        });
+    });
+})();
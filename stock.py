@@ -0,0 +1,230 @@
+"""
+On-hand stock ledger.
+
+product_stock holds one row per product with the current quantity in stock.
+It is kept up to date by DAL callbacks on the invoice detail tables, so every
+insert, update (quantity or product) or delete of an invoice line made through
+the DAL (any action, the Grid, dbadmin) adjusts it inside the same
+transaction. Deleting an invoice or a product deletes its lines through the
+DAL first, so the ON DELETE CASCADE finds nothing left. Raw SQL (bulk.py,
+archive.py) bypasses the callbacks and applies its own effects; anything else
+written outside the DAL is found by reconcile(), which rebuilds the ledger from
+the detail tables and reports the drift.
+"""
+import random
+import time
+
+from .common import db
+from .dbutils import engine, around_updates
+
+# optimistic reservation attempts before giving up (SQLite)
+RETRIES = 12
+
+
+class StockError(Exception):
+    pass
+
+
+class OutOfStock(StockError):
+
+    def __init__(self, product_id, wanted, available):
+        StockError.__init__(self, 'product %s: %s wanted, only %s in stock' % (
+            product_id, wanted, available))
+        self.product_id = product_id
+        self.wanted = wanted
+        self.available = available
+
+
+class ReservationConflict(StockError):
+    pass
+
+
+# Add delta to the stock of one product, creating its ledger row if needed
+def adjust(product_id, delta):
+    if not product_id or not delta:
+        return
+    product_id = int(product_id)
+    ledger = db.product_stock
+    updated = db(ledger.product_id == product_id).update(
+        quantity=ledger.quantity + delta, version=ledger.version.coalesce_zero() + 1)
+    if not updated:
+        ledger.insert(product_id=product_id, quantity=delta)
+
+
+# Check that {product_id: quantity} is in stock and hold it until the end of
+# the transaction, so export lines inserted next cannot oversell. Raises
+# OutOfStock, or ReservationConflict after RETRIES lost races (SQLite).
+# Returns the stock levels seen, as {product_id: quantity}.
+#
+# MySQL (and other servers): the ledger rows are locked with SELECT ... FOR
+# UPDATE, in product order so two reservations cannot deadlock.
+# SQLite: optimistic, the rows are read with their version and claimed with
+# UPDATE ... WHERE version = <read version>; a lost race rolls back and
+# retries after a short random backoff. It must be the first write of the
+# transaction since the retry rolls the transaction back.
+def reserve_many(quantities, stats=None):
+    wanted = {int(product_id): int(quantity) for product_id, quantity in quantities.items()
+              if quantity and int(quantity) > 0}
+    if not wanted:
+        return {}
+    if engine() == 'sqlite':
+        return _reserve_optimistic(wanted, stats)
+    return _reserve_locked(wanted)
+
+
+def reserve(product_id, quantity, stats=None):
+    return reserve_many({product_id: quantity}, stats)
+
+
+def _check(wanted, levels):
+    for product_id in sorted(wanted):
+        available = levels.get(product_id, 0)
+        if available < wanted[product_id]:
+            raise OutOfStock(product_id, wanted[product_id], available)
+
+
+def _reserve_locked(wanted):
+    ledger = db.product_stock
+    rows = db(ledger.product_id.belongs(sorted(wanted))).select(
+        ledger.product_id, ledger.quantity, orderby=ledger.product_id, for_update=True)
+    levels = {row.product_id: row.quantity or 0 for row in rows}
+    _check(wanted, levels)
+    return levels
+
+
+def _reserve_optimistic(wanted, stats):
+    ledger = db.product_stock
+    version = ledger.version.coalesce_zero()
+    for attempt in range(RETRIES):
+        try:
+            rows = db(ledger.product_id.belongs(sorted(wanted))).select(
+                ledger.product_id, ledger.quantity, ledger.version)
+            levels = {row.product_id: row.quantity or 0 for row in rows}
+            seen = {row.product_id: row.version or 0 for row in rows}
+            _check(wanted, levels)
+            if all(db((ledger.product_id == product_id) & (version == seen[product_id])).update(
+                    version=version + 1) for product_id in sorted(wanted)):
+                return levels
+        except db._adapter.driver.OperationalError:
+            # "database is locked": another writer holds the file
+            pass
+        db.rollback()
+        if stats is not None:
+            stats['retries'] = stats.get('retries', 0) + 1
+        time.sleep(random.uniform(0, 0.002 * 2 ** min(attempt, 6)))
+    raise ReservationConflict('stock of %s is busy, try again' % ', '.join(map(str, sorted(wanted))))
+
+
+# Current stock of one product (indexed lookup on the unique product_id)
+def on_hand(product_id):
+    row = db(db.product_stock.product_id == product_id).select(
+        db.product_stock.quantity, limitby=(0, 1)).first()
+    return row.quantity if row else 0
+
+
+# Current stock of the given products as {product_id: quantity}
+def on_hand_many(product_ids):
+    if not product_ids:
+        return {}
+    rows = db(db.product_stock.product_id.belongs(list(product_ids))).select(
+        db.product_stock.product_id, db.product_stock.quantity)
+    return {row.product_id: row.quantity for row in rows}
+
+
+# Current stock of every product as {product_id: quantity}
+def on_hand_all():
+    rows = db(db.product_stock.id > 0).select(
+        db.product_stock.product_id, db.product_stock.quantity)
+    return {row.product_id: row.quantity for row in rows}
+
+
+# Stock of the products of one category as [(product row, quantity)], in code
+# order: one indexed join, products without a ledger row count as 0
+def in_category(category_id):
+    rows = db(db.product.categories_id == category_id).select(
+        db.product.id, db.product.product_code, db.product.description, db.product_stock.quantity,
+        left=db.product_stock.on(db.product_stock.product_id == db.product.id),
+        orderby=db.product.product_code)
+    return [(row.product, row.product_stock.quantity or 0) for row in rows]
+
+
+# Total stock per category as {category_id: quantity}
+def by_category():
+    quantity = db.product_stock.quantity.sum()
+    rows = db((db.product_stock.product_id == db.product.id)
+              & (db.product.categories_id == db.categories.id)).select(
+        db.categories.id, quantity, groupby=db.categories.id)
+    return {row.categories.id: row[quantity] or 0 for row in rows}
+
+
+# SUM(quantity) per product of the detail lines matched by query
+def _quantities(details, query):
+    quantity = details.quantity.sum()
+    rows = db(query & (details.product_id == db.product.id)).select(
+        db.product.id, quantity, groupby=db.product.id)
+    return [(row.product.id, row[quantity] or 0) for row in rows]
+
+
+# Keep product_stock in sync with the lines of one invoice detail table.
+# sign is +1 for imports and -1 for exports.
+def track(header, details, invoice_field, sign):
+
+    def line_inserted(fields, id):
+        adjust(fields.get('product_id'), sign * int(fields.get('quantity') or 0))
+
+    def lines_deleted(dbset):
+        for product_id, quantity in _quantities(details, dbset.query):
+            adjust(product_id, -sign * quantity)
+
+    # an update moving quantity or product: take the lines out of the ledger
+    # before, put them back after
+    def lines_moved(ids, direction):
+        for product_id, quantity in _quantities(details, details.id.belongs(ids)):
+            adjust(product_id, direction * sign * quantity)
+
+    def invoices_deleted(dbset):
+        # delete the lines through the DAL first so the ledger sees them,
+        # the database cascade then finds nothing left to remove
+        db(details[invoice_field].belongs(dbset._select(header.id))).delete()
+
+    def products_deleted(dbset):
+        # same for the lines of deleted products (stock, totals, rollup)
+        db(details.product_id.belongs(dbset._select(db.product.id))).delete()
+
+    details._after_insert.append(line_inserted)
+    around_updates(details, ('quantity', 'product_id'),
+                   lambda ids: lines_moved(ids, -1), lambda ids: lines_moved(ids, 1))
+    details._before_delete.append(lines_deleted)
+    header._before_delete.append(invoices_deleted)
+    db.product._before_delete.append(products_deleted)
+
+
+# Expected stock per product computed from the detail tables
+def expected():
+    levels = {}
+    # archived lines (see archive.py) still moved the stock
+    for details, sign in ((db.input_invoice_details, 1), (db.output_invoice_details, -1),
+                          (db.input_invoice_details_archive, 1),
+                          (db.output_invoice_details_archive, -1)):
+        for product_id, quantity in _quantities(details, details.id > 0):
+            levels[product_id] = levels.get(product_id, 0) + sign * quantity
+    return levels
+
+
+# Rebuild product_stock from the detail tables, returns the drift found as
+# a list of (product_id, ledger quantity, expected quantity)
+def reconcile(fix=True):
+    current = on_hand_all()
+    levels = expected()
+    drift = []
+    for product_id in sorted(set(current) | set(levels)):
+        have, want = current.get(product_id, 0), levels.get(product_id, 0)
+        if have != want:
+            drift.append((product_id, have, want))
+            if fix:
+                ledger = db.product_stock
+                ledger.update_or_insert(ledger.product_id == product_id,
+                                        product_id=product_id, quantity=want)
+    if fix:
+        db.commit()
+    return drift
@@ -1,4 +1,9 @@
 """
+Periodic tasks, and background tasks queued with task.delay(...).
+
+Without Celery (USE_CELERY = False, the default) they run in a thread of the
+web process, see scheduler.py; nothing else needs to be started.
+
 To use celery tasks:
 1) pip install -U "celery[redis]"
 2) In settings.py:
@@ -9,26 +14,82 @@ To use celery tasks:
 5) Start "celery -A apps.{appname}.tasks worker --loglevel=info" for each worker
 
 """
-from .common import settings, scheduler, db, Field
+from .common import settings, scheduler, db, logger
+from . import rollup, replica, idempotency, cleanup
 
-# example of task that needs db access
+
+# fold the new invoice lines into daily_product_movement
 @scheduler.task
-def my_task():
+def rollup_movements():
     try:
         # this task will be executed in its own thread, connect to db
         db._adapter.reconnect()
-        # do something here
+        folded = rollup.run()
+        logger.info("rollup: %s" % folded)
         db.commit()
     except:
         # rollback on failure
         db.rollback()
+        raise
 
 
-# run my_task every 10 seconds
+# delete the expired idempotency keys
+@scheduler.task
+def purge_idempotency_keys():
+    try:
+        db._adapter.reconnect()
+        purged = idempotency.purge()
+        logger.info("idempotency keys purged: %s" % purged)
+        db.commit()
+    except:
+        db.rollback()
+        raise
+
+
+# delete invoices in chunks (see cleanup.py), queued by the delete_invoices
+# action so that a large deletion does not run inside the request
+@scheduler.task
+def delete_invoices(kind, ids=None, from_date=None, to_date=None, empty_only=False):
+    try:
+        db._adapter.reconnect()
+        query = cleanup.invoice_query(kind, ids=ids, from_date=from_date, to_date=to_date,
+                                      empty_only=empty_only)
+        deleted = cleanup.delete_invoices(kind, query)
+        logger.info("%s deleted: %s" % (kind, deleted))
+        db.commit()
+    except:
+        db.rollback()
+        raise
+
+
+# run rollup_movements every ROLLUP_INTERVAL seconds, purge the keys hourly
 scheduler.conf.beat_schedule = {
-    "my_first_task": {
-        "task": "apps.%s.tasks.my_task" % settings.APP_NAME,
-        "schedule": 10.0,
+    "rollup_movements": {
+        "task": "apps.%s.tasks.rollup_movements" % settings.APP_NAME,
+        "schedule": float(settings.ROLLUP_INTERVAL),
+        "args": (),
+    },
+    "purge_idempotency_keys": {
+        "task": "apps.%s.tasks.purge_idempotency_keys" % settings.APP_NAME,
+        "schedule": 3600.0,
         "args": (),
     },
 }
+
+# Simulated replication for local testing (see replica.py): copy the SQLite
+# primary to the replica every DB_REPLICA_SIMULATED_LAG seconds
+primary_path = replica.sqlite_path(settings.DB_URI, settings.DB_FOLDER)
+replica_path = replica.sqlite_path(settings.DB_REPLICA_URI, settings.DB_FOLDER)
+if settings.DB_REPLICA_SIMULATED_LAG and primary_path and replica_path:
+
+    @scheduler.task
+    def sync_replica():
+        replica.sync_sqlite(primary_path, replica_path)
+
+    # start with an up to date replica
+    sync_replica()
+    scheduler.conf.beat_schedule["sync_replica"] = {
+        "task": "apps.%s.tasks.sync_replica" % settings.APP_NAME,
+        "schedule": float(settings.DB_REPLICA_SIMULATED_LAG),
+        "args": (),
+    }
@@ -0,0 +1,69 @@
+"""
+The app is imported as the package of this checkout (like py4web does from
+its apps folder) on a fresh SQLite database in a temporary folder.
+Run from the checkout with: python -m pytest
+"""
+import importlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK = tempfile.mkdtemp(prefix='inventory-tests-')
+
+sys.path.insert(0, os.path.dirname(ROOT))
+os.environ['PY4WEB_APPS_FOLDER'] = os.path.dirname(ROOT)
+os.environ['INVENTORY_DB_URI'] = 'sqlite://' + os.path.join(WORK, 'test.sqlite')
+os.environ['INVENTORY_DB_FOLDER'] = WORK
+os.environ.pop('INVENTORY_DB_REPLICA_URI', None)
+
+app = importlib.import_module(os.path.basename(ROOT))
+importlib.import_module(app.__name__ + '.benchmarks.runner')
+db = app.common.db
+
+# no rollup thread in the middle of a test
+if not app.settings.USE_CELERY:
+    app.common.scheduler.stop()
+
+
+@pytest.fixture
+def clean():
+    # data_version is kept: the per-process caches hold values keyed on its
+    # counters, which must not start again from 0
+    for name in db.tables:
+        if name != 'data_version':
+            db[name].truncate()
+    db.commit()
+    yield db
+    db.rollback()
+
+
+# Insert n products (in a new category unless one is given), returns their ids
+def make_products(n, prefix='P', category=None):
+    if category is None:
+        category = db.categories.insert(name='%s category' % prefix)
+    return [db.product.insert(product_code='%s%04d' % (prefix, i), description='item %s' % i,
+                              unit='pcs', categories_id=category)
+            for i in range(n)]
+
+
+# A ReplicaReads on a second SQLite file, a copy of the primary taken by
+# sync() (call it again to let the replica catch up)
+@pytest.fixture
+def replica_reads(clean):
+    replica = app.replica
+    primary_path = os.path.join(WORK, 'test.sqlite')
+    replica_path = os.path.join(WORK, 'replica.sqlite')
+    reads = replica.ReplicaReads(db, 'sqlite://replica.sqlite', folder=WORK)
+
+    def sync():
+        db.commit()
+        replica.sync_sqlite(primary_path, replica_path)
+
+    reads.sync = sync
+    sync()
+    yield reads
+    db.route(None)
+    reads.adapter.close()
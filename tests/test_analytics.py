@@ -0,0 +1,37 @@
+"""
+Analytics series: ISO week buckets on every engine, rollup plus tail.
+"""
+import datetime
+
+from conftest import app, db, make_products
+
+analytics = app.analytics
+
+
+def test_week_label_is_iso():
+    assert analytics.week_label('2024-12-29') == '2024-W52'
+    assert analytics.week_label(datetime.date(2024, 12, 30)) == '2025-W01'
+    assert analytics.week_label('2021-01-03') == '2020-W53'
+
+
+def test_week_series_across_the_year_end(clean):
+    a, = make_products(1)
+    for day, quantity in (('2024-12-29', 1), ('2024-12-30', 2), ('2025-01-01', 4)):
+        invoice = db.input_invoice.insert(name=day, created_at=day)
+        db.input_invoice_details.insert(input_invoice_id=invoice, product_id=a,
+                                        quantity=quantity, unit_price=1)
+    # the first lines in the rollup, the last one in the tail
+    app.rollup.run()
+    app.rollup.run()
+    invoice = db.output_invoice.insert(name='out', created_at='2025-01-02')
+    db.output_invoice_details.insert(output_invoice_id=invoice, product_id=a, quantity=3,
+                                     unit_price=1)
+    result = analytics.series('2024-12-01', '2025-01-31', bucket='week')
+    assert result['labels'] == ['2024-W52', '2025-W01']
+    assert result['series'][0]['import'] == [1, 6]
+    assert result['series'][0]['export'] == [0, 3]
+    # cached until a line is written
+    db.output_invoice_details.insert(output_invoice_id=invoice, product_id=a, quantity=1,
+                                     unit_price=1)
+    assert analytics.series('2024-12-01', '2025-01-31', bucket='week')['series'][0]['export'] \
+        == [0, 4]
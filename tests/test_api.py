@@ -0,0 +1,56 @@
+"""
+JSON API: ETags from the version counters, 304 on a matching If-None-Match.
+"""
+import inspect
+
+from py4web.core import bottle
+
+from conftest import app, db, make_products
+
+api = app.api
+runner = app.benchmarks.runner
+
+
+# (status, etag, body) of one API call
+def get(action, *args, etag=None, **params):
+    runner.bind_request('GET', params, headers={'If-None-Match': etag} if etag else None)
+    body = inspect.unwrap(getattr(api, action))(*args)
+    return bottle.response.status_code, bottle.response.headers['ETag'], body
+
+
+def test_item_not_modified_until_the_row_changes(clean):
+    a, b = make_products(2)
+    status, etag, body = get('api_item', 'products', a)
+    assert status == 200 and body['item']['product_code'] == 'P0000'
+    assert get('api_item', 'products', a, etag=etag)[:2] == (304, etag)
+    # another product does not change this one
+    db(db.product.id == b).update(description='changed')
+    assert get('api_item', 'products', a, etag=etag)[0] == 304
+    db(db.product.id == a).update(description='changed')
+    status, new_etag, body = get('api_item', 'products', a, etag=etag)
+    assert status == 200 and new_etag != etag and body['item']['description'] == 'changed'
+
+
+def test_invoice_page_follows_its_lines(clean):
+    a, = make_products(1)
+    invoice = db.output_invoice.insert(name='out')
+    status, etag, body = get('api_list', 'export_invoices')
+    assert status == 200 and [item['id'] for item in body['items']] == [invoice]
+    assert get('api_list', 'export_invoices', etag=etag)[0] == 304
+    # the header totals change with the lines
+    db.output_invoice_details.insert(output_invoice_id=invoice, product_id=a, quantity=2,
+                                     unit_price=5)
+    status, etag, body = get('api_list', 'export_invoices', etag=etag)
+    assert status == 200 and body['items'][0]['total_amount'] == 10
+    status, lines_etag, body = get('api_lines', 'export_invoices', invoice)
+    assert [line['product_code'] for line in body['items']] == ['P0000']
+    assert get('api_lines', 'export_invoices', invoice, etag=lines_etag)[0] == 304
+
+
+def test_etag_depends_on_the_query(clean):
+    a, b, c = make_products(3)
+    _, all_etag, body = get('api_list', 'products')
+    _, ids_etag, batch = get('api_list', 'products', ids='%s,%s' % (a, b))
+    assert all_etag != ids_etag and len(body['items']) == 3
+    assert [item['id'] for item in batch['items']] == [a, b]
+    assert get('api_list', 'products', etag=all_etag, fields='product_code')[0] == 200
@@ -0,0 +1,88 @@
+"""
+Archived invoices: moved with their lines, readable, and read only.
+"""
+import inspect
+
+import pytest
+from py4web.core import bottle
+
+from conftest import app, db, make_products
+
+archive = app.archive
+controllers = app.controllers
+runner = app.benchmarks.runner
+stock = app.stock
+
+
+def archived_invoice():
+    a, = make_products(1)
+    old = db.output_invoice.insert(name='old', created_at='2020-01-01')
+    new = db.output_invoice.insert(name='new', created_at='2026-01-01')
+    for invoice_id in (old, new):
+        db.output_invoice_details.insert(output_invoice_id=invoice_id, product_id=a,
+                                         quantity=1, unit_price=10)
+    db.commit()
+    app.rollup.run()
+    assert archive.archive('2021-01-01')['output_invoice'] == 1
+    return a, old, new
+
+
+def call(action, *args, **params):
+    runner.bind_request('POST', params)
+    with pytest.raises(bottle.HTTPResponse) as error:
+        inspect.unwrap(getattr(controllers, action))(*args)
+    return error.value.status_code
+
+
+def test_archive_moves_invoice_and_lines(clean):
+    a, old, new = archived_invoice()
+    assert db.output_invoice(old) is None and db.output_invoice_archive(old).line_count == 1
+    assert db(db.output_invoice_details_archive.output_invoice_id == old).count() == 1
+    # archiving sells nothing
+    assert stock.on_hand(a) == -2
+    rows, header, details = archive.find(db.output_invoice, old)
+    assert header is db.output_invoice_archive and rows.first().name == 'old'
+
+
+def test_archived_page_has_no_edit_controls(clean):
+    a, old, new = archived_invoice()
+    pages = {}
+    for invoice_id in (old, new):
+        runner.bind_request('GET')
+        output = inspect.unwrap(controllers.get_invoice)(invoice_id=invoice_id)
+        pages[invoice_id] = runner.render_template('invoice.html', output)
+    assert 'can no longer be edited' in pages[old]
+    for control in ('deleteModal', 'OrderModal', 'BulkModal', 'delete_product',
+                    'Add Customer Infor'):
+        assert control in pages[new]
+        assert control not in pages[old]
+
+
+def test_archived_invoice_rejects_changes(clean):
+    a, old, new = archived_invoice()
+    line = db(db.output_invoice_details_archive.id > 0).select().first().id
+    assert call('post_invoice', old, productId=a, quantity=1, unit_price=1) == 403
+    assert call('post_invoice_lines', old) == 403
+    assert call('delete_invoice', id=old) == 403
+    assert call('delete', line, old) == 403
+    assert call('customer', old, fullname='x') == 403
+    assert call('post_invoice', 999, productId=a, quantity=1, unit_price=1) == 404
+    assert db.output_invoice_archive(old).customer_name is None
+
+
+def test_archived_import_invoice_is_read_only(clean):
+    a, = make_products(1)
+    old = db.input_invoice.insert(name='old', created_at='2020-01-01')
+    db.input_invoice_details.insert(input_invoice_id=old, product_id=a, quantity=3,
+                                    unit_price=10)
+    db.commit()
+    app.rollup.run()
+    assert archive.archive('2021-01-01')['input_invoice'] == 1
+    runner.bind_request('GET')
+    output = inspect.unwrap(controllers.get_import_invoice)(invoice_id=old)
+    page = runner.render_template('import_invoice.html', output)
+    assert 'can no longer be edited' in page
+    for control in ('deleteModal', 'OrderModal', 'BulkModal', 'delete_import_product'):
+        assert control not in page
+    assert call('post_import_invoice', old, productId=a, quantity=1, unit_price=1) == 403
+    assert call('delete_import_invoice', id=old) == 403
@@ -0,0 +1,74 @@
+"""
+Bulk invoice deletion (see cleanup.py and the delete_invoices action).
+"""
+import inspect
+
+import pytest
+from py4web.core import bottle
+
+from conftest import app, db, make_products
+
+controllers = app.controllers
+runner = app.benchmarks.runner
+scheduler = app.common.scheduler
+
+
+def invoices():
+    a, = make_products(1)
+    full = db.input_invoice.insert(name='full')
+    db.input_invoice_details.insert(input_invoice_id=full, product_id=a, quantity=1,
+                                    unit_price=1)
+    empty = db.input_invoice.insert(name='empty')
+    db.commit()
+    return full, empty
+
+
+# Post a deletion and run the task it queued (the scheduler thread is stopped)
+def delete(params):
+    runner.bind_request('POST', params)
+    result = inspect.unwrap(controllers.delete_invoices)('import_invoices')
+    assert bottle.response.status_code == 202
+    assert scheduler.run_queued() == 1
+    return result
+
+
+def test_delete_empty_invoices(clean):
+    full, empty = invoices()
+    assert delete(dict(empty='1')) == dict(queued=True, kind='import_invoices')
+    assert db.input_invoice(full) and not db.input_invoice(empty)
+
+
+def test_deletion_is_queued(clean):
+    full, empty = invoices()
+    runner.bind_request('POST', dict(ids='%s,%s' % (full, empty)))
+    inspect.unwrap(controllers.delete_invoices)('import_invoices')
+    # nothing deleted inside the request
+    assert db.input_invoice(full) and db.input_invoice(empty)
+    assert scheduler.run_queued() == 1
+    assert db(db.input_invoice.id > 0).isempty()
+    assert db(db.input_invoice_details.id > 0).isempty()
+
+
+def test_bad_ids_are_rejected_before_queueing(clean):
+    invoices()
+    with pytest.raises(bottle.HTTPResponse) as error:
+        delete(dict(ids='1,x'))
+    assert error.value.status_code == 400
+    assert scheduler.run_queued() == 0
+
+
+@pytest.mark.parametrize('value', ['0', 'false', 'no', ''])
+def test_empty_false_is_not_a_filter(clean, value):
+    full, empty = invoices()
+    # no filter given: 400
+    with pytest.raises(bottle.HTTPResponse) as error:
+        delete(dict(empty=value))
+    assert error.value.status_code == 400
+    assert scheduler.run_queued() == 0
+    assert db.input_invoice(full) and db.input_invoice(empty)
+
+
+def test_empty_false_with_ids(clean):
+    full, empty = invoices()
+    delete(dict(ids='%s' % full, empty='false'))
+    assert not db.input_invoice(full) and db.input_invoice(empty)
@@ -0,0 +1,46 @@
+"""
+Streamed exports: batches, and the connection of a lazy body.
+"""
+import pytest
+from pydal.connection import THREAD_LOCAL
+
+from conftest import app, db, make_products
+
+exports = app.exports
+
+
+# whether this thread holds a connection of db (reading adapter.connection
+# would open one)
+def connected():
+    return getattr(THREAD_LOCAL, db._adapter._connection_uname_, None) is not None
+
+
+def test_invoice_list_csv_in_batches(clean, monkeypatch):
+    monkeypatch.setattr(exports, 'BATCH', 2)
+    for i in range(5):
+        db.output_invoice.insert(name='out %s' % i, created_at='2026-01-0%s' % (i + 1))
+    header, records = exports.invoice_list('invoices')
+    text = b''.join(exports.iter_csv(header, records)).decode()
+    assert text.splitlines()[0].startswith('id,name,')
+    assert len(text.splitlines()) == 6
+
+
+def test_lazy_body_gives_its_connection_back(clean):
+    make_products(1)
+    body = exports.with_db(iter([b'a', b'b']))
+    assert b''.join(body) == b'ab'
+    assert not connected()
+    assert db(db.product.id > 0).count() == 1
+
+
+def test_lazy_body_rolls_back_on_error(clean):
+
+    def chunks():
+        db.categories.insert(name='written by the body')
+        yield b'a'
+        raise RuntimeError('client went away')
+
+    with pytest.raises(RuntimeError):
+        b''.join(exports.with_db(chunks()))
+    assert not connected()
+    assert db(db.categories.name == 'written by the body').isempty()
@@ -0,0 +1,96 @@
+"""
+Idempotency keys: a repeated create returns the row created the first time.
+"""
+import datetime
+import inspect
+import threading
+
+import pytest
+from py4web.core import HTTP, bottle
+
+from conftest import app, db
+
+idempotency = app.idempotency
+controllers = app.controllers
+runner = app.benchmarks.runner
+
+
+def creator(name='x'):
+    calls = []
+
+    def create():
+        calls.append(1)
+        return db.output_invoice.insert(name=name)
+
+    return create, calls
+
+
+def test_replay_returns_the_first_result(clean):
+    create, calls = creator()
+    first = idempotency.once('output_invoice', 'k1', create)
+    db.commit()
+    assert idempotency.once('output_invoice', 'k1', create) == first
+    assert idempotency.once('input_invoice', 'k1', create) != first
+    assert len(calls) == 2
+    assert idempotency.once('output_invoice', None, create) != first
+    assert len(calls) == 3
+
+
+def test_expired_key_creates_again(clean):
+    create, calls = creator()
+    first = idempotency.once('output_invoice', 'k1', create)
+    db(db.idempotency_key.id > 0).update(expires_at=datetime.datetime(2000, 1, 1))
+    db.commit()
+    assert idempotency.once('output_invoice', 'k1', create) != first
+    assert idempotency.purge() == 0
+    db(db.idempotency_key.id > 0).update(expires_at=datetime.datetime(2000, 1, 1))
+    assert idempotency.purge() == 1
+
+
+def test_concurrent_retry_waits_for_the_first(clean):
+    claimed, release = threading.Event(), threading.Event()
+    results = {}
+
+    def first():
+        def create():
+            invoice_id = db.output_invoice.insert(name='first')
+            claimed.set()
+            release.wait(5)
+            return invoice_id
+        results['first'] = idempotency.once('output_invoice', 'race', create)
+        db.commit()
+
+    def retry():
+        claimed.wait(5)
+        try:
+            results['retry'] = idempotency.once(
+                'output_invoice', 'race', lambda: db.output_invoice.insert(name='retry'))
+            db.commit()
+        except Exception as error:
+            results['retry'] = error
+            db.rollback()
+
+    threads = [threading.Thread(target=first), threading.Thread(target=retry)]
+    for thread in threads:
+        thread.start()
+    claimed.wait(5)
+    # the retry is blocked on the claimed key until the first one commits
+    threads[1].join(0.3)
+    assert threads[1].is_alive()
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert results['retry'] == results['first']
+    assert db(db.output_invoice.id > 0).count() == 1
+
+
+def test_create_invoice_posted_twice(clean):
+    ids = []
+    for _ in range(2):
+        runner.bind_request('POST', dict(name='posted', idempotency_key='form-1'))
+        with pytest.raises(HTTP):
+            inspect.unwrap(controllers.create_export_invoice)()
+        ids.append(bottle.response.headers['Location'])
+        db.commit()
+    assert ids[0] == ids[1]
+    assert db(db.output_invoice.name == 'posted').count() == 1
@@ -0,0 +1,45 @@
+"""
+The line pages of an invoice: product filter, totals and line numbers.
+"""
+import re
+
+from conftest import app, db, make_products
+
+controllers = app.controllers
+runner = app.benchmarks.runner
+
+
+def page(invoice_id, **params):
+    runner.bind_request('GET', params)
+    return controllers.invoice_lines_page(db.output_invoice_details, 'output_invoice_id',
+                                          invoice_id, params, 'get_invoice')
+
+
+def test_product_filter_covers_every_match(clean):
+    products = make_products(250)
+    other, = make_products(1, prefix='Q')
+    invoice = db.output_invoice.insert(name='out')
+    for product_id in (products[0], products[-1], other):
+        db.output_invoice_details.insert(output_invoice_id=invoice, product_id=product_id,
+                                         quantity=1, unit_price=10)
+    result = page(invoice, product='P')
+    assert [line.product_id for line in result['invoice_details']] == [products[0], products[-1]]
+    assert result['filtered'] == dict(lines=2, quantity=2, amount=20)
+    assert result['total_products'] == 3
+
+
+def test_line_numbers_follow_the_pages(clean):
+    a, = make_products(1)
+    invoice = db.output_invoice.insert(name='out')
+    for i in range(5):
+        db.output_invoice_details.insert(output_invoice_id=invoice, product_id=a, quantity=1,
+                                         unit_price=10)
+    first = page(invoice, limit='2')
+    assert first['offset'] == 0
+    cursor = first['next_url'].split('cursor=')[1].split('&')[0]
+    second = page(invoice, limit='2', cursor=cursor)
+    assert second['offset'] == 2
+    html = runner.render_template('invoice.html', dict(
+        second, invoice=db(db.output_invoice.id == invoice).select(), error=None, archived=False))
+    numbers = re.findall(r'<tr>\s*<td>\s*(\d+)\s*</td>', html)
+    assert numbers == ['3', '4']
@@ -0,0 +1,73 @@
+"""
+The invoice pages load the products of their lines with one query whatever
+the number of lines (see prefetch.py).
+"""
+import inspect
+
+import pytest
+
+from conftest import app, db, make_products
+
+controllers = app.controllers
+runner = app.benchmarks.runner
+
+
+# An export invoice with n lines, each on a product of its own category
+def export_invoice(n):
+    invoice_id = db.output_invoice.insert(name='export %s' % n)
+    for i in range(n):
+        category = db.categories.insert(name='category %s-%s' % (n, i))
+        product_id = make_products(1, prefix='E%s-%s-' % (n, i), category=category)[0]
+        db.output_invoice_details.insert(output_invoice_id=invoice_id, product_id=product_id,
+                                         quantity=1, unit_price=100)
+    db.commit()
+    return invoice_id
+
+
+def import_invoice(n):
+    invoice_id = db.input_invoice.insert(name='import %s' % n)
+    for i in range(n):
+        category = db.categories.insert(name='import category %s-%s' % (n, i))
+        product_id = make_products(1, prefix='I%s-%s-' % (n, i), category=category)[0]
+        db.input_invoice_details.insert(input_invoice_id=invoice_id, product_id=product_id,
+                                        quantity=2, unit_price=50)
+    db.commit()
+    return invoice_id
+
+
+# Statements of one call of the action (unwrapped from its fixtures and the
+# page cache) and of the render of its template
+def queries(action, template, invoice_id):
+    func = inspect.unwrap(getattr(controllers, action))
+    probe = runner.QueryProbe()
+    probe.install()
+    try:
+        runner.bind_request()
+        runner.render_template(template, func(invoice_id=invoice_id))
+    finally:
+        probe.uninstall()
+        db.rollback()
+    return probe.queries
+
+
+@pytest.mark.parametrize('action, template', [
+    ('get_invoice', 'invoice.html'),
+    ('invoiceJson', 'hoadon.html'),
+])
+def test_export_invoice_queries_do_not_grow_with_lines(clean, action, template):
+    small, large = export_invoice(2), export_invoice(12)
+    assert queries(action, template, small) == queries(action, template, large)
+
+
+def test_import_invoice_queries_do_not_grow_with_lines(clean):
+    small, large = import_invoice(2), import_invoice(12)
+    assert queries('get_import_invoice', 'import_invoice.html', small) == \
+        queries('get_import_invoice', 'import_invoice.html', large)
+
+
+def test_invoice_data_attaches_products(clean):
+    invoice_id = export_invoice(3)
+    data = controllers.invoice_data(invoice_id)
+    assert len(data['details']) == 3
+    assert all(line.product.product_code.startswith('E3-') for line in data['details'])
+    assert data['total'] == 300 and data['total_product'] == 3
@@ -0,0 +1,82 @@
+"""
+Request metrics fixture: statements, rows and the Prometheus exposition.
+"""
+import logging
+
+from py4web.core import bottle
+
+from conftest import app, db, make_products
+
+metrics = app.metrics.metrics
+runner = app.benchmarks.runner
+
+
+# Run body() as one request seen by the fixture m
+def request(m, body, path='bench'):
+    runner.bind_request('GET')
+    bottle.request.environ['PATH_INFO'] = '/%s/%s' % (app.settings.APP_NAME, path)
+    m.on_request({})
+    body()
+    m.on_success({})
+
+
+def test_queries_and_rows_per_action(clean):
+    make_products(3)
+    db.commit()
+
+    def body():
+        db(db.product.id > 0).select(db.product.id)
+        db(db.categories.id > 0).count()
+
+    request(metrics, body, 'metrics-test')
+    entry = metrics.actions['/%s/metrics-test' % app.settings.APP_NAME]
+    assert entry['queries'].total == 2
+    assert entry['rows'] == 3
+    assert entry['statuses'] == {'200': 1}
+    text = metrics.exposition()
+    assert 'inventory_request_queries_count{action="/%s/metrics-test"} 1' % (
+        app.settings.APP_NAME) in text
+    # statements outside a request are not counted
+    db(db.product.id > 0).select(db.product.id)
+    assert metrics.actions['/%s/metrics-test' % app.settings.APP_NAME]['rows'] == 3
+
+
+def test_slow_request_is_logged(clean, monkeypatch):
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    slow_log, level = app.metrics.slow_log, app.metrics.slow_log.level
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.INFO)
+    monkeypatch.setattr(metrics, 'slow_ms', 0.000001)
+    try:
+        request(metrics, lambda: db(db.product.id > 0).select(db.product.id), 'slow-test')
+    finally:
+        slow_log.removeHandler(handler)
+        slow_log.setLevel(level)
+    assert len(records) == 1 and 'queries=1' in records[0].getMessage()
+
+
+def test_replica_statements_are_counted(replica_reads, monkeypatch):
+    # the new fixture hooks the primary adapter too: undo it afterwards
+    monkeypatch.setattr(db._adapter, 'execution_handlers', db._adapter.execution_handlers)
+    monkeypatch.setattr(db._adapter, 'parse', db._adapter.parse)
+    m = app.metrics.RequestMetrics(db, replica=replica_reads)
+    make_products(2)
+    replica_reads.sync()
+    # connect first: the connection's own setup statements are not asserted
+    db.route(replica_reads.adapter)
+    db(db.product.id > 0).count()
+    db.route(None)
+
+    def body():
+        replica_reads.on_request({})
+        try:
+            assert db._adapter is replica_reads.adapter
+            db(db.product.id > 0).select(db.product.id)
+        finally:
+            replica_reads.on_success({})
+
+    request(m, body, 'replica-test')
+    entry = m.actions['/%s/replica-test' % app.settings.APP_NAME]
+    assert entry['queries'].total == 1 and entry['rows'] == 2
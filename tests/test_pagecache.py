@@ -0,0 +1,72 @@
+"""
+Page cache: a page is served from the cache until a counter it depends on moves.
+"""
+import inspect
+
+from conftest import app, db, make_products
+
+controllers = app.controllers
+pages = app.pagecache.pages
+runner = app.benchmarks.runner
+
+
+# The action as the pages fixture sees it: wrapped by pages.cached() only
+def cached(action):
+    return inspect.unwrap(getattr(controllers, action),
+                          stop=lambda f: not hasattr(f.__wrapped__, '__wrapped__'))
+
+
+# (served from the cache, html) of one request, with the fixture hooks
+def request(action, template, invoice_id):
+    runner.bind_request('GET')
+    pages.on_request({})
+    output = cached(action)(invoice_id=invoice_id)
+    hit = isinstance(output, str)
+    html = output if hit else runner.render_template(template, output)
+    pages.on_success({'output': html})
+    db.commit()
+    return hit, html
+
+
+def test_invoice_page_is_invalidated_by_writes(clean):
+    a, = make_products(1)
+    invoice = db.output_invoice.insert(name='out')
+    other = db.output_invoice.insert(name='other')
+    db.commit()
+    assert request('get_invoice', 'invoice.html', invoice)[0] is False
+    assert request('get_invoice', 'invoice.html', invoice)[0] is True
+    # a line of another invoice does not touch this page
+    db.output_invoice_details.insert(output_invoice_id=other, product_id=a, quantity=1,
+                                     unit_price=7)
+    assert request('get_invoice', 'invoice.html', invoice)[0] is True
+    # a line of this invoice does
+    db.output_invoice_details.insert(output_invoice_id=invoice, product_id=a, quantity=1,
+                                     unit_price=7)
+    hit, html = request('get_invoice', 'invoice.html', invoice)
+    assert hit is False and 'P0000' in html
+    # and so does a product (the codes on the page)
+    assert request('get_invoice', 'invoice.html', invoice)[0] is True
+    db(db.product.id == a).update(product_code='R0000')
+    hit, html = request('get_invoice', 'invoice.html', invoice)
+    assert hit is False and 'R0000' in html
+
+
+def test_print_page_is_invalidated_by_header_edits(clean):
+    invoice = db.output_invoice.insert(name='out')
+    db.commit()
+    assert request('invoiceJson', 'hoadon.html', invoice)[0] is False
+    assert request('invoiceJson', 'hoadon.html', invoice)[0] is True
+    db(db.output_invoice.id == invoice).update(customer_name='Someone New')
+    hit, html = request('invoiceJson', 'hoadon.html', invoice)
+    assert hit is False and 'Someone New' in html
+
+
+def test_error_response_is_not_stored(clean):
+    invoice = db.output_invoice.insert(name='out')
+    db.commit()
+    runner.bind_request('GET')
+    pages.on_request({})
+    cached('get_invoice')(invoice_id=invoice)
+    pages.on_error({})
+    pages.on_success({'output': 'not the page'})
+    assert request('get_invoice', 'invoice.html', invoice)[0] is False
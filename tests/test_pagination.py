@@ -0,0 +1,36 @@
+"""
+Keyset pages with malformed cursors read as the first page.
+"""
+import inspect
+
+import pytest
+
+from conftest import app, db, make_products
+
+pagination = app.pagination
+controllers = app.controllers
+api = app.api
+runner = app.benchmarks.runner
+
+
+@pytest.mark.parametrize('params, cursor', [
+    (dict(cursor='12'), '12'),
+    (dict(cursor='abc'), None),
+    (dict(cursor='-1'), None),
+    (dict(cursor='2024-01-01,7', order='created_at'), '2024-01-01,7'),
+    (dict(cursor='2024-01-01,x', order='created_at'), None),
+    (dict(cursor='12', order='created_at'), None),
+])
+def test_page_params_cursor(params, cursor):
+    assert pagination.page_params(params)['cursor'] == cursor
+
+
+def test_bad_cursor_is_the_first_page(clean):
+    category = db.categories.insert(name='tools')
+    make_products(3, category=category)
+    first = controllers.dashboard_page('products', {})
+    assert controllers.dashboard_page('products', dict(cursor='abc')) == first
+    runner.bind_request('GET', dict(cursor='abc', order='created_at'))
+    assert len(inspect.unwrap(api.api_list)('products')['items']) == 3
+    runner.bind_request('GET', dict(cursor='2024-01-01,7', order='created_at'))
+    assert len(inspect.unwrap(controllers.category_products)(category)['items']) == 3
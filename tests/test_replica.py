@@ -0,0 +1,75 @@
+"""
+Read replica routing: reads go to the replica unless the client just wrote.
+"""
+import time
+
+from py4web.core import bottle
+
+from conftest import app, db, make_products
+
+runner = app.benchmarks.runner
+COOKIE = app.replica.COOKIE
+
+
+# Product codes as seen by the current connection
+def codes():
+    rows = db(db.product.id > 0).select(db.product.product_code)
+    return sorted(row.product_code for row in rows)
+
+
+def test_reads_are_routed_to_the_replica(replica_reads):
+    make_products(1, 'A')
+    replica_reads.sync()
+    make_products(1, 'B')
+    db.commit()
+
+    runner.bind_request('GET')
+    replica_reads.on_request({})
+    assert db.routed() is replica_reads.adapter
+    # the replica has not seen B yet
+    assert codes() == ['A0000']
+    replica_reads.on_success({})
+    assert db.routed() is None
+    assert codes() == ['A0000', 'B0000']
+
+    replica_reads.sync()
+    runner.bind_request('GET')
+    replica_reads.on_request({})
+    assert codes() == ['A0000', 'B0000']
+    replica_reads.on_error({})
+    assert db.routed() is None
+
+
+def test_recent_write_keeps_reads_on_the_primary(replica_reads):
+    runner.bind_request('POST')
+    replica_reads.writes.on_request({})
+    make_products(1, 'A')
+    db.commit()
+    replica_reads.writes.on_success({})
+    cookie = bottle.response._cookies[COOKIE].value
+    assert float(cookie) > time.time()
+
+    # the redirect that follows carries the cookie: served by the primary
+    runner.bind_request('GET', headers={'Cookie': '%s=%s' % (COOKIE, cookie)})
+    replica_reads.on_request({})
+    assert db.routed() is None
+    assert codes() == ['A0000']
+    replica_reads.on_success({})
+
+    # once the window is over, back to the replica
+    expired = str(int(time.time() - 1))
+    runner.bind_request('GET', headers={'Cookie': '%s=%s' % (COOKIE, expired)})
+    replica_reads.on_request({})
+    assert db.routed() is replica_reads.adapter
+    assert codes() == []
+    replica_reads.on_success({})
+
+
+def test_without_replica_everything_stays_on_the_primary(clean):
+    reads = app.replica.ReplicaReads(db)
+    runner.bind_request('GET')
+    reads.on_request({})
+    assert db.routed() is None
+    reads.writes.on_success({})
+    assert not bottle.response._cookies
+    reads.on_success({})
@@ -0,0 +1,56 @@
+"""
+The product typeahead (search.py) on the catalog cache (catalog.py).
+"""
+from conftest import app, db, make_products
+
+search = app.search
+catalog = app.catalog.catalog
+
+
+def codes(text, limit=10):
+    return [item['code'] for item in search.search(text, limit)]
+
+
+def test_code_prefix_then_description(clean):
+    category = db.categories.insert(name='tools')
+    for code, description in (('B200', 'steel bolt'), ('A100', 'blue cable'),
+                              ('A101', 'steel pipe'), ('C300', 'red tape')):
+        db.product.insert(product_code=code, description=description, unit='pcs',
+                          categories_id=category)
+    assert codes('A1') == ['A100', 'A101']
+    assert codes('A1', limit=1) == ['A100']
+    assert codes('steel') == ['A101', 'B200']
+    assert codes('x') == []
+
+
+def test_catalog_is_reloaded_only_after_a_write(clean):
+    make_products(3)
+    search.search('P')
+    hits, misses = catalog.hits, catalog.misses
+    assert codes('P000') == ['P0000', 'P0001', 'P0002']
+    assert (catalog.hits, catalog.misses) == (hits + 1, misses)
+    db(db.product.product_code == 'P0001').update(product_code='Z0001')
+    assert codes('P000') == ['P0000', 'P0002']
+    assert catalog.misses == misses + 1
+
+
+def test_description_matches_past_many_candidates(clean, monkeypatch):
+    monkeypatch.setattr(search, 'BATCH', 7)
+    category = db.categories.insert(name='tools')
+    # candidates having every trigram of 'steel bolt' without the substring
+    for i in range(30):
+        db.product.insert(product_code='A%03d' % i, description='bolt steel %s' % i,
+                          unit='pcs', categories_id=category)
+    db.product.insert(product_code='Z999', description='Steel Bolt M8', unit='pcs',
+                      categories_id=category)
+    assert codes('steel bolt') == ['Z999']
+    assert len(search.description_ids('steel', limit=None)) == 31
+
+
+def test_short_query_matches_accented_descriptions(clean):
+    category = db.categories.insert(name='tools')
+    db.product.insert(product_code='H1', description='Hàng hóa', unit='pcs',
+                      categories_id=category)
+    db.product.insert(product_code='H2', description='ống', unit='pcs', categories_id=category)
+    assert codes('ha') == ['H1']
+    assert codes('on') == ['H2']
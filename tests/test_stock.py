@@ -0,0 +1,98 @@
+"""
+The product_stock ledger follows every DAL write to the invoice lines.
+"""
+import pytest
+
+from conftest import app, db, make_products
+
+stock = app.stock
+bulk = app.bulk
+
+
+def assert_no_drift():
+    assert stock.reconcile(fix=False) == []
+
+
+def test_line_insert_and_delete(clean):
+    a, b = make_products(2)
+    imported = db.input_invoice.insert(name='in')
+    exported = db.output_invoice.insert(name='out')
+    db.input_invoice_details.insert(input_invoice_id=imported, product_id=a, quantity=10,
+                                    unit_price=5)
+    line = db.output_invoice_details.insert(output_invoice_id=exported, product_id=a,
+                                            quantity=3, unit_price=7)
+    db.input_invoice_details.insert(input_invoice_id=imported, product_id=b, quantity=4,
+                                    unit_price=5)
+    assert stock.on_hand_many([a, b]) == {a: 7, b: 4}
+    db(db.output_invoice_details.id == line).delete()
+    assert stock.on_hand(a) == 10
+    assert_no_drift()
+
+
+def test_line_update_quantity_and_product(clean):
+    a, b = make_products(2)
+    invoice = db.input_invoice.insert(name='in')
+    line = db.input_invoice_details.insert(input_invoice_id=invoice, product_id=a, quantity=10,
+                                           unit_price=5)
+    db(db.input_invoice_details.id == line).update(quantity=6)
+    assert stock.on_hand_many([a, b]) == {a: 6}
+    # the update changes the column its query is on
+    db(db.input_invoice_details.product_id == a).update(product_id=b)
+    assert stock.on_hand_many([a, b]) == {a: 0, b: 6}
+    db(db.input_invoice_details.id > 0).update(unit_price=9)
+    assert stock.on_hand(b) == 6
+    assert_no_drift()
+
+
+def test_invoice_and_product_delete(clean):
+    a, b = make_products(2)
+    invoice = db.input_invoice.insert(name='in')
+    other = db.input_invoice.insert(name='in 2')
+    db.input_invoice_details.insert(input_invoice_id=invoice, product_id=a, quantity=10,
+                                    unit_price=5)
+    db.input_invoice_details.insert(input_invoice_id=other, product_id=a, quantity=1,
+                                    unit_price=5)
+    db.input_invoice_details.insert(input_invoice_id=other, product_id=b, quantity=2,
+                                    unit_price=5)
+    db(db.input_invoice.id == invoice).delete()
+    assert stock.on_hand_many([a, b]) == {a: 1, b: 2}
+    db(db.product.id == b).delete()
+    assert db(db.input_invoice_details.id > 0).count() == 1
+    assert_no_drift()
+
+
+def test_reserve(clean):
+    a, b = make_products(2)
+    invoice = db.input_invoice.insert(name='in')
+    db.input_invoice_details.insert(input_invoice_id=invoice, product_id=a, quantity=5,
+                                    unit_price=5)
+    assert stock.reserve(a, 5) == {a: 5}
+    with pytest.raises(stock.OutOfStock) as error:
+        stock.reserve(a, 6)
+    assert (error.value.product_id, error.value.wanted, error.value.available) == (a, 6, 5)
+    # a product never imported has no ledger row: nothing in stock
+    with pytest.raises(stock.OutOfStock) as error:
+        stock.reserve_many({a: 1, b: 1})
+    assert error.value.product_id == b
+    assert stock.reserve_many({a: 0}) == {}
+
+
+def test_bulk_export_is_all_or_nothing(clean):
+    a, b = make_products(2)
+    imported = db.input_invoice.insert(name='in')
+    for product_id in (a, b):
+        db.input_invoice_details.insert(input_invoice_id=imported, product_id=product_id,
+                                        quantity=3, unit_price=5)
+    exported = db.output_invoice.insert(name='out')
+    lines = [dict(product_id=a, quantity=2, unit_price=9),
+             dict(product_id=b, quantity=2, unit_price=9),
+             dict(product_id=b, quantity=2, unit_price=9)]
+    result = bulk.add_lines(db.output_invoice_details, 'output_invoice_id', exported, lines,
+                            sign=-1)
+    assert result['inserted'] == 0 and 'only 3 in stock' in result['errors'][0]['error']
+    assert stock.on_hand_many([a, b]) == {a: 3, b: 3}
+    result = bulk.add_lines(db.output_invoice_details, 'output_invoice_id', exported, lines[:2],
+                            sign=-1)
+    assert result == dict(inserted=2, errors=[])
+    assert stock.on_hand_many([a, b]) == {a: 1, b: 1}
+    assert_no_drift()
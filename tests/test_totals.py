@@ -0,0 +1,44 @@
+"""
+The stored invoice totals (total_amount, line_count) follow the lines.
+"""
+from conftest import app, db, make_products
+
+counters = app.counters
+
+
+def assert_totals(invoice_id):
+    details = db.output_invoice_details
+    header = db.output_invoice(invoice_id)
+    summary = counters.invoice_summary(details, 'output_invoice_id', invoice_id)
+    assert (header.total_amount, header.line_count) == (summary['amount'], summary['lines'])
+    for line in db(details.output_invoice_id == invoice_id).select():
+        assert line.total_price == line.quantity * line.unit_price
+
+
+def test_product_delete_keeps_totals(clean):
+    a, b, c = make_products(3)
+    invoice = db.output_invoice.insert(name='out')
+    for product_id, quantity in ((a, 1), (b, 2), (c, 3)):
+        db.output_invoice_details.insert(output_invoice_id=invoice, product_id=product_id,
+                                         quantity=quantity, unit_price=5)
+    assert (db.output_invoice(invoice).total_amount, db.output_invoice(invoice).line_count) == (30, 3)
+    db(db.product.id == a).delete()
+    assert (db.output_invoice(invoice).total_amount, db.output_invoice(invoice).line_count) == (25, 2)
+    assert_totals(invoice)
+
+
+def test_line_updates_keep_totals(clean):
+    a, = make_products(1)
+    first = db.output_invoice.insert(name='first')
+    second = db.output_invoice.insert(name='second')
+    line = db.output_invoice_details.insert(output_invoice_id=first, product_id=a, quantity=2,
+                                            unit_price=10)
+    db(db.output_invoice_details.id == line).update(quantity=5)
+    assert db.output_invoice(first).total_amount == 50
+    db(db.output_invoice_details.id == line).update(unit_price=3)
+    assert db.output_invoice(first).total_amount == 15
+    db(db.output_invoice_details.id == line).update(output_invoice_id=second)
+    assert (db.output_invoice(first).total_amount, db.output_invoice(first).line_count) == (0, 0)
+    assert (db.output_invoice(second).total_amount, db.output_invoice(second).line_count) == (15, 1)
+    assert_totals(first)
+    assert_totals(second)
@@ -0,0 +1,67 @@
+"""
+Denormalized invoice totals.
+
+input_invoice / output_invoice carry total_amount and line_count. They are
+adjusted by DAL callbacks on the detail tables whenever a line is added,
+changed or removed (the lines of a deleted product are deleted through the
+DAL first, see stock.track()), so invoice lists can show totals without
+reading any detail row.
+backfill() recomputes them (and the stored total_price of every line) from
+the detail tables.
+"""
+from .common import db
+from .dbutils import around_updates
+
+
+# Add (or with negative values remove) lines and amount to one invoice
+def adjust(header, invoice_id, lines, amount):
+    if not invoice_id or not (lines or amount):
+        return
+    db(header.id == int(invoice_id)).update(
+        total_amount=header.total_amount.coalesce_zero() + amount,
+        line_count=header.line_count.coalesce_zero() + lines)
+
+
+# (invoice_id, line count, amount) per invoice of the detail lines matched by query
+def _per_invoice(details, invoice_field, query):
+    lines = details.id.count()
+    amount = details.total_price.sum()
+    rows = db(query).select(details[invoice_field], lines, amount, groupby=details[invoice_field])
+    return [(row[details[invoice_field]], row[lines] or 0, row[amount] or 0) for row in rows]
+
+
+# Keep the header totals of one invoice detail table up to date
+def track(header, details, invoice_field):
+
+    def line_inserted(fields, id):
+        quantity = int(fields.get('quantity') or 0)
+        unit_price = int(fields.get('unit_price') or 0)
+        adjust(header, fields.get(invoice_field), 1, quantity * unit_price)
+
+    def lines_deleted(dbset):
+        for invoice_id, lines, amount in _per_invoice(details, invoice_field, dbset.query):
+            adjust(header, invoice_id, -lines, -amount)
+
+    # an update of quantity, price or invoice: take the lines out of their
+    # invoices before, recompute total_price (the compute only runs when the
+    # update sets both quantity and unit_price) and put them back after
+    def lines_moving(ids):
+        lines_deleted(db(details.id.belongs(ids)))
+
+    def lines_moved(ids):
+        db(details.id.belongs(ids)).update_naive(total_price=details.quantity * details.unit_price)
+        for invoice_id, lines, amount in _per_invoice(details, invoice_field,
+                                                      details.id.belongs(ids)):
+            adjust(header, invoice_id, lines, amount)
+
+    details._after_insert.append(line_inserted)
+    around_updates(details, ('quantity', 'unit_price', invoice_field), lines_moving, lines_moved)
+    details._before_delete.append(lines_deleted)
+
+
+# Recompute total_price of every line and the totals of every invoice
+def backfill(header, details, invoice_field):
+    db(details.id > 0).update(total_price=details.quantity * details.unit_price)
+    db(header.id > 0).update(total_amount=0, line_count=0)
+    for invoice_id, lines, amount in _per_invoice(details, invoice_field, details.id > 0):
+        db(header.id == invoice_id).update(total_amount=amount, line_count=lines)
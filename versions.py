@@ -0,0 +1,107 @@
+"""
+Data version counters stored in the database.
+
+Each counter is a row of data_version (name, version). Writes bump the
+counters they affect in the same transaction, so every worker process can
+tell whether something it cached is still current by reading one indexed
+row instead of re-running the query that built it.
+
+Counters bumped by most transactions (the per-table ones, see counters.py)
+are sharded: a bump increments one of SHARDS rows, picked per thread so one
+transaction keeps hitting the same row, and a read sums them. Concurrent
+writers then rarely wait on each other's counter row lock until commit.
+"""
+import os
+import threading
+
+from .common import db
+from .dbutils import savepoint
+
+SHARDS = 16
+
+# names of the sharded counters
+sharded = set()
+
+
+# Spread the bumps of a counter over SHARDS rows from now on; the rows
+# already bumped keep counting, so its value does not go back
+def shard(name):
+    sharded.add(name)
+
+
+def _shard_names(name):
+    return [name] + ['%s#%s' % (name, i) for i in range(SHARDS)]
+
+
+# Increment a counter (creating it on first use)
+def bump(name):
+    if name in sharded:
+        name = '%s#%s' % (name, hash((os.getpid(), threading.get_ident())) % SHARDS)
+    counter = db.data_version
+    updated = db(counter.name == name).update(version=counter.version + 1)
+    if not updated:
+        try:
+            # in a savepoint: a failed insert must not abort the transaction
+            with savepoint('data_version_insert'):
+                counter.insert(name=name, version=1)
+        except db._adapter.driver.IntegrityError:
+            # a concurrent transaction created the row first (names are
+            # unique): the update waits for its commit and then finds it
+            db(counter.name == name).update(version=counter.version + 1)
+
+
+# Current value of a counter, 0 if it was never bumped
+def current(name):
+    if name in sharded:
+        return current_many([name]).get(name, 0)
+    row = db(db.data_version.name == name).select(
+        db.data_version.version, limitby=(0, 1)).first()
+    return row.version if row else 0
+
+
+# Current values of several counters in one query, as {name: version}
+def current_many(names):
+    owner = {}
+    for name in names:
+        for row_name in (_shard_names(name) if name in sharded else [name]):
+            owner[row_name] = name
+    rows = db(db.data_version.name.belongs(list(owner))).select(
+        db.data_version.name, db.data_version.version)
+    result = {}
+    for row in rows:
+        name = owner[row.name]
+        result[name] = result.get(name, 0) + (row.version or 0)
+    return result
+
+
+# Bump the named counters on every insert, update and delete of table
+# (actions, Grid, dbadmin or any other DAL path)
+def watch(table, *names):
+
+    def changed(*args):
+        for name in names:
+            bump(name)
+
+    table._after_insert.append(changed)
+    table._after_update.append(changed)
+    table._after_delete.append(changed)
+
+
+# Name of the counter of one row, e.g. 'output_invoice:12'
+def row_name(table, id):
+    return '%s:%s' % (table._tablename, id)
+
+
+# Bump the counter of each row of table that is inserted, updated or deleted
+def watch_rows(table):
+
+    def inserted(fields, id):
+        bump(row_name(table, id))
+
+    def changed(dbset, *args):
+        for row in dbset.select(table.id):
+            bump(row_name(table, row.id))
+
+    table._after_insert.append(inserted)
+    table._after_update.append(changed)
+    table._before_delete.append(changed)